@@ -367,6 +367,10 @@ export interface EngineInput {
   // ✅ Inventario del plan (snapshot de resource_items -> plan_resource_items)
   planResourceItems: PlanResourceItemInput[];
 
+  // Pools de unidades intercambiables (p. ej. equipos de cámara) para CP-SAT: se modelan
+  // como capacidad y el servicio reparte después ids concretos. `capacity` <= nº de unidades.
+  resourcePools?: Array<{ id: number; resourceIds: number[]; capacity?: number }>;
+
   /** Legacy aggregate of coach plan-resource IDs; it does not preserve contestant assignments. */
   coachResourceIds?: number[];
 
@@ -552,6 +556,8 @@ export interface EngineOutput {
     startPlanned: string;
     endPlanned: string;
     assignedSpace?: number | null;
+    // Hueco (1..capacidad) dentro de un espacio con `spaceCapacityById` > 1; lo asigna CP-SAT.
+    assignedSpaceSlot?: number;
     assignedResources?: number[];
   }>;
   warnings?: EngineOutputWarning[];
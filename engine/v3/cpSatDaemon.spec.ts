@@ -0,0 +1,245 @@
+import assert from "node:assert/strict";
+import { EventEmitter } from "node:events";
+import { mkdtempSync, rmSync } from "node:fs";
+import net from "node:net";
+import os from "node:os";
+import path from "node:path";
+import { PassThrough } from "node:stream";
+import test from "node:test";
+import { CpSatDaemonClient, CpSatDaemonError } from "./cpSatDaemon";
+import { optimizeWithCpSatAsync } from "./cpSatOptimizer";
+import type { EngineOutput } from "../types";
+import type { EngineV3Input } from "./types";
+
+const input: EngineV3Input = {
+  planId: 322,
+  workDay: { start: "09:00", end: "10:00" },
+  meal: { start: "12:00", end: "12:30" },
+  camerasAvailable: 1,
+  tasks: [{ id: 1, planId: 322, templateId: 1, zoneId: 1, spaceId: 1, contestantId: 1, status: "pending", durationOverrideMin: 30 }] as any,
+  locks: [],
+  groupingZoneIds: [1],
+  zoneResourceAssignments: {},
+  spaceResourceAssignments: {},
+  zoneResourceTypeRequirements: {},
+  spaceResourceTypeRequirements: {},
+  planResourceItems: [],
+  resourceItemComponents: {},
+  contestantAvailabilityById: { 1: { start: "09:00", end: "10:00" } },
+  optimizerMainZoneId: 1,
+};
+
+const warmStart: EngineOutput = {
+  feasible: true,
+  complete: true,
+  hardFeasible: true,
+  plannedTasks: [{ taskId: 1, startPlanned: "09:00", endPlanned: "09:30" }],
+  unplanned: [],
+};
+
+const solvedDocument = (technicalDetails: string[]) => ({
+  outputDiff: { taskId: [1], startMin: [570], endMin: [600], assignedSpace: [1], assignedResources: [null], rows: 1, moved: 1 },
+  quality: { improved: true, baselineScore: 5, optimizedScore: 0, objectiveDelta: 5, mainZoneGapMinutesDelta: 0, spaceSwitchesDelta: 0 },
+  degradations: [],
+  message: "CP-SAT completado.",
+  technicalDetails,
+});
+
+// Minimal stand-in for `cp_sat_service.py --socket`: NDJSON in, NDJSON out, replies in completion order.
+const startFakeSocketDaemon = async (onMessage: (message: any, reply: (response: any) => void, hangUp: () => void) => void) => {
+  const dir = mkdtempSync(path.join(os.tmpdir(), "cp-sat-daemon-"));
+  const socketPath = path.join(dir, "cp-sat.sock");
+  const received: any[] = [];
+  const server = net.createServer((socket) => {
+    let buffer = "";
+    socket.setEncoding("utf-8");
+    socket.on("data", (chunk: string) => {
+      buffer += chunk;
+      let newline = buffer.indexOf("\n");
+      while (newline >= 0) {
+        const message = JSON.parse(buffer.slice(0, newline));
+        buffer = buffer.slice(newline + 1);
+        newline = buffer.indexOf("\n");
+        received.push(message);
+        onMessage(message, (response) => socket.write(`${JSON.stringify(response)}\n`), () => socket.destroy());
+      }
+    });
+  });
+  await new Promise<void>((resolve) => server.listen(socketPath, resolve));
+  return {
+    socketPath,
+    received,
+    close: () => {
+      server.close();
+      rmSync(dir, { recursive: true, force: true });
+    },
+  };
+};
+
+test("CpSatDaemonClient matches out-of-order replies and progress events by id over the socket", async () => {
+  const daemon = await startFakeSocketDaemon((message, reply) => {
+    const delay = message.payload?.label === "slow" ? 50 : 0;
+    if (message.payload?.stream) reply({ id: message.id, type: "progress", ok: true, objective: 10 });
+    setTimeout(() => reply({ id: message.id, type: "result", ok: true, result: { label: message.payload.label } }), delay);
+  });
+  const client = new CpSatDaemonClient({ socketPath: daemon.socketPath });
+  try {
+    const events: any[] = [];
+    const [slow, fast] = await Promise.all([
+      client.solve({ label: "slow", stream: true }, { timeoutMs: 2_000, onEvent: (event) => events.push(event) }),
+      client.solve({ label: "fast" }, { timeoutMs: 2_000 }),
+    ]);
+
+    assert.equal(slow.result.label, "slow");
+    assert.equal(fast.result.label, "fast");
+    assert.deepEqual(events.map((event) => event.objective), [10]);
+    assert.equal(daemon.received.length, 2);
+    assert.notEqual(daemon.received[0].id, daemon.received[1].id);
+    assert.equal(client.inFlight, 0);
+  } finally {
+    client.close();
+    daemon.close();
+  }
+});
+
+test("CpSatDaemonClient starts a --serve worker on stdio, waits for ready and reuses it", async () => {
+  const spawned: string[][] = [];
+  const fakeSpawn = ((_command: string, args: string[]) => {
+    spawned.push(args);
+    const child = Object.assign(new EventEmitter(), {
+      stdin: new PassThrough(),
+      stdout: new PassThrough(),
+      exitCode: null as number | null,
+      unref: () => undefined,
+      kill: () => {
+        child.exitCode = 0;
+        child.emit("exit", 0, null);
+        return true;
+      },
+    });
+    let buffer = "";
+    child.stdin.setEncoding("utf-8");
+    child.stdin.on("data", (chunk: string) => {
+      buffer += chunk;
+      const lines = buffer.split("\n");
+      buffer = lines.pop() ?? "";
+      for (const line of lines.filter(Boolean)) {
+        const message = JSON.parse(line);
+        child.stdout.write(`${JSON.stringify({ id: message.id, type: "result", ok: true, result: { pid: 4242 } })}\n`);
+      }
+    });
+    setImmediate(() => child.stdout.write(`${JSON.stringify({ id: null, type: "ready", ok: true })}\n`));
+    return child;
+  }) as any;
+
+  const client = new CpSatDaemonClient({ spawnProcess: fakeSpawn, scriptPath: "cp_sat_service.py" });
+  try {
+    const first = await client.solve({}, { timeoutMs: 1_000 });
+    const second = await client.solve({}, { timeoutMs: 1_000 });
+
+    assert.equal(first.result.pid, 4242);
+    assert.equal(second.result.pid, 4242);
+    assert.equal(spawned.length, 1);
+    assert.deepEqual(spawned[0].slice(0, 2), ["cp_sat_service.py", "--serve"]);
+  } finally {
+    client.close();
+  }
+});
+
+test("CpSatDaemonClient rejects pending requests when the daemon goes away or does not answer", async () => {
+  const daemon = await startFakeSocketDaemon((message, reply, hangUp) => {
+    if (message.type === "health") reply({ id: message.id, type: "health", ok: true, status: "ready" });
+    if (message.payload?.label === "crash") hangUp();
+  });
+  const client = new CpSatDaemonClient({ socketPath: daemon.socketPath });
+  try {
+    assert.equal((await client.health(1_000)).status, "ready");
+    await assert.rejects(
+      client.solve({ label: "silent" }, { timeoutMs: 50 }),
+      (error: unknown) => error instanceof CpSatDaemonError && error.code === "timeout",
+    );
+    await assert.rejects(
+      client.solve({ label: "crash" }, { timeoutMs: 5_000 }),
+      (error: unknown) => error instanceof CpSatDaemonError && error.code === "closed",
+    );
+    assert.equal(client.connected, false);
+    assert.equal(client.inFlight, 0);
+    // The next request reconnects to the same socket.
+    assert.equal((await client.health(1_000)).ok, true);
+  } finally {
+    client.close();
+    daemon.close();
+  }
+});
+
+test("optimizeWithCpSatAsync solves through the daemon without spawning python", async () => {
+  const daemon = await startFakeSocketDaemon((message, reply) => {
+    reply({ id: message.id, type: "result", ok: true, result: solvedDocument(["status=4"]) });
+  });
+  const client = new CpSatDaemonClient({ socketPath: daemon.socketPath });
+  let spawnedRuns = 0;
+  try {
+    const result = await optimizeWithCpSatAsync(input, warmStart, 2, {
+      daemon: client,
+      diffOnly: true,
+      runPython: async () => {
+        spawnedRuns += 1;
+        return { stdout: "", stderr: "", status: 1 };
+      },
+    });
+
+    assert.equal(spawnedRuns, 0);
+    assert.equal(daemon.received[0].type, "solve");
+    assert.equal(daemon.received[0].payload.responseMode, "diff");
+    assert.ok(Number.isFinite(daemon.received[0].payload.deadlineEpochMs));
+    assert.deepEqual(result.output.plannedTasks, [{ taskId: 1, startPlanned: "09:30", endPlanned: "10:00", assignedSpace: 1 }]);
+    assert.ok(result.technicalDetails.includes("status=4"));
+  } finally {
+    client.close();
+    daemon.close();
+  }
+});
+
+test("optimizeWithCpSatAsync falls back to a one-shot python run when the daemon is unreachable", async () => {
+  const dir = mkdtempSync(path.join(os.tmpdir(), "cp-sat-daemon-"));
+  const client = new CpSatDaemonClient({ socketPath: path.join(dir, "missing.sock") });
+  let sentPayload: any = null;
+  try {
+    const result = await optimizeWithCpSatAsync(input, warmStart, 2, {
+      daemon: client,
+      runPython: async (payload) => {
+        sentPayload = JSON.parse(payload);
+        return { stdout: JSON.stringify(solvedDocument([])), stderr: "", status: 0 };
+      },
+    });
+
+    assert.equal(sentPayload.timeLimitSeconds, 2);
+    assert.equal(result.noOptimized, undefined);
+    assert.equal(result.output.plannedTasks[0].startPlanned, "09:30");
+    assert.ok(result.technicalDetails.some((detail) => detail.startsWith("cp_sat_daemon_fallback=unavailable")));
+  } finally {
+    client.close();
+    rmSync(dir, { recursive: true, force: true });
+  }
+});
+
+test("optimizeWithCpSatAsync keeps Fase A when the daemon times out instead of solving twice", async () => {
+  const client = Object.assign(new CpSatDaemonClient(), {
+    solve: async () => {
+      throw new CpSatDaemonError("timeout", "cp_sat_daemon_timeout_ms=5000");
+    },
+  });
+  let spawnedRuns = 0;
+  const result = await optimizeWithCpSatAsync(input, warmStart, 0.5, {
+    daemon: client,
+    runPython: async () => {
+      spawnedRuns += 1;
+      return { stdout: "", stderr: "", status: 1 };
+    },
+  });
+
+  assert.equal(spawnedRuns, 0);
+  assert.equal(result.noOptimized, true);
+  assert.equal(result.output, warmStart);
+  assert.ok(result.technicalDetails.includes("cp_sat_daemon_timeout_ms=5000"));
+});
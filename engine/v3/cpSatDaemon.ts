@@ -0,0 +1,331 @@
+import { spawn, type ChildProcess } from "node:child_process";
+import net from "node:net";
+import path from "node:path";
+import type { Readable, Writable } from "node:stream";
+
+// Long-lived `cp_sat_service.py --serve` worker: OR-Tools is imported once and each solve is one NDJSON round trip.
+export type CpSatDaemonOptions = {
+  // Connects to `cp_sat_service.py --socket <path>`; without it the client starts its own `--serve` worker on stdio.
+  socketPath?: string;
+  // With `socketPath`, starts `--socket <path>` when nothing is listening there yet.
+  startIfMissing?: boolean;
+  maxConcurrency?: number;
+  python?: string;
+  scriptPath?: string;
+  // How long to wait for the worker's `ready` line or for a freshly started socket to accept connections.
+  readyTimeoutMs?: number;
+  spawnProcess?: typeof spawn;
+  connect?: (socketPath: string) => net.Socket;
+};
+
+export type CpSatDaemonResponse = {
+  id: string;
+  type: string;
+  ok: boolean;
+  result?: any;
+  error?: string;
+  [key: string]: unknown;
+};
+
+export type CpSatDaemonRequestOptions = {
+  timeoutMs: number;
+  // `progress` events of the same request (payloads with `stream: true`).
+  onEvent?: (event: CpSatDaemonResponse) => void;
+};
+
+// `code` tells the caller whether a one-shot spawn is still worth trying (`unavailable`, `closed`) or not (`timeout`).
+export class CpSatDaemonError extends Error {
+  constructor(readonly code: "unavailable" | "closed" | "timeout" | "protocol", message: string) {
+    super(message);
+    this.name = "CpSatDaemonError";
+  }
+}
+
+type Pending = {
+  resolve: (response: CpSatDaemonResponse) => void;
+  reject: (error: Error) => void;
+  onEvent?: (event: CpSatDaemonResponse) => void;
+  timer: NodeJS.Timeout;
+};
+
+type Connection = {
+  write: (line: string) => void;
+  close: () => void;
+};
+
+const DEFAULT_SCRIPT_PATH = path.resolve(process.cwd(), "engine/v3/python/cp_sat_service.py");
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export class CpSatDaemonClient {
+  private connection: Connection | null = null;
+  private connecting: Promise<Connection> | null = null;
+  private readonly pending = new Map<string, Pending>();
+  private nextId = 0;
+  private child: ChildProcess | null = null;
+
+  constructor(private readonly options: CpSatDaemonOptions = {}) {}
+
+  get connected(): boolean {
+    return this.connection !== null;
+  }
+
+  get inFlight(): number {
+    return this.pending.size;
+  }
+
+  /** Sends one message and resolves with its `result`/`health`/`shutdown` reply, matched by `id`. */
+  async request(
+    message: { type?: string; payload?: unknown },
+    { timeoutMs, onEvent }: CpSatDaemonRequestOptions,
+  ): Promise<CpSatDaemonResponse> {
+    const connection = await this.ensureConnection();
+    const id = `n${process.pid}-${++this.nextId}`;
+    return new Promise<CpSatDaemonResponse>((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new CpSatDaemonError("timeout", `cp_sat_daemon_timeout_ms=${timeoutMs}`));
+      }, timeoutMs);
+      this.pending.set(id, { resolve, reject, onEvent, timer });
+      try {
+        connection.write(`${JSON.stringify({ ...message, id })}\n`);
+      } catch (error) {
+        clearTimeout(timer);
+        this.pending.delete(id);
+        reject(new CpSatDaemonError("closed", String((error as Error)?.message || error)));
+      }
+    });
+  }
+
+  solve(payload: Record<string, unknown>, options: CpSatDaemonRequestOptions): Promise<CpSatDaemonResponse> {
+    return this.request({ type: "solve", payload }, options);
+  }
+
+  health(timeoutMs = 2_000): Promise<CpSatDaemonResponse> {
+    return this.request({ type: "health" }, { timeoutMs });
+  }
+
+  /** Stops the worker this client started (a shared socket daemon is only disconnected). */
+  close(): void {
+    this.fail(new CpSatDaemonError("closed", "cp_sat_daemon_closed_by_client"));
+    if (this.child && this.child.exitCode === null) {
+      this.child.kill("SIGTERM");
+    }
+    this.child = null;
+  }
+
+  private ensureConnection(): Promise<Connection> {
+    if (this.connection) return Promise.resolve(this.connection);
+    if (!this.connecting) {
+      const attempt = this.options.socketPath ? this.openSocket(this.options.socketPath) : this.startStdioWorker();
+      this.connecting = attempt
+        .then((connection) => {
+          this.connection = connection;
+          return connection;
+        })
+        .finally(() => {
+          this.connecting = null;
+        });
+    }
+    return this.connecting;
+  }
+
+  private spawnWorker(args: string[], stdio: "pipe" | "ignore"): ChildProcess {
+    const spawnProcess = this.options.spawnProcess ?? spawn;
+    const child = spawnProcess(
+      this.options.python ?? "python3",
+      [this.options.scriptPath ?? DEFAULT_SCRIPT_PATH, ...args, "--max-concurrency", String(this.options.maxConcurrency ?? 2)],
+      { stdio: [stdio, stdio, "inherit"] },
+    );
+    // The worker must not keep the Node process alive on its own; pending requests hold their own timers.
+    child.unref();
+    return child;
+  }
+
+  private startStdioWorker(): Promise<Connection> {
+    const child = this.spawnWorker(["--serve"], "pipe");
+    this.child = child;
+    const stdin = child.stdin as Writable;
+    const stdout = child.stdout as Readable;
+    (stdout as any).unref?.();
+    (stdin as any).unref?.();
+    return new Promise<Connection>((resolve, reject) => {
+      let ready = false;
+      const timer = setTimeout(() => {
+        if (!ready) {
+          child.kill("SIGTERM");
+          reject(new CpSatDaemonError("unavailable", "cp_sat_daemon_ready_timeout"));
+        }
+      }, this.options.readyTimeoutMs ?? 30_000);
+      const connection: Connection = {
+        write: (line) => {
+          stdin.write(line);
+        },
+        close: () => {
+          stdin.end();
+        },
+      };
+      this.readLines(stdout, (message) => {
+        if (!ready && message.type === "ready" && message.id == null) {
+          ready = true;
+          clearTimeout(timer);
+          resolve(connection);
+          return;
+        }
+        this.dispatch(message);
+      });
+      stdin.on("error", () => {
+        // EPIPE after the worker dies; `exit` below fails the pending requests.
+      });
+      child.once("error", (error: NodeJS.ErrnoException) => {
+        clearTimeout(timer);
+        this.dropConnection(connection, new CpSatDaemonError("unavailable", `python_spawn_error_code=${error.code ?? error.message}`));
+        reject(new CpSatDaemonError("unavailable", `python_spawn_error_code=${error.code ?? error.message}`));
+      });
+      child.once("exit", (code, signal) => {
+        clearTimeout(timer);
+        const error = new CpSatDaemonError(ready ? "closed" : "unavailable", `cp_sat_daemon_exit=${signal ?? code}`);
+        this.dropConnection(connection, error);
+        if (this.child === child) this.child = null;
+        reject(error);
+      });
+    });
+  }
+
+  private async openSocket(socketPath: string): Promise<Connection> {
+    try {
+      return await this.connectSocket(socketPath);
+    } catch (error) {
+      const code = (error as NodeJS.ErrnoException)?.code;
+      if (!this.options.startIfMissing || (code !== "ENOENT" && code !== "ECONNREFUSED")) {
+        throw new CpSatDaemonError("unavailable", `cp_sat_daemon_connect_error_code=${code ?? (error as Error)?.message}`);
+      }
+    }
+    if (!this.child || this.child.exitCode !== null) {
+      this.child = this.spawnWorker(["--socket", socketPath], "ignore");
+      this.child.once("error", () => {
+        this.child = null;
+      });
+    }
+    // The daemon creates the socket once OR-Tools is imported: poll until it accepts connections.
+    const deadline = Date.now() + (this.options.readyTimeoutMs ?? 30_000);
+    let lastCode = "ENOENT";
+    while (Date.now() < deadline) {
+      await sleep(100);
+      if (!this.child) break;
+      try {
+        return await this.connectSocket(socketPath);
+      } catch (error) {
+        lastCode = (error as NodeJS.ErrnoException)?.code ?? lastCode;
+      }
+    }
+    throw new CpSatDaemonError("unavailable", `cp_sat_daemon_connect_error_code=${lastCode}`);
+  }
+
+  private connectSocket(socketPath: string): Promise<Connection> {
+    const connect = this.options.connect ?? ((target: string) => net.createConnection(target));
+    return new Promise<Connection>((resolve, reject) => {
+      const socket = connect(socketPath);
+      const connection: Connection = {
+        write: (line) => {
+          socket.write(line);
+        },
+        close: () => {
+          socket.end();
+        },
+      };
+      socket.once("connect", () => {
+        socket.unref();
+        this.readLines(socket, (message) => this.dispatch(message));
+        socket.on("close", () => this.dropConnection(connection, new CpSatDaemonError("closed", "cp_sat_daemon_socket_closed")));
+        resolve(connection);
+      });
+      socket.on("error", (error) => {
+        reject(error);
+        this.dropConnection(connection, new CpSatDaemonError("closed", `cp_sat_daemon_socket_error=${(error as NodeJS.ErrnoException).code ?? error.message}`));
+      });
+    });
+  }
+
+  private readLines(stream: Readable, onMessage: (message: CpSatDaemonResponse) => void): void {
+    let buffer = "";
+    stream.setEncoding("utf-8");
+    stream.on("data", (chunk: string) => {
+      buffer += chunk;
+      let newline = buffer.indexOf("\n");
+      while (newline >= 0) {
+        const line = buffer.slice(0, newline).trim();
+        buffer = buffer.slice(newline + 1);
+        newline = buffer.indexOf("\n");
+        if (!line) continue;
+        try {
+          onMessage(JSON.parse(line));
+        } catch {
+          // A non-JSON line cannot be matched to any request; the request's own timeout handles it.
+        }
+      }
+    });
+  }
+
+  private dispatch(message: CpSatDaemonResponse): void {
+    const waiting = message.id != null ? this.pending.get(String(message.id)) : undefined;
+    if (!waiting) return;
+    if (message.type === "progress") {
+      waiting.onEvent?.(message);
+      return;
+    }
+    clearTimeout(waiting.timer);
+    this.pending.delete(String(message.id));
+    if (message.type === "error") {
+      waiting.reject(new CpSatDaemonError("protocol", String(message.error ?? "cp_sat_daemon_error")));
+      return;
+    }
+    waiting.resolve(message);
+  }
+
+  private dropConnection(connection: Connection, error: CpSatDaemonError): void {
+    if (this.connection !== connection) return;
+    this.fail(error);
+  }
+
+  private fail(error: CpSatDaemonError): void {
+    const connection = this.connection;
+    this.connection = null;
+    for (const [id, waiting] of this.pending) {
+      clearTimeout(waiting.timer);
+      this.pending.delete(id);
+      waiting.reject(error);
+    }
+    try {
+      connection?.close();
+    } catch {
+      // Already closed.
+    }
+  }
+}
+
+let sharedDaemon: CpSatDaemonClient | null | undefined;
+
+/**
+ * Process-wide client used by `optimizeWithCpSatAsync`.
+ *
+ * `CP_SAT_DAEMON=0` disables it (every solve spawns `python3` again); `CP_SAT_SOCKET`
+ * points it at a shared `--socket` daemon, started on first use if none is listening.
+ */
+export function getSharedCpSatDaemon(): CpSatDaemonClient | null {
+  if (sharedDaemon !== undefined) return sharedDaemon;
+  const mode = String(process.env.CP_SAT_DAEMON ?? "1").toLowerCase();
+  if (["0", "false", "off"].includes(mode)) {
+    sharedDaemon = null;
+    return sharedDaemon;
+  }
+  const socketPath = process.env.CP_SAT_SOCKET || undefined;
+  sharedDaemon = new CpSatDaemonClient({
+    socketPath,
+    startIfMissing: true,
+    maxConcurrency: Number(process.env.CP_SAT_MAX_CONCURRENCY) || undefined,
+  });
+  const daemon = sharedDaemon;
+  process.once("exit", () => daemon.close());
+  return sharedDaemon;
+}
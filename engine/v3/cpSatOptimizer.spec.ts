@@ -50,3 +50,98 @@ test("optimizeWithCpSat classifies missing python3 ENOENT without claiming OR-To
   assert.ok(result.technicalDetails.includes("python_spawn_error_code=ENOENT"));
   assert.ok(!result.technicalDetails.includes("ortools_import_failed"));
 });
+
+test("optimizeWithCpSat keeps the best-so-far document written before a timeout kill", () => {
+  const timedOut = Object.assign(new Error("spawnSync python3 ETIMEDOUT"), { code: "ETIMEDOUT" });
+  let sentPayload: any = null;
+  const result = optimizeWithCpSat(input, warmStart, 0.5, {
+    spawnPython: ((_command: string, _args: string[], options: any) => {
+      sentPayload = JSON.parse(options.input);
+      return {
+        pid: 0,
+        output: [],
+        stdout: JSON.stringify({
+          output: warmStart,
+          quality: { improved: false, baselineScore: 0, optimizedScore: 0, objectiveDelta: 0, mainZoneGapMinutesDelta: 0, spaceSwitchesDelta: 0 },
+          degradations: [],
+          message: "CP-SAT interrumpido; se devuelve el mejor incumbente.",
+          technicalDetails: ["cancelled=sigterm"],
+        }),
+        stderr: "",
+        status: 0,
+        signal: null,
+        error: timedOut,
+      };
+    }) as any,
+  });
+
+  assert.ok(Number.isFinite(sentPayload.deadlineEpochMs));
+  assert.equal(result.noOptimized, undefined);
+  assert.ok(result.technicalDetails.includes("cancelled=sigterm"));
+  assert.ok(result.technicalDetails.includes("python_timeout_best_so_far"));
+});
+
+test("optimizeWithCpSat forwards what-if scenarios in a single payload", () => {
+  let sentPayload: any = null;
+  const result = optimizeWithCpSat(input, warmStart, 2, {
+    scenarios: [{ id: "meal-late", overlay: { engineInput: { meal: { start: "12:30", end: "13:00" } } } }],
+    spawnPython: ((_command: string, _args: string[], options: any) => {
+      sentPayload = JSON.parse(options.input);
+      return {
+        pid: 0,
+        output: [],
+        stdout: JSON.stringify({
+          output: warmStart,
+          quality: { improved: false, baselineScore: 0, optimizedScore: 0, objectiveDelta: 0, mainZoneGapMinutesDelta: 0, spaceSwitchesDelta: 0 },
+          degradations: [],
+          message: "CP-SAT completado; se mantiene best-so-far.",
+          technicalDetails: ["batchScenarios=1"],
+          scenarios: [
+            { id: "base", score: { score: 0, gap: 0, switches: 0 }, deltaVsBase: { score: 0, gap: 0, switches: 0 } },
+            { id: "meal-late", score: { score: 5, gap: 0, switches: 1 }, deltaVsBase: { score: 5, gap: 0, switches: 1 } },
+          ],
+        }),
+        stderr: "",
+        status: 0,
+        signal: null,
+      };
+    }) as any,
+  });
+
+  assert.equal(sentPayload.scenarios.length, 1);
+  assert.equal(sentPayload.scenarios[0].id, "meal-late");
+  assert.deepEqual(result.scenarios?.map((scenario) => scenario.id), ["base", "meal-late"]);
+  assert.equal(result.scenarios?.[1].deltaVsBase?.score, 5);
+});
+
+test("optimizeWithCpSat sends columnar rows and rebuilds the output from a diff-only response", () => {
+  let sentPayload: any = null;
+  const result = optimizeWithCpSat(input, warmStart, 2, {
+    columnar: true,
+    diffOnly: true,
+    spawnPython: ((_command: string, _args: string[], options: any) => {
+      sentPayload = JSON.parse(options.input);
+      return {
+        pid: 0,
+        output: [],
+        stdout: JSON.stringify({
+          outputDiff: { taskId: [1], startMin: [570], endMin: [600], assignedSpace: [1], assignedResources: [null], rows: 1, moved: 1 },
+          quality: { improved: true, baselineScore: 5, optimizedScore: 0, objectiveDelta: 5, mainZoneGapMinutesDelta: 0, spaceSwitchesDelta: 0 },
+          degradations: [],
+          message: "CP-SAT completado.",
+          technicalDetails: [],
+        }),
+        stderr: "",
+        status: 0,
+        signal: null,
+      };
+    }) as any,
+  });
+
+  assert.equal(sentPayload.responseMode, "diff");
+  assert.equal(sentPayload.engineInput.tasks, undefined);
+  assert.deepEqual(sentPayload.engineInput.taskColumns.id, [1]);
+  assert.deepEqual(sentPayload.warmStart.plannedColumns, { taskId: [1], startMin: [540], endMin: [570] });
+  assert.deepEqual(result.output.plannedTasks, [{ taskId: 1, startPlanned: "09:30", endPlanned: "10:00", assignedSpace: 1 }]);
+  assert.equal(result.output.feasible, true);
+});
@@ -1,7 +1,8 @@
-import { spawnSync } from "node:child_process";
+import { spawn, spawnSync } from "node:child_process";
 import { existsSync } from "node:fs";
 import path from "node:path";
 import type { EngineOutput } from "../types";
+import { CpSatDaemonError, getSharedCpSatDaemon, type CpSatDaemonClient } from "./cpSatDaemon";
 import type { EngineV3Input } from "./types";
 
 export type CpSatOptimizationResult = {
@@ -18,6 +19,34 @@ export type CpSatOptimizationResult = {
   degradations: any[];
   message: string;
   technicalDetails: string[];
+  scenarios?: CpSatScenarioResult[];
+};
+
+// What-if variant: `overlay` is merged over the base payload (objects by key, everything else replaced).
+export type CpSatScenarioOverlay = {
+  id: string;
+  overlay: Record<string, unknown>;
+};
+
+export type CpSatScenarioResult = {
+  id: string;
+  score?: { score: number; gap: number; switches: number };
+  deltaVsBase?: { score: number; gap: number; switches: number };
+  result?: CpSatOptimizationResult;
+  error?: string;
+};
+
+// `responseMode: "diff"`: parallel columns for the rows the solver rewrote; everything else is the warm start.
+export type CpSatOutputDiff = {
+  taskId: number[];
+  startMin: number[];
+  endMin: number[];
+  assignedSpace: Array<number | null>;
+  assignedResources: Array<number[] | null>;
+  // Only present when some row sits in a multi-slot space (`spaceCapacityById`).
+  assignedSpaceSlot?: Array<number | null>;
+  rows: number;
+  moved: number;
 };
 
 const SCRIPT_PATH = path.resolve(process.cwd(), "engine/v3/python/cp_sat_service.py");
@@ -28,6 +57,49 @@ const toMinutes = (hhmm: string): number | null => {
   return h * 60 + m;
 };
 
+const toHHMM = (minutes: number): string =>
+  `${String(Math.floor(minutes / 60)).padStart(2, "0")}:${String(minutes % 60).padStart(2, "0")}`;
+
+// Column-per-key form of a row list; keys missing from a row travel as null.
+const toColumns = (rows: any[]): Record<string, unknown[]> => {
+  const columns: Record<string, unknown[]> = {};
+  rows.forEach((row, index) => {
+    for (const [key, value] of Object.entries(row ?? {})) {
+      if (value === undefined) continue;
+      if (!columns[key]) columns[key] = new Array(rows.length).fill(null);
+      columns[key][index] = value;
+    }
+  });
+  return columns;
+};
+
+const toPlannedColumns = (rows: any[]): Record<string, unknown[]> =>
+  toColumns(
+    rows.map(({ startPlanned, endPlanned, ...rest }) => ({
+      ...rest,
+      startMin: toMinutes(String(startPlanned)) ?? undefined,
+      endMin: toMinutes(String(endPlanned)) ?? undefined,
+    })),
+  );
+
+export const applyOutputDiff = (warmStart: EngineOutput, diff: CpSatOutputDiff): EngineOutput => {
+  const changed = new Map<number, any>();
+  diff.taskId.forEach((taskId, index) => {
+    const row: Record<string, unknown> = { startPlanned: toHHMM(diff.startMin[index]), endPlanned: toHHMM(diff.endMin[index]) };
+    if (diff.assignedSpace?.[index] != null) row.assignedSpace = diff.assignedSpace[index];
+    if (diff.assignedResources?.[index] != null) row.assignedResources = diff.assignedResources[index];
+    if (diff.assignedSpaceSlot?.[index] != null) row.assignedSpaceSlot = diff.assignedSpaceSlot[index];
+    changed.set(Number(taskId), row);
+  });
+  return {
+    ...warmStart,
+    plannedTasks: (warmStart.plannedTasks ?? []).map((row: any) => {
+      const patch = changed.get(Number(row?.taskId));
+      return patch ? { ...row, ...patch } : row;
+    }),
+  };
+};
+
 const scoreWarmStart = (input: EngineV3Input, warmStart: EngineOutput) => {
   const mainZoneId = Number((input as any)?.optimizerMainZoneId ?? NaN);
   const hasMainZone = Number.isFinite(mainZoneId) && mainZoneId > 0;
@@ -80,15 +152,43 @@ const scoreWarmStart = (input: EngineV3Input, warmStart: EngineOutput) => {
 export type CpSatOptimizationOptions = {
   movableTaskIds?: number[];
   pilotMode?: boolean;
+  // Solved side by side with the base in a single Python process under the same time limit.
+  scenarios?: CpSatScenarioOverlay[];
+  // Sends tasks and warm-start rows as parallel columns (smaller payload, faster parse on both sides).
+  columnar?: boolean;
+  // Asks only for the rewritten rows; the full output is rebuilt here from the warm start.
+  diffOnly?: boolean;
   spawnPython?: typeof spawnSync;
 };
 
-export function optimizeWithCpSat(
+export type CpSatAsyncOptimizationOptions = Omit<CpSatOptimizationOptions, "spawnPython"> & {
+  // Persistent worker; defaults to the process-wide one (`CP_SAT_DAEMON=0` disables it). `null` always spawns.
+  daemon?: CpSatDaemonClient | null;
+  // One-shot fallback when the daemon cannot be reached; defaults to a non-blocking `spawn`.
+  runPython?: (payload: string, timeoutMs: number) => Promise<PythonRun>;
+};
+
+// Outcome of one `python3 cp_sat_service.py` run, whether from `spawnSync` or the async runner.
+export type PythonRun = {
+  stdout: string;
+  stderr: string;
+  status: number | null;
+  error?: Error;
+};
+
+type CpSatRequest = {
+  payload: string;
+  timeoutMs: number;
+  baselineResult: (message: string, technicalDetails: string[]) => CpSatOptimizationResult;
+  withOutput: (parsed: any) => any;
+};
+
+const prepareRequest = (
   input: EngineV3Input,
   warmStart: EngineOutput,
   timeLimitSeconds: number,
-  options: CpSatOptimizationOptions = {},
-): CpSatOptimizationResult {
+  options: Omit<CpSatOptimizationOptions, "spawnPython">,
+): CpSatRequest => {
   const warmScore = scoreWarmStart(input, warmStart);
 
   const baselineResult = (message: string, technicalDetails: string[]): CpSatOptimizationResult => ({
@@ -107,24 +207,45 @@ export function optimizeWithCpSat(
     technicalDetails,
   });
 
-  if (!existsSync(SCRIPT_PATH)) {
-    return baselineResult("CP-SAT script no encontrado; se conserva Fase A.", ["cp_sat_script_missing"]);
-  }
-
+  const timeoutMs = Math.max(5_000, Math.round(timeLimitSeconds * 1000) + 3_000);
+  const { tasks, ...inputRest } = input as any;
+  const { plannedTasks, ...warmRest } = warmStart as any;
   const payload = JSON.stringify({
-    engineInput: input,
-    warmStart,
+    engineInput: options.columnar ? { ...inputRest, taskColumns: toColumns(tasks ?? []) } : input,
+    warmStart: options.columnar ? { ...warmRest, plannedColumns: toPlannedColumns(plannedTasks ?? []) } : warmStart,
+    responseMode: options.diffOnly ? "diff" : undefined,
     timeLimitSeconds,
     movableTaskIds: options.movableTaskIds,
     pilotMode: options.pilotMode ?? false,
+    scenarios: options.scenarios?.length ? options.scenarios : undefined,
+    // The service stops the search itself one second before the kill timeout.
+    deadlineEpochMs: Date.now() + timeoutMs - 1_000,
   });
 
-  const spawnPython = options.spawnPython ?? spawnSync;
-  const py = spawnPython("python3", [SCRIPT_PATH], {
-    input: payload,
-    encoding: "utf-8",
-    timeout: Math.max(5_000, Math.round(timeLimitSeconds * 1000) + 3_000),
-  });
+  const withOutput = (parsed: any) =>
+    parsed && !parsed.output && parsed.outputDiff
+      ? { ...parsed, output: applyOutputDiff(warmStart, parsed.outputDiff as CpSatOutputDiff), outputDiff: undefined }
+      : parsed;
+
+  return { payload, timeoutMs, baselineResult, withOutput };
+};
+
+const resultFromPythonRun = (request: CpSatRequest, py: PythonRun): CpSatOptimizationResult => {
+  const { baselineResult, withOutput } = request;
+  if (py.error && (py.error as NodeJS.ErrnoException).code === "ETIMEDOUT") {
+    // On SIGTERM the service writes the full document for its best incumbent before exiting.
+    try {
+      const parsed = withOutput(JSON.parse(String(py.stdout || "")));
+      if (parsed && parsed.output) {
+        return {
+          ...(parsed as CpSatOptimizationResult),
+          technicalDetails: [...(parsed.technicalDetails ?? []), "python_timeout_best_so_far"],
+        };
+      }
+    } catch {
+      // Fall through to the generic spawn error handling.
+    }
+  }
 
   if (py.error) {
     const code = (py.error as NodeJS.ErrnoException).code;
@@ -141,7 +262,7 @@ export function optimizeWithCpSat(
   }
 
   try {
-    const parsed = JSON.parse(String(py.stdout || "{}"));
+    const parsed = withOutput(JSON.parse(String(py.stdout || "{}")));
     if (!parsed || !parsed.output) {
       return baselineResult("Respuesta CP-SAT inválida; se conserva Fase A.", ["missing_output_in_cp_sat_response"]);
     }
@@ -150,4 +271,102 @@ export function optimizeWithCpSat(
     const stderr = String(py.stderr || "").trim();
     return baselineResult("No se pudo parsear salida CP-SAT; se conserva Fase A.", [String((error as Error)?.message || error), stderr].filter(Boolean));
   }
+};
+
+// Non-blocking one-shot run: same contract as `spawnSync` (SIGTERM at the timeout, reported as ETIMEDOUT).
+const runPythonAsync = (payload: string, timeoutMs: number): Promise<PythonRun> =>
+  new Promise((resolve) => {
+    const child = spawn("python3", [SCRIPT_PATH], { stdio: ["pipe", "pipe", "pipe"] });
+    const stdout: string[] = [];
+    const stderr: string[] = [];
+    let timedOut = false;
+    const timer = setTimeout(() => {
+      timedOut = true;
+      child.kill("SIGTERM");
+    }, timeoutMs);
+    child.stdout.setEncoding("utf-8").on("data", (chunk: string) => stdout.push(chunk));
+    child.stderr.setEncoding("utf-8").on("data", (chunk: string) => stderr.push(chunk));
+    child.stdin.on("error", () => {
+      // EPIPE if python3 dies before reading the payload; `close` reports the outcome.
+    });
+    child.once("error", (error) => {
+      clearTimeout(timer);
+      resolve({ stdout: stdout.join(""), stderr: stderr.join(""), status: null, error });
+    });
+    child.once("close", (status) => {
+      clearTimeout(timer);
+      const error = timedOut ? Object.assign(new Error("python3 ETIMEDOUT"), { code: "ETIMEDOUT" }) : undefined;
+      resolve({ stdout: stdout.join(""), stderr: stderr.join(""), status, error });
+    });
+    child.stdin.end(payload);
+  });
+
+export function optimizeWithCpSat(
+  input: EngineV3Input,
+  warmStart: EngineOutput,
+  timeLimitSeconds: number,
+  options: CpSatOptimizationOptions = {},
+): CpSatOptimizationResult {
+  const request = prepareRequest(input, warmStart, timeLimitSeconds, options);
+  if (!existsSync(SCRIPT_PATH)) {
+    return request.baselineResult("CP-SAT script no encontrado; se conserva Fase A.", ["cp_sat_script_missing"]);
+  }
+
+  const spawnPython = options.spawnPython ?? spawnSync;
+  const py = spawnPython("python3", [SCRIPT_PATH], {
+    input: request.payload,
+    encoding: "utf-8",
+    timeout: request.timeoutMs,
+  });
+  return resultFromPythonRun(request, {
+    stdout: String(py.stdout ?? ""),
+    stderr: String(py.stderr ?? ""),
+    status: py.status,
+    error: py.error,
+  });
+}
+
+/**
+ * Same contract as `optimizeWithCpSat` without blocking the event loop: the solve goes to the
+ * persistent worker (OR-Tools already imported) and only falls back to a one-shot `python3`
+ * when the worker cannot be started or reached. A worker timeout is not retried: the budget is spent.
+ */
+export async function optimizeWithCpSatAsync(
+  input: EngineV3Input,
+  warmStart: EngineOutput,
+  timeLimitSeconds: number,
+  options: CpSatAsyncOptimizationOptions = {},
+): Promise<CpSatOptimizationResult> {
+  const request = prepareRequest(input, warmStart, timeLimitSeconds, options);
+  const runPython = options.runPython ?? runPythonAsync;
+  if (!options.runPython && !existsSync(SCRIPT_PATH)) {
+    return request.baselineResult("CP-SAT script no encontrado; se conserva Fase A.", ["cp_sat_script_missing"]);
+  }
+
+  const daemon = options.daemon === undefined ? getSharedCpSatDaemon() : options.daemon;
+  let fallbackDetail: string | null = null;
+  if (daemon) {
+    try {
+      const response = await daemon.solve(JSON.parse(request.payload), { timeoutMs: request.timeoutMs });
+      if (!response.ok) {
+        return request.baselineResult("CP-SAT devolvió error de ejecución; se conserva Fase A.", [
+          String(response.error ?? "cp_sat_daemon_error"),
+        ]);
+      }
+      const parsed = request.withOutput(response.result);
+      if (!parsed || !parsed.output) {
+        return request.baselineResult("Respuesta CP-SAT inválida; se conserva Fase A.", ["missing_output_in_cp_sat_response"]);
+      }
+      return parsed as CpSatOptimizationResult;
+    } catch (error) {
+      const code = error instanceof CpSatDaemonError ? error.code : "protocol";
+      if (code === "timeout") {
+        return request.baselineResult("CP-SAT no respondió a tiempo; se conserva Fase A.", [String((error as Error).message)]);
+      }
+      fallbackDetail = `cp_sat_daemon_fallback=${code}:${(error as Error)?.message ?? error}`;
+    }
+  }
+
+  const result = resultFromPythonRun(request, await runPython(request.payload, request.timeoutMs));
+  return fallbackDetail ? { ...result, technicalDetails: [...(result.technicalDetails ?? []), fallbackDetail] } : result;
 }
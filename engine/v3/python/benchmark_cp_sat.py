@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Benchmark de escalado del servicio CP-SAT aislado del motor TS.
+
+Genera escenarios sintéticos con semilla (tareas, concursantes, espacios,
+recursos, densidad de dependencias y cuota de zona principal), mide cada fase
+de `cp_sat_service.py` en un proceso nuevo por ejecución y escribe un JSON
+comparable contra una línea base guardada.
+
+    python3 engine/v3/python/benchmark_cp_sat.py --sizes 25,100,500 --output out.json
+    python3 engine/v3/python/benchmark_cp_sat.py --sizes 25,100,500 --compare baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cp_sat_service as service  # noqa: E402
+
+DEFAULT_SIZES = [25, 50, 100, 250, 500, 1000, 2000]
+
+# Métricas comparadas contra la línea base: (clave, umbral absoluto mínimo para considerar ruido).
+REGRESSION_METRICS: List[Tuple[str, float]] = [
+    ("parseSeconds", 0.05),
+    ("buildSeconds", 0.05),
+    ("firstSolutionSeconds", 0.25),
+    ("peakRssMb", 16.0),
+    ("buildRssDeltaMb", 8.0),
+    ("variables", 0.0),
+    ("constraints", 0.0),
+    ("objective", 0.0),
+]
+
+
+def generate_scenario(
+    tasks: int,
+    seed: int = 1,
+    contestants: Optional[int] = None,
+    spaces: Optional[int] = None,
+    resources: Optional[int] = None,
+    dependency_density: float = 0.1,
+    main_zone_share: float = 0.4,
+    time_limit_seconds: float = 5.0,
+) -> Dict[str, Any]:
+    """Payload sintético con warm start factible construido por list scheduling.
+
+    Por defecto concursantes, espacios y recursos escalan con el número de
+    tareas para que el día siga siendo planificable. Las tareas que no caben en
+    la jornada se descartan, así que el payload puede tener menos tareas de las
+    pedidas (`scenario.tasks` informa las reales).
+    """
+    rnd = random.Random(seed)
+    contestants = contestants or max(2, tasks // 6)
+    spaces = spaces or max(2, tasks // 20)
+    resources = resources or max(1, tasks // 15)
+    main_spaces = max(1, round(spaces * main_zone_share))
+    grid = 5
+    work_start, work_end = 8 * 60, 23 * 60 + 55
+    meal_start, meal_end = 14 * 60, 14 * 60 + 45
+    horizon = (work_end - work_start) // grid
+    meal_slots = ((meal_start - work_start) // grid, (meal_end - work_start) // grid)
+
+    busy: Dict[Tuple[str, int], bytearray] = {}
+    ends_by_tid: Dict[int, int] = {}
+    engine_tasks: List[Dict[str, Any]] = []
+    planned: List[Dict[str, Any]] = []
+    for tid in range(1, tasks + 1):
+        space_id = rnd.randint(1, spaces)
+        dur_slots = rnd.choice([2, 3, 4, 6, 8, 12])
+        contestant_id = rnd.randint(1, contestants)
+        resource_ids = [100 + rnd.randint(1, resources)] if rnd.random() < 0.5 else []
+        depends_on = []
+        if ends_by_tid and rnd.random() < dependency_density:
+            depends_on = [rnd.choice(list(ends_by_tid))]
+        keys = [("space", space_id), ("contestant", contestant_id)] + [("resource", rid) for rid in resource_ids]
+        earliest = max([ends_by_tid[did] for did in depends_on] or [0])
+        start = None
+        for slot in range(earliest, horizon - dur_slots + 1):
+            if slot < meal_slots[1] and slot + dur_slots > meal_slots[0]:
+                continue
+            if all(not any(busy.setdefault(key, bytearray(horizon))[slot:slot + dur_slots]) for key in keys):
+                start = slot
+                break
+        if start is None:
+            continue
+        for key in keys:
+            busy[key][start:start + dur_slots] = b"\x01" * dur_slots
+        ends_by_tid[tid] = start + dur_slots
+        engine_tasks.append({
+            "id": tid,
+            "templateId": rnd.randint(1, 6),
+            "zoneId": 1 if space_id <= main_spaces else 2,
+            "spaceId": space_id,
+            "contestantId": contestant_id,
+            "status": "pending",
+            "durationOverrideMin": dur_slots * grid,
+            "dependsOnTaskIds": depends_on,
+        })
+        start_m = work_start + start * grid
+        planned.append({
+            "taskId": tid,
+            "startPlanned": service.to_hhmm(start_m),
+            "endPlanned": service.to_hhmm(start_m + dur_slots * grid),
+            "assignedResources": resource_ids,
+            "assignedSpace": space_id,
+        })
+
+    return {
+        "engineInput": {
+            "planId": seed,
+            "workDay": {"start": service.to_hhmm(work_start), "end": service.to_hhmm(work_end)},
+            "meal": {"start": service.to_hhmm(meal_start), "end": service.to_hhmm(meal_end)},
+            "tasks": engine_tasks,
+            "locks": [],
+            "optimizerMainZoneId": 1,
+            "contestantAvailabilityById": {},
+        },
+        "warmStart": {"feasible": True, "plannedTasks": planned, "unplanned": []},
+        "timeLimitSeconds": time_limit_seconds,
+    }
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Ejecuta un escenario y mide cada fase. Corre en un proceso propio (RSS aislado)."""
+    cp_model = service.load_cp_model()
+    payload = generate_scenario(**case["scenario"])
+    payload.update(case.get("payload") or {})
+    result: Dict[str, Any] = {
+        "name": case["name"],
+        "scenario": {**case["scenario"], "tasks": len(payload["engineInput"]["tasks"])},
+        "payload": case.get("payload") or {},
+    }
+    if cp_model is None:
+        return {**result, "error": "ortools_import_failed"}
+
+    started = time.perf_counter()
+    ctx, early = service.prepare_context(payload)
+    result["parseSeconds"] = round(time.perf_counter() - started, 4)
+    if ctx is None:
+        return {**result, "error": (early or {}).get("message", "prepare_context_failed")}
+
+    rss_before = service.current_rss_mb()
+    started = time.perf_counter()
+    build = service.build_model(cp_model, ctx)
+    result["buildSeconds"] = round(time.perf_counter() - started, 4)
+    rss_after = service.current_rss_mb()
+    result["buildRssDeltaMb"] = round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else None
+    result.update(service.model_counts(build.model))
+    result["hintComplete"] = bool(build.hint.get("complete"))
+    result["hintFeasible"] = bool(build.hint.get("feasible"))
+
+    first_solution: List[float] = []
+    solve_started = time.perf_counter()
+
+    class FirstSolution(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self) -> None:
+            if not first_solution:
+                first_solution.append(time.perf_counter() - solve_started)
+
+    # Misma configuración que el servicio (`tune_solver_config`); `--workers` solo fija los workers si se pasa.
+    tuning_payload = {**ctx.payload, "numSearchWorkers": case["numWorkers"]} if case.get("numWorkers") else ctx.payload
+    solver, config = service.tuned_solver(cp_model, tuning_payload, build, ctx.time_limit_seconds)
+    result["solverConfig"] = {key: config[key] for key in ["workers", "useLns", "linearizationLevel", "presolve", "sizeClass"]}
+    status = service.run_solver(solver, build.model, FirstSolution())
+    result["solveSeconds"] = round(time.perf_counter() - solve_started, 4)
+    result["status"] = solver.StatusName(status)
+    result["firstSolutionSeconds"] = round(first_solution[0], 4) if first_solution else None
+    if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        result["objective"] = solver.ObjectiveValue()
+        result["bestBound"] = solver.BestObjectiveBound()
+        solved = service.assemble_result(
+            ctx, {tid: int(solver.Value(var)) for tid, var in build.start_vars.items()}, [], [], []
+        )
+        result["quality"] = solved["quality"]
+    else:
+        result["objective"] = None
+    result["peakRssMb"] = service.peak_rss_mb()
+    return result
+
+
+def run_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Lanza `run_case` en un proceso nuevo para que `peakRssMb` no arrastre ejecuciones previas."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, case).result()
+
+
+def build_cases(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    payload = json.loads(args.payload) if args.payload else {}
+    cases = []
+    for size in args.sizes:
+        for seed in args.seeds:
+            scenario = {
+                "tasks": size,
+                "seed": seed,
+                "dependency_density": args.dependency_density,
+                "main_zone_share": args.main_zone_share,
+                "time_limit_seconds": args.time_limit,
+            }
+            cases.append({
+                "name": f"n{size}-seed{seed}",
+                "scenario": scenario,
+                "payload": payload,
+                "numWorkers": args.workers,
+            })
+    return cases
+
+
+def compare_runs(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+) -> List[Dict[str, Any]]:
+    """Métricas que empeoran más de `tolerance` (relativo) y del umbral absoluto respecto a la base."""
+    baseline_by_name = {run["name"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in current.get("runs", []):
+        base = baseline_by_name.get(run["name"])
+        if base is None:
+            continue
+        if base.get("status") in ["OPTIMAL", "FEASIBLE"] and run.get("status") not in ["OPTIMAL", "FEASIBLE"]:
+            regressions.append({"name": run["name"], "metric": "status", "baseline": base.get("status"), "current": run.get("status")})
+        for metric, absolute in REGRESSION_METRICS:
+            before, after = base.get(metric), run.get(metric)
+            if before is None or after is None:
+                if before is not None and after is None:
+                    regressions.append({"name": run["name"], "metric": metric, "baseline": before, "current": None})
+                continue
+            if after > before * (1 + tolerance) and after - before > absolute:
+                regressions.append({
+                    "name": run["name"],
+                    "metric": metric,
+                    "baseline": before,
+                    "current": after,
+                    "ratio": round(after / before, 3) if before else None,
+                })
+    return regressions
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark de escalado de cp_sat_service.py")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",") if x], default=DEFAULT_SIZES)
+    parser.add_argument("--seeds", type=lambda v: [int(x) for x in v.split(",") if x], default=[1])
+    parser.add_argument("--dependency-density", type=float, default=0.1)
+    parser.add_argument("--main-zone-share", type=float, default=0.4)
+    parser.add_argument("--time-limit", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, help="Workers de búsqueda (por defecto, los de `tune_solver_config`)")
+    parser.add_argument("--payload", help="JSON con campos extra del payload (p. ej. '{\"occupancyEncoding\": \"compact\"}')")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto stdout)")
+    parser.add_argument("--compare", help="JSON de resultados previo usado como línea base")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento relativo permitido (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cp_model = service.load_cp_model()
+    results: Dict[str, Any] = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "ortools": getattr(sys.modules.get("ortools"), "__version__", None) if cp_model is not None else None,
+        "cpus": service.available_cpus(),
+        "runs": [],
+    }
+    for case in build_cases(args):
+        run = run_isolated(case)
+        results["runs"].append(run)
+        print(
+            f"{run['name']}: tasks={run['scenario']['tasks']} parse={run.get('parseSeconds')}s build={run.get('buildSeconds')}s buildRss=+{run.get('buildRssDeltaMb')}MB "
+            f"vars={run.get('variables')} cts={run.get('constraints')} first={run.get('firstSolutionSeconds')}s "
+            f"status={run.get('status')} objective={run.get('objective')} rss={run.get('peakRssMb')}MB",
+            file=sys.stderr,
+        )
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions = compare_runs(results, baseline, args.tolerance)
+        results["comparison"] = {"baseline": args.compare, "tolerance": args.tolerance, "regressions": regressions}
+        for item in regressions:
+            print(f"REGRESIÓN {item['name']} {item['metric']}: {item['baseline']} -> {item['current']}", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    document = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(document + "\n")
+    else:
+        print(document)
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,344 @@
+"""Caché de resultados en disco (`cacheDir`) y captura de peticiones para reproducción offline (`capture`).
+
+Las dos capas envuelven el solve de `cp_sat_service.py` sin cambiarlo: la caché
+decide si hace falta resolver y con qué hint, y la captura guarda petición,
+modelo, parámetros y respuesta para `replay_cp_sat.py`.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import cp_sat_service as service
+
+# Campos del payload que no cambian la solución pedida y no forman parte de la clave de caché.
+CACHE_KEY_IGNORED_FIELDS = [
+    "timeLimitSeconds",
+    "deadlineEpochMs",
+    "stream",
+    "checkpointPath",
+    "checkpointIntervalSeconds",
+    "profileDumpPath",
+    "profileModelKinds",
+    "cache",
+    "cacheDir",
+    "cacheMaxBytes",
+    "cacheMaxAgeSeconds",
+    "reuseModel",
+    "capture",
+]
+
+
+def request_cache_key(payload: Dict[str, Any]) -> str:
+    """SHA-256 del payload normalizado (claves ordenadas, ids movibles ordenados, sin campos operativos).
+
+    Cualquier campo nuevo del payload forma parte de la clave salvo que se
+    añada a `CACHE_KEY_IGNORED_FIELDS`.
+    """
+    normalized = {key: value for key, value in payload.items() if key not in CACHE_KEY_IGNORED_FIELDS}
+    normalized["movableTaskIds"] = sorted({int(v) for v in (payload.get("movableTaskIds") or [])})
+    normalized["pilotMode"] = bool(payload.get("pilotMode"))
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ResultCache:
+    """Caché LRU en disco de documentos de salida, un fichero JSON por clave.
+
+    El orden LRU es el `mtime` de cada fichero (se actualiza en cada acierto);
+    al guardar se expulsan las entradas más antiguas que `max_age_seconds` y
+    después las menos usadas hasta quedar por debajo de `max_bytes`. Es segura
+    entre procesos: escrituras atómicas y borrados tolerantes a carreras.
+    """
+    directory: str
+    max_bytes: int = 64 * 1024 * 1024
+    max_age_seconds: float = 24 * 3600.0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.max_age_seconds:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as handle:
+                entry = json.load(handle)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        entry["ageSeconds"] = round(time.time() - float(entry.get("storedAt") or time.time()), 3)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        service.write_checkpoint(self.path(key), {**entry, "storedAt": time.time()})
+        self.evict()
+
+    def evict(self) -> None:
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.max_age_seconds:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def result_cache_for(payload: Dict[str, Any]) -> Optional[ResultCache]:
+    """Caché configurada por `cacheDir` o `CP_SAT_CACHE_DIR`; None si no hay o `cache: false`."""
+    directory = payload.get("cacheDir") or os.environ.get("CP_SAT_CACHE_DIR")
+    if not directory or payload.get("cache") is False:
+        return None
+    return ResultCache(
+        directory=str(directory),
+        max_bytes=int(payload.get("cacheMaxBytes") or os.environ.get("CP_SAT_CACHE_MAX_BYTES") or 64 * 1024 * 1024),
+        max_age_seconds=float(payload.get("cacheMaxAgeSeconds") or os.environ.get("CP_SAT_CACHE_MAX_AGE_SECONDS") or 24 * 3600),
+    )
+
+
+# Campos que no se guardan en `request.json`: son operativos y no cambian el problema.
+CAPTURE_IGNORED_FIELDS = [
+    "deadlineEpochMs",
+    "stream",
+    "checkpointPath",
+    "checkpointIntervalSeconds",
+    "profileDumpPath",
+    "cacheDir",
+    "capture",
+]
+
+
+@dataclass
+class CaptureConfig:
+    """Captura de peticiones para reproducirlas offline con `replay_cp_sat.py`.
+
+    Cada captura es un directorio con `request.json` (payload normalizado),
+    `response.json`, `meta.json` y, si hubo solve monolítico, `model.pb`
+    (CpModelProto binario) y `parameters.txt` (SatParameters en texto). Se
+    guardan las peticiones muestreadas con `sample_rate`, las que acaban en
+    Fase A (`on_fallback`) y las que superan `slow_seconds`. Al guardar se
+    expulsan las más antiguas hasta quedar por debajo de `max_captures` y `max_bytes`.
+    """
+    directory: str
+    sample_rate: float = 0.0
+    slow_seconds: Optional[float] = None
+    on_fallback: bool = True
+    max_bytes: int = 256 * 1024 * 1024
+    max_captures: int = 200
+
+    def evict(self) -> None:
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name == ".staging":
+                    # Restos de peticiones interrumpidas antes de decidir la captura.
+                    for stale in os.listdir(path):
+                        stale_path = os.path.join(path, stale)
+                        if now - os.stat(stale_path).st_mtime > 3600:
+                            shutil.rmtree(stale_path, ignore_errors=True)
+                    continue
+                if not os.path.isdir(path):
+                    continue
+                files = [os.path.join(path, item) for item in os.listdir(path)]
+                size = sum(os.path.getsize(item) for item in files)
+                entries.append((os.stat(path).st_mtime, size, path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes and count <= self.max_captures:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            count -= 1
+
+
+@dataclass
+class PendingCapture:
+    """Captura en curso de una petición: el modelo se exporta a `staging` durante el solve."""
+    config: CaptureConfig
+    sampled: bool
+    staging: Optional[str] = None
+    error: Optional[str] = None
+
+
+def capture_config_for(payload: Dict[str, Any]) -> Optional[CaptureConfig]:
+    """Captura configurada por `capture` (objeto o `true`) o por `CP_SAT_CAPTURE_*`; None si no hay o `capture: false`.
+
+    Con `capture: true` y sin `sampleRate` se captura la petición siempre; con
+    solo las variables de entorno, por defecto solo los fallbacks.
+    """
+    option = payload.get("capture")
+    if option is False:
+        return None
+    options = option if isinstance(option, dict) else {}
+    directory = options.get("dir") or os.environ.get("CP_SAT_CAPTURE_DIR")
+    if not directory:
+        return None
+    default_rate = 1.0 if option is True or isinstance(option, dict) else 0.0
+    slow_seconds = options.get("slowSeconds") or os.environ.get("CP_SAT_CAPTURE_SLOW_SECONDS")
+    return CaptureConfig(
+        directory=str(directory),
+        sample_rate=float(options.get("sampleRate", os.environ.get("CP_SAT_CAPTURE_SAMPLE_RATE") or default_rate)),
+        slow_seconds=float(slow_seconds) if slow_seconds else None,
+        on_fallback=bool(options.get("onFallback", True)),
+        max_bytes=int(options.get("maxBytes") or os.environ.get("CP_SAT_CAPTURE_MAX_BYTES") or 256 * 1024 * 1024),
+        max_captures=int(options.get("maxCaptures") or os.environ.get("CP_SAT_CAPTURE_MAX_CAPTURES") or 200),
+    )
+
+
+def stage_capture_model(profile: service.RequestProfile, model: Any, solver: Any, solved: bool) -> None:
+    """Exporta modelo y parámetros del solve si la petición ya cumple algún criterio de captura.
+
+    Se hace dentro del solve porque al terminar el modelo puede haber vuelto al
+    almacén de `reuseModel` y estar parcheándose para otra petición.
+    """
+    pending = profile.capture
+    if pending is None:
+        return
+    config = pending.config
+    slow = config.slow_seconds is not None and time.perf_counter() - profile.started >= config.slow_seconds
+    if not (pending.sampled or slow or (config.on_fallback and not solved)):
+        return
+    staging = os.path.join(config.directory, ".staging", uuid.uuid4().hex)
+    try:
+        os.makedirs(staging, exist_ok=True)
+        if not model.ExportToFile(os.path.join(staging, "model.pb")):
+            raise OSError("model_export_failed")
+        with open(os.path.join(staging, "parameters.txt"), "w", encoding="utf-8") as handle:
+            handle.write(str(solver.parameters) + "\n")
+        pending.staging = staging
+    except OSError as error:
+        shutil.rmtree(staging, ignore_errors=True)
+        pending.error = f"{type(error).__name__}: {error}"
+
+
+def finish_capture(profile: service.RequestProfile, payload: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Guarda la captura si la petición se muestreó, cayó a Fase A o fue lenta; si no, descarta lo preparado."""
+    pending = profile.capture
+    if pending is None:
+        return
+    config = pending.config
+    total_seconds = time.perf_counter() - profile.started
+    reasons = []
+    if (result.get("cache") or {}).get("status") != "hit":
+        if pending.sampled:
+            reasons.append("sampled")
+        # Todas las respuestas de `baseline_result` del servicio lo dicen en el mensaje.
+        if config.on_fallback and "Fase A" in str(result.get("message") or ""):
+            reasons.append("fallback")
+        if config.slow_seconds is not None and total_seconds >= config.slow_seconds:
+            reasons.append("slow")
+    if not reasons:
+        if pending.staging:
+            shutil.rmtree(pending.staging, ignore_errors=True)
+        return
+    key = request_cache_key(payload)
+    path = os.path.join(config.directory, f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{key[:12]}-{uuid.uuid4().hex[:6]}")
+    try:
+        if pending.staging:
+            os.rename(pending.staging, path)
+        else:
+            os.makedirs(path)
+        request = {key: value for key, value in payload.items() if key not in CAPTURE_IGNORED_FIELDS}
+        meta = {
+            "capturedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "reasons": reasons,
+            "cacheKey": key,
+            "model": bool(pending.staging),
+            "modelError": pending.error,
+            "python": sys.version.split()[0],
+            "ortools": getattr(sys.modules.get("ortools"), "__version__", None),
+            "totalSeconds": round(total_seconds, 4),
+            "solver": profile.solver,
+        }
+        for name, document in (("request.json", request), ("response.json", result), ("meta.json", meta)):
+            with open(os.path.join(path, name), "w", encoding="utf-8") as handle:
+                json.dump(document, handle, ensure_ascii=False, sort_keys=True)
+        config.evict()
+    except OSError as error:
+        result["technicalDetails"] = [*result.get("technicalDetails", []), f"captureWriteError={type(error).__name__}"]
+        return
+    result["capture"] = {"path": path, "reasons": reasons}
+    result["technicalDetails"] = [*result.get("technicalDetails", []), f"capture={'+'.join(reasons)}"]
+
+
+def solve_cached(
+    payload: Dict[str, Any],
+    emit: Optional[Any],
+    profile: service.RequestProfile,
+    base: Optional[service.BatchBase] = None,
+) -> Dict[str, Any]:
+    """Capa de caché de resultados sobre `solve_uncached`.
+
+    Un acierto con presupuesto igual o menor devuelve el documento guardado sin
+    resolver; con más presupuesto, la solución guardada se usa como hint y el
+    nuevo resultado sustituye a la entrada.
+    """
+    cache = result_cache_for(payload)
+    time_limit_seconds = float(payload.get("timeLimitSeconds") or 0)
+    if cache is None or time_limit_seconds <= 0:
+        return service.solve_uncached(payload, emit, profile, base=base)
+
+    with profile.phase("cache"):
+        key = request_cache_key(payload)
+        entry = cache.get(key)
+    info: Dict[str, Any] = {"status": "miss", "key": key}
+    hint_plan = None
+    if entry is not None:
+        info.update({"ageSeconds": entry["ageSeconds"], "storedTimeLimitSeconds": entry.get("timeLimitSeconds")})
+        if float(entry.get("timeLimitSeconds") or 0) >= time_limit_seconds:
+            result = dict(entry["result"])
+            result["cache"] = {**info, "status": "hit"}
+            result["technicalDetails"] = [*result.get("technicalDetails", []), "cache=hit", f"cacheAgeS={entry['ageSeconds']:.3f}"]
+            return result
+        info["status"] = "hint"
+        hint_plan = list(((entry["result"].get("output") or {}).get("plannedTasks")) or [])
+
+    result = service.solve_uncached(payload, emit, profile, hint_plan, base)
+    result["cache"] = info
+    result["technicalDetails"] = [*result.get("technicalDetails", []), f"cache={info['status']}"]
+    # Se guarda cualquier resultado de un solve (también `lns` o una Fase A tras INFEASIBLE); nunca las salidas tempranas.
+    if profile.outcome is not None and service.cancel_reason() is None:
+        effective_limit = time_limit_seconds
+        for detail in result.get("technicalDetails", []):
+            if detail.startswith("deadlineClampedTimeLimitS="):
+                effective_limit = float(detail.split("=", 1)[1])
+        stored = {key: value for key, value in result.items() if key not in ["cache", "profile"]}
+        stored["technicalDetails"] = [d for d in stored.get("technicalDetails", []) if not d.startswith("cache=")]
+        with profile.phase("cache"):
+            try:
+                cache.put(key, {"key": key, "timeLimitSeconds": effective_limit, "result": stored})
+            except OSError as error:
+                result["technicalDetails"].append(f"cacheWriteError={type(error).__name__}")
+    return result
@@ -0,0 +1,627 @@
+"""Resolución por partes del modelo completo: componentes independientes (`decompose`) y LNS (`lns`).
+
+Los sub-solves pesados se mandan al pool de procesos de `cp_sat_service.py`;
+las funciones que recibe el pool (`solve_component`, `solve_lns_remote`) viven
+aquí y se importan por nombre de módulo en cada proceso.
+"""
+from __future__ import annotations
+
+import random
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import replace
+from typing import Any, Dict, List, Optional, Tuple
+
+import cp_sat_service as service
+
+
+def conflict_components(ctx: service.SolveContext) -> List[List[int]]:
+    """Componentes conexos de las tareas movibles.
+
+    Dos tareas movibles quedan unidas si comparten espacio, concursante,
+    recurso o dependencia. Las tareas fijas no unen componentes: son
+    intervalos constantes del entorno de cada componente. Las tareas movibles
+    de zona principal se agrupan en un solo componente porque la ocupación
+    de la zona acopla sus posiciones.
+    """
+    movable = ctx.movable_task_ids()
+    parent = {tid: tid for tid in movable}
+
+    def find(tid: int) -> int:
+        while parent[tid] != tid:
+            parent[tid] = parent[parent[tid]]
+            tid = parent[tid]
+        return tid
+
+    def union(a: int, b: int) -> None:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    first_by_group: Dict[Tuple[str, int], int] = {}
+    for tid in movable:
+        spec = ctx.specs[tid]
+        keys: List[Tuple[str, int]] = [("resource", rid) for rid in spec.resource_ids]
+        if spec.space_id > 0:
+            keys.append(("space", spec.space_id))
+        if spec.contestant_id > 0:
+            keys.append(("contestant", spec.contestant_id))
+        if ctx.main_zone_id > 0 and spec.zone_id == ctx.main_zone_id:
+            keys.append(("mainZone", ctx.main_zone_id))
+        keys.extend(key for key in spec.cumulative_demands if key not in keys)
+        for key in keys:
+            if key in first_by_group:
+                union(tid, first_by_group[key])
+            else:
+                first_by_group[key] = tid
+        for did in spec.depends_on:
+            if did in parent:
+                union(tid, did)
+
+    components: Dict[int, List[int]] = {}
+    for tid in movable:
+        components.setdefault(find(tid), []).append(tid)
+    return sorted(components.values(), key=lambda tids: (-len(tids), tids[0]))
+
+
+def component_environment(ctx: service.SolveContext, component: List[int]) -> List[int]:
+    """Tareas fijas que comparten grupo NoOverlap o dependencia con el componente."""
+    members = set(component)
+    keys = set()
+    depends = set()
+    for tid in component:
+        spec = ctx.specs[tid]
+        keys.update(("resource", rid) for rid in spec.resource_ids)
+        if spec.space_id > 0:
+            keys.add(("space", spec.space_id))
+        if spec.contestant_id > 0:
+            keys.add(("contestant", spec.contestant_id))
+        keys.update(spec.cumulative_demands)
+        depends.update(spec.depends_on)
+    environment = []
+    for tid, spec in ctx.specs.items():
+        if tid in members or not spec.fixed:
+            continue
+        spec_keys = {("resource", rid) for rid in spec.resource_ids}
+        if spec.space_id > 0:
+            spec_keys.add(("space", spec.space_id))
+        if spec.contestant_id > 0:
+            spec_keys.add(("contestant", spec.contestant_id))
+        spec_keys.update(spec.cumulative_demands)
+        if tid in depends or not keys.isdisjoint(spec_keys) or not members.isdisjoint(spec.depends_on):
+            environment.append(tid)
+    return environment
+
+
+def component_context(ctx: service.SolveContext, task_ids: List[int]) -> service.SolveContext:
+    """Copia de `ctx` reducida a `task_ids`: lo que `build_model` necesita en el proceso del pool.
+
+    Sin `engineInput`, `warmStart` ni la tabla del plan, para no volver a
+    parsear y preprocesar el payload completo en cada componente.
+    """
+    selected = set(task_ids)
+    return replace(
+        ctx,
+        payload={key: value for key, value in ctx.payload.items() if key not in ["engineInput", "warmStart"]},
+        engine_input={},
+        warm={},
+        warm_planned=[],
+        tasks_by_id={},
+        warm_by_id={tid: row for tid, row in ctx.warm_by_id.items() if tid in selected},
+        specs={tid: spec for tid, spec in ctx.specs.items() if tid in selected},
+        details=[],
+        report={},
+        plan_table=None,
+        profile=None,
+        hint_starts={tid: slot for tid, slot in ctx.hint_starts.items() if tid in selected},
+    )
+
+
+def solve_component(
+    ctx: service.SolveContext,
+    time_limit_seconds: float,
+    deadline_epoch: float,
+    num_workers: int,
+    near_hard_breaks_max: int,
+) -> Dict[str, Any]:
+    """Resuelve un componente en un proceso del pool y devuelve solo inicios por tarea.
+
+    El límite se recorta al tiempo que queda hasta `deadline_epoch` cuando el
+    componente empieza: si esperó en cola más de la cuenta, no se resuelve.
+    """
+    with service.request_scope():
+        cp_model = service.load_cp_model()
+        if cp_model is None:
+            return {"status": "ORTOOLS_UNAVAILABLE", "starts": {}, "broken": []}
+        build = service.build_model(cp_model, ctx, None, near_hard_breaks_max)
+        limit = min(float(time_limit_seconds), deadline_epoch - time.time())
+        if limit <= 0:
+            return {"status": "DEADLINE", "starts": {}, "broken": []}
+        solver, _config = service.tuned_solver(cp_model, ctx.payload, build, limit, num_workers)
+        # `deterministic` amplía el límite de pared; nunca más allá del deadline compartido.
+        solver.parameters.max_time_in_seconds = min(solver.parameters.max_time_in_seconds, limit)
+        status = service.run_solver(solver, build.model)
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            return {"status": solver.StatusName(status), "starts": {}, "broken": [], "wallTime": solver.WallTime()}
+        return {
+            "status": solver.StatusName(status),
+            "starts": {tid: int(solver.Value(build.start_vars[tid])) for tid in build.movable_task_ids},
+            "broken": [tid for tid, b in build.degrade_bools if solver.Value(b) == 1],
+            "wallTime": solver.WallTime(),
+        }
+
+
+# Espera extra sobre el deadline de los componentes antes de dar uno por perdido (serialización y arranque del proceso).
+COMPONENT_RESULT_GRACE_SECONDS = 1.0
+
+
+def split_near_hard_budget(ctx: service.SolveContext, components: List[List[int]]) -> List[int]:
+    """Reparte `optimizerNearHardBreaksMax` entre componentes según sus tareas nivel 10."""
+    counts = [sum(1 for tid in component if ctx.specs[tid].near_hard) for component in components]
+    total = sum(counts)
+    budget = ctx.near_hard_breaks_max
+    if total == 0 or budget == 0:
+        return [0 for _ in components]
+    shares = [(budget * count) // total for count in counts]
+    leftover = budget - sum(shares)
+    for idx in sorted(range(len(components)), key=lambda i: -counts[i]):
+        if leftover <= 0:
+            break
+        if counts[idx] > shares[idx]:
+            shares[idx] += 1
+            leftover -= 1
+    return shares
+
+
+def solve_decomposed(cp_model: Any, ctx: service.SolveContext, emit: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+    """Resuelve cada componente independiente en paralelo y fusiona los inicios.
+
+    Devuelve None si no hay al menos dos componentes, para usar el solve monolítico.
+    Con `emit`, publica un evento `progress` por componente terminado.
+    """
+    components = conflict_components(ctx)
+    if len(components) < 2:
+        return None
+
+    payload = ctx.payload
+    total_budget = ctx.time_limit_seconds
+    remaining_deadline = service.remaining_until_deadline(payload)
+    if remaining_deadline is not None:
+        total_budget = min(total_budget, remaining_deadline)
+        if total_budget <= 0:
+            return None
+    coordination_share = float(payload.get("decomposeCoordinationShare", 0.2) or 0)
+    coordination_share = max(0.0, min(0.5, coordination_share))
+    component_budget = total_budget * (1.0 - coordination_share)
+    cpus = service.available_cpus()
+    max_workers = int(payload.get("decomposeMaxWorkers") or cpus)
+    pool_size = max(1, min(max_workers, cpus, len(components)))
+    search_workers = max(1, cpus // pool_size)
+    total_size = sum(len(component) for component in components)
+    breaks = split_near_hard_budget(ctx, components)
+
+    started = time.monotonic()
+    # Los componentes que no caben en el pool esperan en cola: todos comparten el
+    # mismo deadline de pared y cada uno recorta su límite al empezar.
+    component_deadline = time.time() + component_budget
+    pool = service.get_process_pool(pool_size)
+    futures = []
+    for component, component_breaks in zip(components, breaks):
+        part = component_context(ctx, component + component_environment(ctx, component))
+        budget = min(component_budget, component_budget * pool_size * len(component) / total_size)
+        futures.append(pool.submit(solve_component, part, budget, component_deadline, search_workers, component_breaks))
+
+    solved_starts: Dict[int, int] = {}
+    broken_tids: List[int] = []
+    statuses: List[str] = []
+    for component, future in zip(components, futures):
+        try:
+            result = future.result(timeout=max(0.0, component_deadline - time.time()) + COMPONENT_RESULT_GRACE_SECONDS)
+        except FutureTimeoutError:
+            future.cancel()
+            result = {"status": "TIMEOUT", "starts": {}, "broken": []}
+        except Exception as error:
+            result = {"status": f"ERROR:{type(error).__name__}", "starts": {}, "broken": []}
+        statuses.append(str(result.get("status")))
+        starts = result.get("starts") or {}
+        if emit is not None:
+            emit({
+                "type": "progress",
+                "phase": "component",
+                "component": len(statuses),
+                "components": len(components),
+                "status": statuses[-1],
+                "elapsedSeconds": round(time.monotonic() - started, 3),
+                "moved": [
+                    [int(tid), service.to_hhmm(ctx.work_start + int(slot) * ctx.grid)]
+                    for tid, slot in sorted(starts.items())
+                    if int(slot) != ctx.specs[int(tid)].warm_slot
+                ],
+            })
+        if starts:
+            solved_starts.update({int(tid): int(slot) for tid, slot in starts.items()})
+            broken_tids.extend(int(tid) for tid in result.get("broken") or [])
+        else:
+            # Componente sin solución: sus tareas conservan el warm start.
+            for tid in component:
+                solved_starts[tid] = ctx.specs[tid].warm_slot
+    component_wall = time.monotonic() - started
+
+    if not any(status in ["OPTIMAL", "FEASIBLE"] for status in statuses):
+        service.record_outcome(ctx, "INFEASIBLE" if all(status == "INFEASIBLE" for status in statuses) else "UNKNOWN")
+        return service.baseline_result(
+            ctx.engine_input,
+            ctx.warm,
+            "CP-SAT sin mejora factible; se devuelve Fase A.",
+            ["status=decomposed_no_feasible_component", f"decompositionComponentStatuses={','.join(statuses)}"],
+        )
+
+    for tid, spec in ctx.specs.items():
+        solved_starts.setdefault(tid, spec.fixed_ws if spec.fixed else spec.warm_slot)
+
+    merged = service.assemble_result(ctx, solved_starts, broken_tids, [], [])
+    coordination = "skipped"
+    remaining = total_budget - (time.monotonic() - started)
+    final = merged
+    if coordination_share > 0 and remaining >= 0.5 and service.cancel_reason() is None:
+        # Pasada de coordinación: modelo completo sugerido con la fusión, para
+        # los términos globales (makespan) que los componentes no ven.
+        build = service.build_model(cp_model, ctx)
+        service.add_solution_hint(ctx, build, {tid: solved_starts[tid] for tid in build.start_vars})
+        solver, _config = service.tuned_solver(cp_model, ctx.payload, build, remaining)
+        status = service.run_solver(solver, build.model)
+        coordination = f"rejected:{solver.StatusName(status)}"
+        if status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            coordinated = service.assemble_result(
+                ctx,
+                {tid: int(solver.Value(var)) for tid, var in build.start_vars.items()},
+                [tid for tid, b in build.degrade_bools if solver.Value(b) == 1],
+                [],
+                [],
+            )
+            if coordinated["quality"]["optimizedScore"] <= merged["quality"]["optimizedScore"]:
+                final = coordinated
+                coordination = f"accepted:{solver.StatusName(status)}"
+
+    overall = "OPTIMAL" if all(status == "OPTIMAL" for status in statuses) else "FEASIBLE"
+    service.record_outcome(ctx, overall)
+    final["technicalDetails"] = [
+        f"status={overall}",
+        f"wall_time_s={time.monotonic() - started:.3f}",
+        f"decompositionComponents={len(components)}",
+        f"decompositionComponentSizes={','.join(str(len(component)) for component in components)}",
+        f"decompositionComponentStatuses={','.join(statuses)}",
+        f"decompositionWorkers={pool_size}",
+        f"decompositionSearchWorkersPerComponent={search_workers}",
+        f"decompositionComponentWallS={component_wall:.3f}",
+        f"decompositionCoordination={coordination}",
+        *([f"cancelled={service.cancel_reason()}"] if service.cancel_reason() else []),
+        *final["technicalDetails"],
+    ]
+    return final
+
+
+# Tipos de vecindario de `lns`: franja de tiempo, un espacio, un concursante o la zona principal alrededor de sus mayores huecos.
+LNS_NEIGHBORHOOD_KINDS = ["window", "space", "contestant", "mainZoneGap"]
+
+# Límites del tamaño adaptativo de vecindario (tareas liberadas por sub-solve).
+LNS_MIN_NEIGHBORHOOD = 4
+LNS_MAX_NEIGHBORHOOD = 120
+
+# Modelo completo construido una vez por proceso del pool y reutilizado en cada vecindario de la misma ejecución.
+_LNS_WORKER_BUILD: Dict[str, Tuple[service.SolveContext, service.ModelBuild]] = {}
+
+
+def lns_score(ctx: service.SolveContext, starts: Dict[int, int]) -> int:
+    """Puntuación de `score_plan` del plan con los inicios `starts` (slots) sobre el warm start."""
+    rewritten = {
+        tid: (ctx.work_start + slot * ctx.grid, ctx.work_start + (slot + ctx.specs[tid].dur_slots) * ctx.grid)
+        for tid, slot in starts.items()
+    }
+    if ctx.plan_table is not None:
+        start, end = service.plan_with_starts(ctx.plan_table, rewritten)
+        return int(service.score_plans(ctx.plan_table, start, end)["score"][0])
+    planned = [
+        {**row, "startPlanned": service.to_hhmm(rewritten[tid][0]), "endPlanned": service.to_hhmm(rewritten[tid][1])}
+        if (tid := int(row.get("taskId") or -1)) in rewritten else row
+        for row in ctx.warm_planned
+    ]
+    return service.score_plan(ctx.engine_input, planned)[0]
+
+
+def lns_neighborhood(
+    ctx: service.SolveContext,
+    kind: str,
+    incumbent: Dict[int, int],
+    size: int,
+    rng: random.Random,
+) -> List[int]:
+    """Tareas movibles que libera un vecindario de tipo `kind` (como mucho `size`, las más cercanas a un pivote)."""
+    movable = [tid for tid in ctx.movable_task_ids() if tid in incumbent]
+    if not movable:
+        return []
+
+    def nearest(candidates: List[int], center: int, limit: int) -> List[int]:
+        return sorted(candidates, key=lambda tid: (abs(incumbent[tid] - center), tid))[:limit]
+
+    if kind == "window":
+        return sorted(nearest(movable, incumbent[rng.choice(movable)], size))
+    if kind in ["space", "contestant"]:
+        groups: Dict[int, List[int]] = {}
+        for tid in movable:
+            key = ctx.specs[tid].space_id if kind == "space" else ctx.specs[tid].contestant_id
+            if key > 0:
+                groups.setdefault(key, []).append(tid)
+        if not groups:
+            return []
+        members = groups[rng.choice(sorted(groups))]
+        return sorted(nearest(members, incumbent[rng.choice(members)], size))
+    if kind == "mainZoneGap" and ctx.main_zone_id > 0:
+        main = sorted(
+            (incumbent[tid], incumbent[tid] + spec.dur_slots, tid)
+            for tid, spec in ctx.specs.items()
+            if spec.zone_id == ctx.main_zone_id and tid in incumbent
+        )
+        gaps = sorted(
+            ((following[0] - previous[1], previous[1], following[0]) for previous, following in zip(main, main[1:])),
+            reverse=True,
+        )
+        gaps = [gap for gap in gaps if gap[0] > 0][:3]
+        if not gaps:
+            return []
+        _width, gap_start, gap_end = rng.choice(gaps)
+        center = (gap_start + gap_end) // 2
+        main_ids = [tid for _s, _e, tid in main if tid in set(movable)]
+        chosen = nearest(main_ids, center, max(1, size // 2))
+        chosen += nearest([tid for tid in movable if tid not in chosen], center, size - len(chosen))
+        return sorted(chosen)
+    return []
+
+
+def solve_lns_neighborhood(
+    cp_model: Any,
+    ctx: service.SolveContext,
+    build: service.ModelBuild,
+    free_ids: List[int],
+    incumbent: Dict[int, int],
+    time_limit_seconds: float,
+    num_workers: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """Sub-solve de un vecindario: el resto de inicios se fija al incumbente y el modelo se restaura al terminar."""
+    proto = build.model.Proto()
+    free = set(free_ids)
+    saved: Dict[int, List[int]] = {}
+    for tid, var in build.start_vars.items():
+        if tid not in free and tid in incumbent:
+            domain = proto.variables[var.Index()].domain
+            saved[var.Index()] = list(domain)
+            service.set_domain(domain, [incumbent[tid], incumbent[tid]])
+    try:
+        service.add_solution_hint(ctx, build, {tid: incumbent[tid] for tid in build.start_vars if tid in incumbent})
+        solver, _config = service.tuned_solver(cp_model, ctx.payload, build, time_limit_seconds, num_workers)
+        solver.parameters.random_seed = int(seed)
+        solver.parameters.log_search_progress = False
+        status = service.run_solver(solver, build.model)
+    finally:
+        for index, domain in saved.items():
+            service.set_domain(proto.variables[index].domain, domain)
+    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        return {"status": solver.StatusName(status), "starts": {}, "wallTime": solver.WallTime()}
+    return {
+        "status": solver.StatusName(status),
+        "starts": {tid: int(solver.Value(build.start_vars[tid])) for tid in free_ids if tid in build.start_vars},
+        "objective": float(solver.ObjectiveValue()),
+        "wallTime": solver.WallTime(),
+    }
+
+
+def solve_lns_remote(
+    payload: Dict[str, Any],
+    run_key: str,
+    free_ids: List[int],
+    incumbent: Dict[int, int],
+    time_limit_seconds: float,
+    num_workers: int,
+    seed: int,
+) -> Dict[str, Any]:
+    """`solve_lns_neighborhood` en un proceso del pool; el modelo se construye la primera vez de cada ejecución."""
+    with service.request_scope():
+        cp_model = service.load_cp_model()
+        if cp_model is None:
+            return {"status": "ORTOOLS_UNAVAILABLE", "starts": {}}
+        if run_key not in _LNS_WORKER_BUILD:
+            ctx, _early = service.prepare_context(payload)
+            if ctx is None:
+                return {"status": "INVALID_PAYLOAD", "starts": {}}
+            _LNS_WORKER_BUILD.clear()
+            _LNS_WORKER_BUILD[run_key] = (ctx, service.build_model(cp_model, ctx))
+        ctx, build = _LNS_WORKER_BUILD[run_key]
+        return solve_lns_neighborhood(cp_model, ctx, build, free_ids, incumbent, time_limit_seconds, num_workers, seed)
+
+
+def solve_lns(cp_model: Any, ctx: service.SolveContext, emit: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+    """Búsqueda de vecindario grande (`lns`) sobre el modelo completo, construido una sola vez.
+
+    Parte del warm start (reparado si hace falta) y en cada ronda libera
+    vecindarios sin tareas en común, uno por proceso del pool, con el resto
+    fijo en el incumbente y un presupuesto corto. Un vecindario se acepta si
+    mejora `score_plan` (o lo iguala y mejora el objetivo del modelo). El tipo
+    de vecindario se elige con probabilidad proporcional a su tasa de éxito y el
+    tamaño crece cuando los sub-solves cierran óptimos y baja cuando no
+    encuentran solución. Devuelve None si no hay tareas movibles.
+    """
+    payload = ctx.payload
+    options = payload.get("lns") if isinstance(payload.get("lns"), dict) else {}
+    if not ctx.movable_task_ids():
+        return None
+    total_budget = ctx.time_limit_seconds
+    remaining_deadline = service.remaining_until_deadline(payload)
+    if remaining_deadline is not None:
+        total_budget = min(total_budget, remaining_deadline)
+        if total_budget <= 0:
+            return None
+    started = time.monotonic()
+    rng = random.Random(int(options.get("seed") or 0))
+    kinds = [kind for kind in options.get("kinds") or LNS_NEIGHBORHOOD_KINDS if kind in LNS_NEIGHBORHOOD_KINDS]
+    if ctx.main_zone_id <= 0 and "mainZoneGap" in kinds and len(kinds) > 1:
+        kinds.remove("mainZoneGap")
+    neighborhood_seconds = float(options.get("neighborhoodSeconds") or max(0.2, min(2.0, total_budget / 10)))
+    size = int(options.get("neighborhoodSize") or min(30, len(ctx.movable_task_ids())))
+    size = max(LNS_MIN_NEIGHBORHOOD, min(LNS_MAX_NEIGHBORHOOD, size))
+    cpus = service.available_cpus()
+    pool_size = max(1, min(int(options.get("maxWorkers") or cpus), cpus))
+    search_workers = max(1, cpus // pool_size)
+
+    build = service.build_model(cp_model, ctx)
+    incumbent = service.warm_hint_starts(ctx, build)
+    initial = "warmStart"
+    if service.hint_violations(ctx, build, incumbent):
+        incumbent, _repaired = service.repair_hint_starts(ctx, build, incumbent)
+        initial = "repaired"
+    objective: Optional[float] = None
+    if service.hint_violations(ctx, build, incumbent):
+        # Sin incumbente factible de partida: una parte del presupuesto va a un solve completo.
+        service.add_solution_hint(ctx, build, incumbent)
+        initial_limit = total_budget * float(options.get("initialShare") or 0.3)
+        solver, _config = service.tuned_solver(cp_model, payload, build, initial_limit, search_workers * pool_size)
+        status = service.run_solver(solver, build.model)
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            service.record_outcome(ctx, solver.StatusName(status))
+            return service.baseline_result(
+                ctx.engine_input,
+                ctx.warm,
+                "CP-SAT sin mejora factible; se devuelve Fase A.",
+                [f"status={solver.StatusName(status)}", "lnsInitial=infeasible"],
+            )
+        incumbent = {tid: int(solver.Value(var)) for tid, var in build.start_vars.items()}
+        objective = float(solver.ObjectiveValue())
+        initial = "solved"
+    score = lns_score(ctx, incumbent)
+    initial_score = score
+
+    stats = {kind: {"tried": 0, "accepted": 0, "improvement": 0, "failed": 0} for kind in kinds}
+    run_key = uuid.uuid4().hex
+    pool = service.get_process_pool(pool_size) if pool_size > 1 else None
+    rounds = 0
+    neighborhoods = 0
+    conflicts = 0
+    while service.cancel_reason() is None:
+        remaining = total_budget - (time.monotonic() - started)
+        if remaining < min(0.1, neighborhood_seconds):
+            break
+        budget = min(neighborhood_seconds, remaining)
+        picked: List[Tuple[str, List[int]]] = []
+        taken: set = set()
+        for _attempt in range(4 * pool_size):
+            if len(picked) >= pool_size:
+                break
+            weights = [(stats[kind]["accepted"] + 1) / (stats[kind]["tried"] + 2) for kind in kinds]
+            kind = rng.choices(kinds, weights)[0]
+            free_ids = lns_neighborhood(ctx, kind, incumbent, size, rng)
+            if free_ids and taken.isdisjoint(free_ids):
+                picked.append((kind, free_ids))
+                taken.update(free_ids)
+        if not picked:
+            break
+        rounds += 1
+        seeds = [rng.randrange(1 << 30) for _ in picked]
+        if pool is None:
+            results = [
+                solve_lns_neighborhood(cp_model, ctx, build, free_ids, incumbent, budget, search_workers, seed)
+                for (_kind, free_ids), seed in zip(picked, seeds)
+            ]
+        else:
+            futures = [
+                pool.submit(solve_lns_remote, payload, run_key, free_ids, incumbent, budget, search_workers, seed)
+                for (_kind, free_ids), seed in zip(picked, seeds)
+            ]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    results.append({"status": f"ERROR:{type(error).__name__}", "starts": {}})
+
+        scored = []
+        for (kind, free_ids), result in zip(picked, results):
+            neighborhoods += 1
+            stats[kind]["tried"] += 1
+            if result.get("status") == "OPTIMAL":
+                size = min(LNS_MAX_NEIGHBORHOOD, max(size + 1, int(size * 1.2)))
+            elif not result.get("starts"):
+                stats[kind]["failed"] += 1
+                size = max(LNS_MIN_NEIGHBORHOOD, int(size * 0.8))
+                continue
+            candidate = {**incumbent, **{int(tid): int(slot) for tid, slot in result["starts"].items()}}
+            scored.append((lns_score(ctx, candidate), float(result.get("objective", 0.0)), kind, result["starts"]))
+
+        # `unchanged`: el incumbente sigue siendo aquel contra el que se resolvieron los vecindarios de la ronda.
+        unchanged = True
+        for candidate_score, candidate_objective, kind, starts in sorted(scored, key=lambda item: (item[0], item[1])):
+            candidate = {**incumbent, **{int(tid): int(slot) for tid, slot in starts.items()}}
+            if candidate == incumbent:
+                continue
+            if unchanged:
+                better = candidate_score < score or (
+                    candidate_score == score and (objective is None or candidate_objective < objective)
+                )
+            else:
+                # Resuelto contra el incumbente anterior: solo se fusiona si sigue siendo factible.
+                if service.hint_violations(ctx, build, candidate):
+                    conflicts += 1
+                    continue
+                candidate_score = lns_score(ctx, candidate)
+                better = candidate_score < score
+            if not better:
+                continue
+            stats[kind]["accepted"] += 1
+            stats[kind]["improvement"] += score - candidate_score
+            incumbent, score = candidate, candidate_score
+            objective = candidate_objective if unchanged else None
+            unchanged = False
+            if emit is not None:
+                emit({
+                    "type": "progress",
+                    "phase": "lns",
+                    "round": rounds,
+                    "kind": kind,
+                    "score": score,
+                    "elapsedSeconds": round(time.monotonic() - started, 3),
+                })
+    lns_wall = time.monotonic() - started
+    service.record_outcome(ctx, "FEASIBLE")
+
+    broken_tids = [tid for tid in build.keep_bools if incumbent[tid] != ctx.specs[tid].warm_slot]
+    accepted = sum(kind_stats["accepted"] for kind_stats in stats.values())
+    ctx.report["lns"] = {
+        "initial": initial,
+        "initialScore": initial_score,
+        "finalScore": score,
+        "rounds": rounds,
+        "neighborhoods": neighborhoods,
+        "accepted": accepted,
+        "mergeConflicts": conflicts,
+        "neighborhoodSize": size,
+        "neighborhoodSeconds": round(neighborhood_seconds, 3),
+        "workers": pool_size,
+        "kinds": stats,
+        "wallSeconds": round(lns_wall, 3),
+    }
+    return service.assemble_result(
+        ctx,
+        incumbent,
+        broken_tids,
+        [
+            "status=FEASIBLE",
+            f"wall_time_s={lns_wall:.3f}",
+            f"lnsRounds={rounds}",
+            f"lnsNeighborhoods={neighborhoods}",
+            f"lnsAccepted={accepted}",
+            "lnsKinds=" + ",".join(f"{kind}:{kind_stats['accepted']}/{kind_stats['tried']}" for kind, kind_stats in stats.items()),
+            f"lnsWorkers={pool_size}",
+            *([f"cancelled={service.cancel_reason()}"] if service.cancel_reason() else []),
+        ],
+        [],
+    )
@@ -0,0 +1,337 @@
+"""Reutilización de modelos CP-SAT entre peticiones del mismo plan (`reuseModel`).
+
+El worker persistente guarda el modelo construido de cada plan y, en la
+siguiente petición con la misma estructura, parchea dominios, ventanas, locks
+y warm start en lugar de volver a llamar a `build_model`.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import cp_sat_service as service
+
+# Modelos guardados entre peticiones con `reuseModel`: LRU en memoria del proceso.
+MODEL_REUSE_MAX_ENTRIES = 8
+
+# Por encima de esta fracción de tareas cambiadas (o de variables retiradas) sale más a cuenta reconstruir.
+MODEL_REUSE_MAX_DELTA_SHARE = 0.25
+
+_MODEL_STORE: Dict[str, "ReusableModel"] = {}
+_MODEL_STORE_LOCK = threading.Lock()
+
+
+@dataclass
+class ReusableModel:
+    """Modelo guardado de un plan y los specs con los que está parcheado."""
+    build: service.ModelBuild
+    specs: Dict[int, service.TaskSpec]
+    plan_id: Any = None
+    uses: int = 1
+
+
+def task_signature(spec: service.TaskSpec) -> Tuple[Any, ...]:
+    """Lo que fija la forma de una tarea en el modelo; dominio, ventana, lock y warm start se parchean."""
+    return (
+        spec.dur_slots,
+        spec.fixed,
+        spec.fixed_by_lock,
+        spec.has_warm,
+        spec.near_hard,
+        spec.meal_in_domain,
+        spec.space_id,
+        spec.contestant_id,
+        spec.zone_id,
+        spec.template_id,
+        tuple(spec.resource_ids),
+        tuple(spec.depends_on),
+        tuple(sorted(spec.cumulative_demands.items())),
+    )
+
+
+def model_structure_key(ctx: service.SolveContext) -> Optional[str]:
+    """Huella de lo que un modelo guardado no puede parchear; None si el payload no trae `planId`.
+
+    Incluye jornada, comida, codificación, las tareas casi duras, las clases de
+    simetría y todo lo que alimenta la ocupación de zona principal (sus tareas
+    con dominio y los slots contados).
+    """
+    plan_id = ctx.engine_input.get("planId")
+    if plan_id is None:
+        return None
+    main_zone = [
+        tid for tid, spec in ctx.specs.items()
+        if ctx.main_zone_id > 0 and spec.zone_id == ctx.main_zone_id
+    ]
+    structure = {
+        "planId": plan_id,
+        "grid": ctx.grid,
+        "workStart": ctx.work_start,
+        "horizon": ctx.horizon,
+        "meal": ctx.meal_slots,
+        "mainZoneId": ctx.main_zone_id,
+        "encoding": ctx.occupancy_encoding,
+        "nearHardBreaksMax": ctx.near_hard_breaks_max,
+        "nearHard": sorted(tid for tid, spec in ctx.specs.items() if spec.near_hard),
+        "mainZone": sorted(
+            [tid, *task_signature(spec), spec.lb, spec.ub, spec.window_lb, spec.window_ub, spec.domain_intervals]
+            for tid, spec in ((tid, ctx.specs[tid]) for tid in main_zone)
+        ),
+        "occupancySlots": service.main_zone_occupancy_slots(ctx, main_zone),
+        "symmetry": service.symmetry_classes(ctx, ctx.movable_task_ids()) if ctx.payload.get("symmetryBreaking") else None,
+        "capacities": sorted([kind, key, capacity] for (kind, key), capacity in ctx.capacities.items()),
+    }
+    encoded = json.dumps(structure, sort_keys=True, separators=(",", ":"), default=list)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def drop_lin_max_exprs(lin_max: Any, var_indices: set) -> None:
+    """Quita de un `lin_max` las expresiones que usan alguna de `var_indices`."""
+    kept = [
+        (list(expr.vars), list(expr.coeffs), int(expr.offset))
+        for expr in lin_max.exprs
+        if var_indices.isdisjoint(expr.vars)
+    ]
+    lin_max.exprs.clear()
+    for variables, coeffs, offset in kept:
+        append_lin_max_expr(lin_max, variables, coeffs, offset)
+
+
+def append_lin_max_expr(lin_max: Any, variables: List[int], coeffs: List[int], offset: int = 0) -> None:
+    expr = lin_max.exprs.add()
+    expr.vars.extend(variables)
+    expr.coeffs.extend(coeffs)
+    expr.offset = offset
+
+
+def clear_constraint(constraint: Any) -> None:
+    """Deja la restricción vacía: CP-SAT la ignora y los índices del resto no cambian."""
+    constraint.enforcement_literal.clear()
+    for kind in ("linear", "lin_max", "interval", "no_overlap"):
+        if getattr(constraint, f"has_{kind}")():
+            getattr(constraint, f"clear_{kind}")()
+
+
+def retire_task(build: service.ModelBuild, spec: service.TaskSpec) -> None:
+    """Saca una tarea del modelo guardado sin renumerarlo.
+
+    Vacía sus restricciones (incluidas las dependencias en las que aparece), la
+    quita de sus NoOverlap, del makespan y del span de su concursante, anula su
+    término de distancia al warm start y fija sus variables a 0.
+    """
+    proto = build.model.Proto()
+    tid = spec.tid
+    for index in build.task_constraints.pop(tid, []):
+        clear_constraint(proto.constraints[index])
+    for kind in ("lock", "window", "warm", "keep"):
+        build.parametric.pop((kind, tid), None)
+    interval = build.intervals.pop(tid).Index()
+    for group in service.task_groups(spec):
+        build.group_members[group].remove(tid)
+        if group in build.group_constraints:
+            intervals = proto.constraints[build.group_constraints[group]].no_overlap.intervals
+            kept = [index for index in intervals if index != interval]
+            intervals.clear()
+            intervals.extend(kept)
+    retired = [build.start_vars.pop(tid), build.end_vars.pop(tid)]
+    var_indices = {retired[0].Index(), retired[1].Index()}
+    if build.makespan_constraint is not None:
+        drop_lin_max_exprs(proto.constraints[build.makespan_constraint].lin_max, var_indices)
+    if spec.contestant_id in build.span_constraints:
+        for index in build.span_constraints[spec.contestant_id]:
+            drop_lin_max_exprs(proto.constraints[index].lin_max, var_indices)
+        build.span_bounds[spec.contestant_id][0].remove(tid)
+    d = build.abs_diffs.pop(tid, None)
+    if d is not None:
+        objective = proto.objective
+        for position, index in enumerate(objective.vars):
+            if index == d.Index():
+                objective.coeffs[position] = 0
+        retired.append(d)
+    before_meal = build.before_meal_bools.pop(tid, None)
+    if before_meal is not None:
+        retired.append(before_meal)
+    if not spec.fixed:
+        build.movable_task_ids.remove(tid)
+    for var in retired:
+        service.set_domain(proto.variables[var.Index()].domain, [0, 0])
+    build.retired_vars += len(retired)
+
+
+def add_task(cp_model: Any, ctx: service.SolveContext, build: service.ModelBuild, spec: service.TaskSpec) -> None:
+    """Añade una tarea al modelo guardado igual que la añadiría `build_model` (salvo dependencias)."""
+    proto = build.model.Proto()
+    tid = spec.tid
+    service.add_task_variables(cp_model, ctx, build, spec)
+    interval = build.intervals[tid]
+    for group in service.task_groups(spec):
+        members = build.group_members.setdefault(group, [])
+        if group in build.group_constraints:
+            proto.constraints[build.group_constraints[group]].no_overlap.intervals.append(interval.Index())
+        elif members:
+            build.group_constraints[group] = build.model.AddNoOverlap(
+                [build.intervals[member] for member in members] + [interval]
+            ).Index()
+        members.append(tid)
+    start, end = build.start_vars[tid].Index(), build.end_vars[tid].Index()
+    if not spec.fixed:
+        service.add_meal_choice(ctx, build, tid)
+        d = service.add_warm_distance(ctx, build, tid)
+        if d is not None:
+            proto.objective.vars.append(d.Index())
+            proto.objective.coeffs.append(service.W3)
+    if build.makespan_constraint is not None:
+        append_lin_max_expr(proto.constraints[build.makespan_constraint].lin_max, [end], [1])
+    if spec.contestant_id in build.span_constraints:
+        first_index, last_index = build.span_constraints[spec.contestant_id]
+        append_lin_max_expr(proto.constraints[first_index].lin_max, [start], [-1])
+        append_lin_max_expr(proto.constraints[last_index].lin_max, [end], [1])
+        build.span_bounds[spec.contestant_id][0].append(tid)
+
+
+def patch_task(cp_model: Any, ctx: service.SolveContext, build: service.ModelBuild, old: service.TaskSpec, spec: service.TaskSpec) -> bool:
+    """Actualiza dominio, ventana, lock y warm start de una tarea ya modelada; True si cambió algo."""
+    proto = build.model.Proto()
+    tid = spec.tid
+    patched = False
+    if (old.lb, old.ub, old.domain_intervals) != (spec.lb, spec.ub, spec.domain_intervals):
+        intervals = spec.domain_intervals if spec.domain_intervals is not None else [(spec.lb, spec.ub)]
+        service.set_domain(
+            proto.variables[build.start_vars[tid].Index()].domain,
+            cp_model.Domain.FromIntervals(intervals).FlattenedIntervals(),
+        )
+        service.set_domain(
+            proto.variables[build.end_vars[tid].Index()].domain,
+            [max(0, spec.lb + spec.dur_slots), min(ctx.horizon, spec.ub + spec.dur_slots)],
+        )
+        patched = True
+    if (old.window_lb, old.window_ub) != (spec.window_lb, spec.window_ub):
+        lower, upper = build.parametric[("window", tid)]
+        proto.constraints[lower].linear.domain[0] = spec.window_lb
+        proto.constraints[upper].linear.domain[1] = spec.window_ub
+        patched = True
+    if spec.fixed_by_lock and old.fixed_ws != spec.fixed_ws:
+        at_start, at_end = build.parametric[("lock", tid)]
+        service.set_domain(proto.constraints[at_start].linear.domain, [spec.fixed_ws, spec.fixed_ws])
+        service.set_domain(proto.constraints[at_end].linear.domain, [spec.fixed_ws + spec.dur_slots] * 2)
+        patched = True
+    if old.warm_slot != spec.warm_slot:
+        if ("warm", tid) in build.parametric:
+            exprs = proto.constraints[build.parametric[("warm", tid)][0]].lin_max.exprs
+            exprs[0].offset = -spec.warm_slot
+            exprs[1].offset = spec.warm_slot
+        if ("keep", tid) in build.parametric:
+            at_warm, off_warm = build.parametric[("keep", tid)]
+            service.set_domain(proto.constraints[at_warm].linear.domain, [spec.warm_slot, spec.warm_slot])
+            domain = proto.constraints[off_warm].linear.domain
+            service.set_domain(domain, [domain[0], spec.warm_slot - 1, spec.warm_slot + 1, domain[len(domain) - 1]])
+        patched = True
+    return patched
+
+
+def patch_model(cp_model: Any, ctx: service.SolveContext, entry: ReusableModel) -> Tuple[Optional[str], Dict[str, int]]:
+    """Aplica al modelo guardado el delta respecto a la petición anterior.
+
+    Devuelve `(motivo, contadores)`; con motivo el modelo no se ha tocado y hay
+    que reconstruirlo. Una tarea cuya firma cambia se retira y se vuelve a añadir.
+    """
+    build, old_specs = entry.build, entry.specs
+    changed = {
+        tid for tid, spec in ctx.specs.items()
+        if tid in old_specs and task_signature(old_specs[tid]) != task_signature(spec)
+    }
+    retired = [tid for tid in old_specs if tid not in ctx.specs or tid in changed]
+    added = [tid for tid in ctx.specs if tid not in old_specs or tid in changed]
+    if len(set(retired) | set(added)) > MODEL_REUSE_MAX_DELTA_SHARE * max(1, len(ctx.specs)):
+        return "delta_too_large", {}
+    variables = len(build.model.Proto().variables)
+    if build.retired_vars + 4 * len(retired) > MODEL_REUSE_MAX_DELTA_SHARE * variables:
+        return "too_many_retired_vars", {}
+    contestants = {spec.contestant_id for spec in ctx.specs.values() if spec.contestant_id > 0}
+    if contestants != set(build.span_vars):
+        # Un concursante nuevo o sin tareas cambia los spans y el objetivo: no se parchea.
+        return "contestants_changed", {}
+    if any(old_specs[tid].cumulative_demands for tid in retired) or any(ctx.specs[tid].cumulative_demands for tid in added):
+        # Los Cumulative no se parchean: entrar o salir de un pool obliga a reconstruir.
+        return "cumulative_changed", {}
+
+    for tid in retired:
+        retire_task(build, old_specs[tid])
+    added_set = set(added)
+    for tid in added:
+        add_task(cp_model, ctx, build, ctx.specs[tid])
+    for tid in added:
+        for did in ctx.specs[tid].depends_on:
+            if did in build.end_vars:
+                service.add_dependency(build, tid, did)
+    for spec in ctx.specs.values():
+        if spec.tid in added_set:
+            continue
+        for did in spec.depends_on:
+            if did in added_set:
+                service.add_dependency(build, spec.tid, did)
+    patched = sum(
+        1 for tid, spec in ctx.specs.items()
+        if tid not in added_set and patch_task(cp_model, ctx, build, old_specs[tid], spec)
+    )
+    return None, {"patchedTasks": patched, "addedTasks": len(added), "retiredTasks": len(retired)}
+
+
+@contextmanager
+def reusable_model(cp_model: Any, ctx: service.SolveContext, profile: service.RequestProfile) -> Iterator[service.ModelBuild]:
+    """`build_model`, con `reuseModel` sobre el modelo guardado del mismo plan y estructura.
+
+    El modelo se saca del almacén mientras dura el `with` (dos peticiones
+    simultáneas nunca comparten modelo) y vuelve a él al terminar sin error.
+    Con `lexicographic` no se guarda: ese modo añade restricciones al modelo.
+    """
+    if not ctx.payload.get("reuseModel"):
+        with profile.phase("build"):
+            build = service.build_model(cp_model, ctx)
+        yield build
+        return
+    started = time.perf_counter()
+    with profile.phase("build"):
+        key = model_structure_key(ctx)
+        plan_id = ctx.engine_input.get("planId")
+        entry = None
+        reason = "no_plan_id"
+        if key is not None:
+            with _MODEL_STORE_LOCK:
+                entry = _MODEL_STORE.pop(key, None)
+                same_plan = any(stored.plan_id == plan_id for stored in _MODEL_STORE.values())
+            reason = "structure_changed" if same_plan else "not_stored"
+        counts: Dict[str, int] = {}
+        if entry is not None:
+            try:
+                reason, counts = patch_model(cp_model, ctx, entry)
+            except Exception as error:
+                reason = f"patch_failed:{type(error).__name__}"
+        if entry is not None and reason is None:
+            entry.specs = dict(ctx.specs)
+            entry.uses += 1
+            service.hint_model(ctx, entry.build)
+        else:
+            entry = ReusableModel(build=service.build_model(cp_model, ctx), specs=dict(ctx.specs), plan_id=plan_id)
+    mode = "reused" if reason is None else "built"
+    ctx.report["modelReuse"] = {
+        "mode": mode,
+        "reason": reason,
+        "uses": entry.uses,
+        "retiredVars": entry.build.retired_vars,
+        "seconds": round(time.perf_counter() - started, 4),
+        **counts,
+    }
+    ctx.details.append(f"modelReuse={mode}" + (f":{reason}" if reason else ""))
+    yield entry.build
+    if key is None or ctx.payload.get("lexicographic"):
+        return
+    with _MODEL_STORE_LOCK:
+        _MODEL_STORE[key] = entry
+        while len(_MODEL_STORE) > MODEL_REUSE_MAX_ENTRIES:
+            del _MODEL_STORE[next(iter(_MODEL_STORE))]
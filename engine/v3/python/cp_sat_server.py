@@ -0,0 +1,403 @@
+"""Transporte del servicio CP-SAT: worker persistente, formatos de mensaje y entrada columnar.
+
+`CpSatServer` atiende peticiones por stdin/stdout o socket Unix; `WireCodec`
+codifica cada mensaje en JSON o msgpack, por líneas o con prefijo de longitud.
+También decodifica la entrada columnar y calcula la salida como diff, que
+`cp_sat_service.solve_request` aplica a cada petición.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+import cp_sat_service as service
+
+_MSGPACK: Any = None
+_MSGPACK_LOADED = False
+_MSGPACK_LOCK = threading.Lock()
+
+
+def load_msgpack() -> Any:
+    """Importa msgpack (opcional, solo para `--wire msgpack`); None si no está instalado."""
+    global _MSGPACK, _MSGPACK_LOADED
+    with _MSGPACK_LOCK:
+        if not _MSGPACK_LOADED:
+            try:
+                import msgpack
+                _MSGPACK = msgpack
+            except Exception:
+                _MSGPACK = None
+            _MSGPACK_LOADED = True
+        return _MSGPACK
+
+
+MSGPACK_MISSING = "--wire msgpack requiere el paquete msgpack (pip install msgpack); es opcional y no está en requirements.txt"
+
+
+def require_msgpack() -> Any:
+    """msgpack para codificar o decodificar; error claro si no está instalado."""
+    msgpack = load_msgpack()
+    if msgpack is None:
+        raise RuntimeError(MSGPACK_MISSING)
+    return msgpack
+
+
+def rows_from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Filas a partir de columnas paralelas; un `None` no genera clave en su fila."""
+    names = list(columns.keys())
+    values = [columns[name] for name in names]
+    size = max((len(column) for column in values), default=0)
+    rows = []
+    for index in range(size):
+        rows.append({
+            name: column[index]
+            for name, column in zip(names, values)
+            if index < len(column) and column[index] is not None
+        })
+    return rows
+
+
+def planned_rows_from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Como `rows_from_columns`, con `startMin`/`endMin` (minutos desde 00:00) pasados a HH:MM."""
+    rows = rows_from_columns(columns)
+    for row in rows:
+        if "startMin" in row:
+            row["startPlanned"] = service.to_hhmm(int(row.pop("startMin")))
+        if "endMin" in row:
+            row["endPlanned"] = service.to_hhmm(int(row.pop("endMin")))
+    return rows
+
+
+def decode_columnar_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Traduce las variantes columnares del contrato a filas antes de cualquier otro paso.
+
+    `engineInput.taskColumns` sustituye a `engineInput.tasks`, `warmStart.plannedColumns`
+    a `warmStart.plannedTasks` y `planColumns` a `plan` (`validateOnly`). La caché y el
+    resto del servicio solo ven el formato por filas.
+    """
+    engine_input = payload.get("engineInput")
+    warm = payload.get("warmStart")
+    columnar_input = isinstance(engine_input, dict) and isinstance(engine_input.get("taskColumns"), dict)
+    columnar_warm = isinstance(warm, dict) and isinstance(warm.get("plannedColumns"), dict)
+    if not (columnar_input or columnar_warm or isinstance(payload.get("planColumns"), dict)):
+        return payload
+    payload = dict(payload)
+    if columnar_input:
+        engine_input = dict(engine_input)
+        engine_input["tasks"] = rows_from_columns(engine_input.pop("taskColumns"))
+        payload["engineInput"] = engine_input
+    if columnar_warm:
+        warm = dict(warm)
+        warm["plannedTasks"] = planned_rows_from_columns(warm.pop("plannedColumns"))
+        payload["warmStart"] = warm
+    if isinstance(payload.get("planColumns"), dict):
+        payload["plan"] = planned_rows_from_columns(payload.pop("planColumns"))
+    return payload
+
+
+def diff_response(result: Dict[str, Any], warm_planned: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """`responseMode: "diff"`: sustituye `output` por las filas que cambian respecto al warm start.
+
+    `outputDiff` trae columnas `taskId`/`startMin`/`endMin`/`assignedSpace`/`assignedResources`
+    de las filas reescritas y el número total de filas; el resto de cada fila y de
+    `output` es el del warm start. `assignedSpaceSlot` solo aparece si alguna fila
+    lo lleva (espacios con varios huecos).
+    """
+    output = result.get("output")
+    if not isinstance(output, dict):
+        return result
+    warm_by_tid = {row.get("taskId"): row for row in warm_planned}
+    diff: Dict[str, List[Any]] = {"taskId": [], "startMin": [], "endMin": [], "assignedSpace": [], "assignedResources": []}
+    slots: List[Any] = []
+    planned = list(output.get("plannedTasks") or [])
+    for row in planned:
+        warm_row = warm_by_tid.get(row.get("taskId"))
+        if row is warm_row or row == warm_row or not row.get("startPlanned") or not row.get("endPlanned"):
+            continue
+        diff["taskId"].append(int(row.get("taskId")))
+        diff["startMin"].append(service.parse_hhmm(str(row["startPlanned"])))
+        diff["endMin"].append(service.parse_hhmm(str(row["endPlanned"])))
+        diff["assignedSpace"].append(row.get("assignedSpace"))
+        diff["assignedResources"].append(row.get("assignedResources"))
+        slots.append(row.get("assignedSpaceSlot"))
+    if any(slot is not None for slot in slots):
+        diff["assignedSpaceSlot"] = slots
+    diffed = {key: value for key, value in result.items() if key != "output"}
+    diffed["outputDiff"] = {**diff, "rows": len(planned), "moved": len(diff["taskId"])}
+    return diffed
+
+
+WIRE_FORMATS = ["json", "msgpack"]
+WIRE_FRAMINGS = ["lines", "length"]
+
+
+@dataclass
+class WireCodec:
+    """Formato de los mensajes del servicio: JSON o msgpack, por líneas o con prefijo de longitud.
+
+    `length` antepone a cada mensaje su tamaño en 4 bytes big-endian. msgpack
+    siempre usa `length`, porque su binario puede contener saltos de línea.
+    """
+
+    format: str = "json"
+    framing: str = "lines"
+
+    def decode(self, raw: Any) -> Any:
+        if self.format == "msgpack":
+            return require_msgpack().unpackb(raw, raw=False, strict_map_key=False)
+        return json.loads(raw)
+
+    def encode(self, message: Any) -> bytes:
+        if self.format == "msgpack":
+            body = require_msgpack().packb(message, use_bin_type=True)
+        else:
+            body = json.dumps(message).encode("utf-8")
+        if self.framing == "length":
+            return struct.pack(">I", len(body)) + body
+        return body + b"\n"
+
+    def frames(self, stream: IO[bytes]) -> Iterator[bytes]:
+        if self.framing == "lines":
+            yield from stream
+            return
+        while True:
+            header = stream.read(4)
+            if len(header) < 4:
+                return
+            (size,) = struct.unpack(">I", header)
+            body = stream.read(size)
+            if len(body) < size:
+                return
+            yield body
+
+    def read_one(self, stream: IO[bytes]) -> Any:
+        """Primer mensaje del flujo (modo one-shot); `{}` si está vacío."""
+        if self.framing == "lines":
+            raw = stream.read()
+            return self.decode(raw) if raw.strip() else {}
+        return next((self.decode(frame) for frame in self.frames(stream)), {})
+
+
+class CpSatServer:
+    """Worker persistente: NDJSON por stdin/stdout o socket Unix, con OR-Tools ya importado.
+
+    Cada línea es un objeto `{"id", "type", "payload"}`. `type` puede ser `solve`
+    (por defecto), `validate`, `health`, `ready` o `shutdown`; si falta `payload`, el propio
+    mensaje se interpreta como payload del contrato one-shot. Las respuestas
+    repiten `id` y se emiten en orden de finalización, no de llegada.
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.started_at = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="cp-sat")
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.served = 0
+        self.failed = 0
+        self.shutdown_requested = threading.Event()
+
+    def status(self) -> Dict[str, Any]:
+        cp_model = service.load_cp_model()
+        version = None
+        if cp_model is not None:
+            try:
+                import ortools
+                version = getattr(ortools, "__version__", None)
+            except Exception:
+                version = None
+        with self.lock:
+            return {
+                "status": "ready" if cp_model is not None else "degraded",
+                "ortoolsAvailable": cp_model is not None,
+                "ortoolsVersion": version,
+                "pid": os.getpid(),
+                "maxConcurrency": self.max_concurrency,
+                "inFlight": self.in_flight,
+                "queued": self.queued,
+                "served": self.served,
+                "failed": self.failed,
+                "uptimeSeconds": round(time.monotonic() - self.started_at, 3),
+            }
+
+    def _run_solve(self, request_id: Any, payload: Dict[str, Any], reply: Any, profile: Optional[service.RequestProfile] = None) -> None:
+        with self.lock:
+            self.queued -= 1
+            self.in_flight += 1
+        if profile is not None:
+            profile.add("queued", time.perf_counter() - profile.started - profile.phases.get("jsonParse", 0.0))
+        try:
+            result = service.solve_request(payload, lambda event: reply({"id": request_id, **event}), profile)
+            response = {"id": request_id, "type": "result", "ok": True, "result": result}
+            ok = True
+        except Exception as error:
+            response = {"id": request_id, "type": "result", "ok": False, "error": f"{type(error).__name__}: {error}"}
+            ok = False
+        with self.lock:
+            self.in_flight -= 1
+            self.served += 1
+            if not ok:
+                self.failed += 1
+        reply(response)
+
+    def handle_line(
+        self,
+        line: Any,
+        reply: Any,
+        pending: Optional[List[Any]] = None,
+        codec: Optional[WireCodec] = None,
+    ) -> bool:
+        """Despacha un mensaje (línea NDJSON o trama de `codec`). Devuelve False si se pidió `shutdown`."""
+        codec = codec or WireCodec()
+        text = line.strip() if codec.framing == "lines" else line
+        if not text:
+            return True
+        profile = service.RequestProfile()
+        try:
+            with profile.phase("jsonParse"):
+                message = codec.decode(text)
+            if not isinstance(message, dict):
+                raise ValueError("message_not_object")
+        except Exception as error:
+            reply({"id": None, "type": "error", "ok": False, "error": f"invalid_json: {error}"})
+            return True
+
+        request_id = message.get("id")
+        kind = str(message.get("type") or "solve")
+        if kind in ["health", "ready"]:
+            reply({"id": request_id, "type": kind, "ok": True, **self.status()})
+            return True
+        if kind == "validate":
+            # Validación pura: milisegundos y sin OR-Tools, se responde sin pasar por la cola de solves.
+            payload = message.get("payload")
+            if not isinstance(payload, dict):
+                payload = {k: v for k, v in message.items() if k not in ["id", "type"]}
+            reply({"id": request_id, "type": "result", "ok": True, "result": service.validate_request(payload)})
+            return True
+        if kind == "shutdown":
+            self.shutdown_requested.set()
+            reply({"id": request_id, "type": "shutdown", "ok": True})
+            return False
+        if kind != "solve":
+            reply({"id": request_id, "type": "error", "ok": False, "error": f"unknown_type={kind}"})
+            return True
+
+        payload = message.get("payload")
+        if not isinstance(payload, dict):
+            payload = {k: v for k, v in message.items() if k not in ["id", "type"]}
+        with self.lock:
+            self.queued += 1
+        future = self.executor.submit(self._run_solve, request_id, payload, reply, profile)
+        if pending is not None:
+            pending.append(future)
+        return True
+
+    def serve_stream(self, instream: IO[bytes], outstream: IO[bytes], codec: Optional[WireCodec] = None) -> int:
+        codec = codec or WireCodec()
+        write_lock = threading.Lock()
+
+        def reply(response: Dict[str, Any]) -> None:
+            encoded = codec.encode(response)
+            with write_lock:
+                outstream.write(encoded)
+                outstream.flush()
+
+        reply({"id": None, "type": "ready", "ok": True, **self.status()})
+        try:
+            for frame in codec.frames(instream):
+                if not self.handle_line(frame, reply, codec=codec):
+                    break
+        except service.ServiceShutdown:
+            pass
+        self.executor.shutdown(wait=True)
+        return 0
+
+    def serve_socket(self, socket_path: str, codec: Optional[WireCodec] = None) -> int:
+        server_ref = self
+        codec = codec or WireCodec()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                write_lock = threading.Lock()
+
+                def reply(response: Dict[str, Any]) -> None:
+                    encoded = codec.encode(response)
+                    with write_lock:
+                        try:
+                            self.wfile.write(encoded)
+                            self.wfile.flush()
+                        except OSError:
+                            pass
+
+                # Las respuestas de esta conexión se esperan antes de cerrarla.
+                pending: List[Any] = []
+                for frame in codec.frames(self.rfile):
+                    if not server_ref.handle_line(frame, reply, pending, codec):
+                        threading.Thread(target=self.server.shutdown, daemon=True).start()
+                        break
+                for future in pending:
+                    future.result()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socketserver.ThreadingUnixStreamServer.daemon_threads = True
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+            try:
+                server.serve_forever()
+            except service.ServiceShutdown:
+                pass
+            finally:
+                self.executor.shutdown(wait=True)
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)
+        return 0
+
+
+def parse_cli_options(argv: List[str]) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "serve": False,
+        "socket": None,
+        "maxConcurrency": int(os.environ.get("CP_SAT_MAX_CONCURRENCY") or 2),
+        "wire": os.environ.get("CP_SAT_WIRE") or "json",
+        "framing": None,
+    }
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--serve":
+            options["serve"] = True
+        elif arg == "--socket" and i + 1 < len(argv):
+            options["serve"] = True
+            options["socket"] = argv[i + 1]
+            i += 1
+        elif arg == "--max-concurrency" and i + 1 < len(argv):
+            options["maxConcurrency"] = int(argv[i + 1])
+            i += 1
+        elif arg == "--wire" and i + 1 < len(argv):
+            options["wire"] = argv[i + 1]
+            i += 1
+        elif arg == "--framing" and i + 1 < len(argv):
+            options["framing"] = argv[i + 1]
+            i += 1
+        i += 1
+    return options
+
+
+def wire_codec(options: Dict[str, Any]) -> WireCodec:
+    wire = str(options.get("wire") or "json")
+    if wire not in WIRE_FORMATS:
+        raise SystemExit(f"wire no soportado: {wire} (opciones: {', '.join(WIRE_FORMATS)})")
+    if wire == "msgpack" and load_msgpack() is None:
+        raise SystemExit(MSGPACK_MISSING)
+    framing = str(options.get("framing") or ("length" if wire == "msgpack" else "lines"))
+    if framing not in WIRE_FRAMINGS or (wire == "msgpack" and framing != "length"):
+        raise SystemExit(f"framing no soportado para {wire}: {framing}")
+    return WireCodec(format=wire, framing=framing)
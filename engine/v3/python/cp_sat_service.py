@@ -1,7 +1,61 @@
 #!/usr/bin/env python3
 import json
+import multiprocessing
+import os
+import random
+import re
+import signal
 import sys
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Partes del servicio en módulos propios. Importan este módulo como `service`
+# (import circular): solo lo usan dentro de funciones, nunca al importarse.
+import cp_sat_cache
+import cp_sat_decompose
+import cp_sat_reuse
+import cp_sat_server
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_CP_MODEL: Any = None
+_CP_MODEL_LOADED = False
+_CP_MODEL_LOCK = threading.Lock()
+_NUMPY: Any = None
+_NUMPY_LOADED = False
+
+_ACTIVE_SOLVERS: set = set()
+_ACTIVE_SOLVERS_LOCK = threading.Lock()
+_CANCELLED = threading.Event()
+_CANCEL_REASON: List[str] = []
+# Peticiones en curso en este proceso: la cancelación se limpia al terminar la última (`request_scope`).
+_ACTIVE_REQUESTS = 0
+
+# Margen reservado tras el solve para re-puntuar y serializar antes del deadline.
+DEADLINE_MARGIN_SECONDS = 0.25
+
+OCCUPANCY_ENCODINGS = ["cover", "compact"]
+
+# Por encima de este tamaño `profile.model` solo da totales y bloques; el desglose
+# por tipo de restricción recorre el proto entero (`profileModelKinds` lo fuerza).
+PROFILE_MODEL_KINDS_MAX_CONSTRAINTS = 20000
+
+# Weighted objective: main-zone occupancy >> finish early >> warm-start distance >> near-hard breaks >> contestant span >> main-zone switch proxy.
+W1 = 10000
+W2 = 100
+W3 = 1
+W4 = 5000
+W5 = 1
+W6 = 8
 
 
 def parse_hhmm(v: str) -> int:
@@ -87,76 +141,870 @@ def compute_main_zone_occupied_slots(
     return sum(occupied)
 
 
-def main() -> int:
-    raw = sys.stdin.read()
-    payload = json.loads(raw or "{}")
+@dataclass
+class PlanTable:
+    """Filas de un plan en columnas NumPy, parseadas una sola vez por petición.
+
+    Cada fila de `plannedTasks` es una posición de los arrays; los planes
+    candidatos se describen como matrices `(planes, filas)` de inicio y fin en
+    minutos sobre las mismas filas.
+    """
+    task_ids: Any
+    start: Any
+    end: Any
+    space: Any
+    zone: Any
+    template: Any
+    contestant: Any
+    scored: Any
+    main_gap: Any
+    main_occupancy: Any
+    rows_by_tid: Dict[int, List[int]]
+    work_start: int
+    work_end: int
+    grid: int
+
+
+def load_numpy() -> Any:
+    """Importa NumPy una sola vez por proceso; None si no está disponible."""
+    global _NUMPY, _NUMPY_LOADED
+    with _CP_MODEL_LOCK:
+        if not _NUMPY_LOADED:
+            try:
+                import numpy
+                _NUMPY = numpy
+            except Exception:
+                _NUMPY = None
+            _NUMPY_LOADED = True
+        return _NUMPY
+
+
+def plan_table(
+    engine_input: Dict[str, Any],
+    planned: List[Dict[str, Any]],
+    work_start: int,
+    work_end: int,
+    grid: int,
+) -> Optional[PlanTable]:
+    """Columnas del plan con la misma semántica que `score_plan` y `compute_main_zone_occupied_slots`."""
+    np = load_numpy()
+    if np is None:
+        return None
+    tasks_by_id = {int(t.get("id")): t for t in engine_input.get("tasks", [])}
+    main_zone_raw = engine_input.get("optimizerMainZoneId")
+    try:
+        main_zone = int(main_zone_raw)
+    except Exception:
+        main_zone = 0
+    n = len(planned)
+    columns = {name: np.zeros(n, dtype=np.int64) for name in ["task_ids", "start", "end", "space", "zone", "template", "contestant"]}
+    rows_by_tid: Dict[int, List[int]] = {}
+    for i, p in enumerate(planned):
+        tid = int(p["taskId"]) if p.get("taskId") is not None else -1
+        t = tasks_by_id.get(tid) or {}
+        columns["task_ids"][i] = tid
+        columns["start"][i] = parse_hhmm(p.get("startPlanned"))
+        columns["end"][i] = parse_hhmm(p.get("endPlanned"))
+        columns["space"][i] = int(t.get("spaceId") or 0)
+        columns["zone"][i] = int(t.get("zoneId") or 0)
+        columns["template"][i] = int(t.get("templateId") or 0)
+        columns["contestant"][i] = int(t.get("contestantId") or 0)
+        rows_by_tid.setdefault(tid, []).append(i)
+    scored = columns["task_ids"] >= 0
+    in_main = (columns["zone"] == main_zone) if main_zone_raw else np.zeros(n, dtype=bool)
+    return PlanTable(
+        **columns,
+        scored=scored,
+        main_gap=scored & in_main,
+        main_occupancy=(columns["task_ids"] > 0) & in_main & (main_zone > 0),
+        rows_by_tid=rows_by_tid,
+        work_start=work_start,
+        work_end=work_end,
+        grid=grid,
+    )
+
+
+def score_plans(table: PlanTable, starts: Any, ends: Any) -> Dict[str, Any]:
+    """Puntúa a la vez varios planes candidatos `(planes, filas)` sobre las filas de `table`.
+
+    Devuelve arrays por plan con `score`, `gap`, `switches` (idénticos a
+    `score_plan`), `mainZoneOccupiedSlots` y `makespan` (minutos desde el
+    inicio de jornada), calculados con ordenaciones y diferencias vectorizadas.
+    """
+    np = load_numpy()
+    starts = np.atleast_2d(np.asarray(starts, dtype=np.int64))
+    ends = np.atleast_2d(np.asarray(ends, dtype=np.int64))
+    plans = starts.shape[0]
+
+    # Cambios de template consecutivos dentro de cada espacio (orden estable por inicio).
+    cols = np.flatnonzero(table.scored)
+    s = starts[:, cols]
+    space = np.broadcast_to(table.space[cols], s.shape)
+    template = np.broadcast_to(table.template[cols], s.shape)
+    order = np.lexsort((s, space), axis=-1)
+    space_sorted = np.take_along_axis(space, order, axis=1)
+    template_sorted = np.take_along_axis(template, order, axis=1)
+    switches = ((space_sorted[:, 1:] == space_sorted[:, :-1]) & (template_sorted[:, 1:] != template_sorted[:, :-1])).sum(axis=1)
+
+    # Huecos entre intervalos consecutivos de la zona principal.
+    main_cols = np.flatnonzero(table.main_gap)
+    gap = np.zeros(plans, dtype=np.int64)
+    if len(main_cols) > 1:
+        main_start = starts[:, main_cols]
+        order = np.argsort(main_start, axis=1, kind="stable")
+        main_start = np.take_along_axis(main_start, order, axis=1)
+        main_end = np.take_along_axis(ends[:, main_cols], order, axis=1)
+        gap = np.clip(main_start[:, 1:] - main_end[:, :-1], 0, None).sum(axis=1)
+
+    # Slots de la zona principal cubiertos por al menos una tarea.
+    horizon = max(1, (table.work_end - table.work_start) // table.grid)
+    occupied = np.zeros(plans, dtype=np.int64)
+    occ_cols = np.flatnonzero(table.main_occupancy)
+    if len(occ_cols):
+        s_slot = np.maximum(0, (starts[:, occ_cols] - table.work_start) // table.grid)
+        e_slot = np.minimum(horizon, (ends[:, occ_cols] - table.work_start + (table.grid - 1)) // table.grid)
+        valid = s_slot < e_slot
+        rows = np.broadcast_to(np.arange(plans)[:, None], s_slot.shape)
+        coverage = np.zeros((plans, horizon + 1), dtype=np.int64)
+        np.add.at(coverage, (rows[valid], s_slot[valid]), 1)
+        np.add.at(coverage, (rows[valid], e_slot[valid]), -1)
+        occupied = (np.cumsum(coverage, axis=1)[:, :horizon] > 0).sum(axis=1)
+
+    makespan = (ends.max(axis=1) if ends.shape[1] else np.full(plans, table.work_start)) - table.work_start
+    return {
+        "score": gap * 10 + switches * 5,
+        "gap": gap,
+        "switches": switches,
+        "mainZoneOccupiedSlots": occupied,
+        "makespan": makespan,
+    }
+
+
+def plan_with_starts(table: PlanTable, starts_by_tid: Dict[int, Tuple[int, int]]) -> Tuple[Any, Any]:
+    """Copia inicio/fin del plan base sustituyendo las filas de `starts_by_tid` (minutos)."""
+    start = table.start.copy()
+    end = table.end.copy()
+    for tid, (start_m, end_m) in starts_by_tid.items():
+        for row in table.rows_by_tid.get(tid, []):
+            start[row] = start_m
+            end[row] = end_m
+    return start, end
+
+
+@dataclass
+class MainZoneOccupancy:
+    occ_vars: Dict[int, Any] = field(default_factory=dict)
+    # Literales (tarea, slot) en columnas paralelas de enteros: el hint solo necesita el índice CP-SAT.
+    cover_tids: array = field(default_factory=lambda: array("q"))
+    cover_slots: array = field(default_factory=lambda: array("q"))
+    cover_vars: array = field(default_factory=lambda: array("q"))
+    inside_vars: Dict[int, Any] = field(default_factory=dict)
+    slot_set: set = field(default_factory=set)
+    total_slots: int = 0
+    forced_slots: int = 0
+    compact_mode: str = ""
+    model_sizes: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+    def add_cover(self, tid: int, slot: int, var: Any) -> None:
+        self.cover_tids.append(tid)
+        self.cover_slots.append(slot)
+        self.cover_vars.append(var.Index())
+
+
+def link_cover(cp_model: Any, model: Any, start: Any, lo: int, hi: int, horizon: int, cover: Any) -> None:
+    """`cover` ⇔ `lo <= start <= hi`: el literal vale exactamente si la tarea pisa el slot."""
+    model.AddLinearConstraint(start, lo, hi).OnlyEnforceIf(cover)
+    outside = [[a, b] for a, b in ((0, lo - 1), (hi + 1, horizon)) if a <= b]
+    if outside:
+        model.AddLinearExpressionInDomain(start, cp_model.Domain.FromIntervals(outside)).OnlyEnforceIf(cover.Not())
+    else:
+        model.AddBoolOr([cover])
+
+
+def add_main_zone_occupancy(
+    cp_model: Any,
+    model: Any,
+    encoding: str,
+    occ_slots: List[int],
+    main_zone_task_ids: List[int],
+    start_vars: Dict[int, Any],
+    domain_by_tid: Dict[int, Tuple[int, int]],
+    duration_slots_by_tid: Dict[int, int],
+    horizon: int,
+    main_zone_disjoint: bool,
+    names: bool = True,
+) -> MainZoneOccupancy:
+    """Ocupación de slots de la zona principal.
+
+    `cover` crea un literal por cada par (tarea, slot) de `occ_slots`. `compact`
+    evita ese producto: si las tareas de zona principal no pueden solaparse
+    entre sí (comparten un grupo NoOverlap) los slots ocupados son la suma de
+    `|intervalo ∩ occ_slots|` por tarea, que se obtiene con un `AddElement` por
+    tarea movible sobre una tabla constante. Si pueden solaparse, solo crea
+    literales para las tareas cuyo dominio alcanza el slot y cuenta como
+    constantes los slots cubiertos en cualquier posición. Las tres variantes
+    son exactas (cada literal de cobertura equivale a que la tarea pise el slot
+    y `occ` al OR de sus coberturas), así que `main_zone_empty_slots` vale lo
+    mismo en cualquier solución, no solo cuando se minimiza: también con cotas
+    de `lexicographic` u objetivos por término de `convergence`. Con
+    `names=False` (`leanModel`) las variables se crean sin nombre.
+    """
+    result = MainZoneOccupancy()
+    occ_slot_set = set()
+    reachable_by_slot: Dict[int, List[Tuple[int, int, int]]] = {}
+    forced_by_slot: Dict[int, bool] = {}
+    cover_pairs = 0
+    reachable_pairs = 0
+    reachable_slots = 0
+    for s in occ_slots:
+        fits = 0
+        reachable: List[Tuple[int, int, int]] = []
+        forced = False
+        for tid in main_zone_task_ids:
+            dur_slots = duration_slots_by_tid.get(tid, 1)
+            if max(0, s - dur_slots + 1) > min(horizon - dur_slots, s):
+                continue
+            fits += 1
+            lb, ub = domain_by_tid.get(tid, (0, horizon - dur_slots))
+            lo = max(lb, s - dur_slots + 1)
+            hi = min(ub, s)
+            if lo > hi:
+                continue
+            if lo == lb and hi == ub:
+                forced = True
+            reachable.append((tid, lo, hi))
+        if not fits:
+            continue
+        occ_slot_set.add(s)
+        reachable_by_slot[s] = reachable
+        forced_by_slot[s] = forced
+        cover_pairs += fits
+        if reachable and not forced:
+            reachable_pairs += len(reachable)
+            reachable_slots += 1
+    result.slot_set = occ_slot_set
+    result.total_slots = len(occ_slot_set)
+
+    movable_main = [tid for tid in main_zone_task_ids if domain_by_tid.get(tid, (0, 0))[0] < domain_by_tid.get(tid, (0, 0))[1]]
+    result.model_sizes = {
+        "cover": {"vars": cover_pairs + result.total_slots, "constraints": 4 * cover_pairs + 3 * result.total_slots},
+        "compact": (
+            {"vars": len(movable_main), "constraints": len(movable_main)}
+            if main_zone_disjoint
+            else {"vars": reachable_pairs + reachable_slots, "constraints": 3 * reachable_pairs + reachable_slots}
+        ),
+    }
+
+    if encoding == "compact" and main_zone_disjoint:
+        result.compact_mode = "element"
+        for tid in main_zone_task_ids:
+            dur_slots = duration_slots_by_tid.get(tid, 1)
+            lb, ub = domain_by_tid.get(tid, (0, horizon - dur_slots))
+            if ub < lb:
+                continue
+            table = [
+                sum(1 for slot in range(p, p + dur_slots) if slot in occ_slot_set) if p >= lb else 0
+                for p in range(ub + 1)
+            ]
+            if lb == ub:
+                result.forced_slots += table[lb]
+                continue
+            inside = model.NewIntVar(min(table[lb:]), max(table[lb:]), var_name(names, "main_inside_{}", tid))
+            model.AddElement(start_vars[tid], table, inside)
+            result.inside_vars[tid] = inside
+        return result
+
+    for s in sorted(occ_slot_set):
+        if encoding == "compact":
+            result.compact_mode = "reachable"
+            reachable = reachable_by_slot[s]
+            if forced_by_slot[s]:
+                result.forced_slots += 1
+                continue
+            if not reachable:
+                continue
+            cover_bools = []
+            for tid, lo, hi in reachable:
+                b = model.NewBoolVar(var_name(names, "cover_{}_{}", tid, s))
+                link_cover(cp_model, model, start_vars[tid], lo, hi, horizon, b)
+                cover_bools.append(b)
+                result.add_cover(tid, s, b)
+            occ = model.NewBoolVar(var_name(names, "occ_{}", s))
+            model.AddBoolOr(cover_bools).OnlyEnforceIf(occ)
+            for b in cover_bools:
+                model.AddImplication(b, occ)
+            result.occ_vars[s] = occ
+            continue
+
+        cover_bools = []
+        for tid in main_zone_task_ids:
+            dur_slots = duration_slots_by_tid.get(tid, 1)
+            if max(0, s - dur_slots + 1) > min(horizon - dur_slots, s):
+                continue
+            b = model.NewBoolVar(var_name(names, "cover_{}_{}", tid, s))
+            link_cover(cp_model, model, start_vars[tid], s - dur_slots + 1, s, horizon, b)
+            cover_bools.append(b)
+            result.add_cover(tid, s, b)
+        occ = model.NewBoolVar(var_name(names, "occ_{}", s))
+        model.AddBoolOr(cover_bools).OnlyEnforceIf(occ)
+        model.AddBoolAnd(b.Not() for b in cover_bools).OnlyEnforceIf(occ.Not())
+        model.AddBoolOr([occ.Not(), *cover_bools])
+        for b in cover_bools:
+            model.AddImplication(b, occ)
+        result.occ_vars[s] = occ
+    return result
+
+
+def planned_resources(row: Dict[str, Any], task: Dict[str, Any]) -> List[Any]:
+    """Recursos de una fila warm; sin `assignedResources`, los de la tarea."""
+    resources = row.get("assignedResources")
+    if resources is None:
+        resources = task.get("assignedResources") or task.get("resourceIds") or []
+    return resources if isinstance(resources, list) else []
+
+
+def tasks_pairwise_disjoint(task_ids: List[int], groups_by_tid: Dict[int, List[Tuple[str, int]]]) -> bool:
+    """True si cada par de tareas comparte al menos un grupo NoOverlap."""
+    for i, tid in enumerate(task_ids):
+        groups = set(groups_by_tid.get(tid) or [])
+        for other in task_ids[i + 1:]:
+            if groups.isdisjoint(groups_by_tid.get(other) or []):
+                return False
+    return True
+
+
+def load_cp_model() -> Any:
+    """Importa OR-Tools una sola vez por proceso; None si no está disponible."""
+    global _CP_MODEL, _CP_MODEL_LOADED
+    with _CP_MODEL_LOCK:
+        if not _CP_MODEL_LOADED:
+            try:
+                from ortools.sat.python import cp_model
+                _CP_MODEL = cp_model
+            except Exception:
+                _CP_MODEL = None
+            _CP_MODEL_LOADED = True
+        return _CP_MODEL
+
+
+def baseline_result(
+    engine_input: Dict[str, Any],
+    warm: Dict[str, Any],
+    message: str,
+    technical: List[str],
+) -> Dict[str, Any]:
+    baseline_score, _baseline_gap, _baseline_switches = score_plan(engine_input, list(warm.get("plannedTasks") or []))
+    return {
+        "output": warm,
+        "quality": {
+            "improved": False,
+            "baselineScore": baseline_score,
+            "optimizedScore": baseline_score,
+            "objectiveDelta": 0,
+            "mainZoneGapMinutesDelta": 0,
+            "spaceSwitchesDelta": 0,
+        },
+        "degradations": [],
+        "message": message,
+        "technicalDetails": technical,
+    }
+
+
+# Reglas duras que comprueba `validate_plan`, en el orden en que se informan.
+HARD_RULES = ["window", "lock", "meal", "dependency", "overlap"]
+
+
+def space_capacities(engine_input: Dict[str, Any]) -> Dict[int, int]:
+    """Espacios con más de un hueco simultáneo (`spaceCapacityById`, o su alias `spaceConcurrencyById`)."""
+    capacities: Dict[int, int] = {}
+    for source in (engine_input.get("spaceConcurrencyById") or {}, engine_input.get("spaceCapacityById") or {}):
+        for sid, capacity in source.items():
+            try:
+                capacities[int(sid)] = int(capacity)
+            except (TypeError, ValueError):
+                continue
+    return {sid: capacity for sid, capacity in capacities.items() if sid > 0 and capacity > 1}
+
+
+def resource_pools(engine_input: Dict[str, Any]) -> Dict[int, Tuple[List[int], int]]:
+    """Pools de unidades intercambiables (`resourcePools`): id -> (unidades, capacidad simultánea).
+
+    La capacidad por defecto es el número de unidades y nunca lo supera. Una
+    unidad declarada en dos pools se queda en el primero.
+    """
+    pools: Dict[int, Tuple[List[int], int]] = {}
+    seen: set = set()
+    for pool in engine_input.get("resourcePools") or []:
+        try:
+            pool_id = int(pool.get("id"))
+            units = [int(rid) for rid in pool.get("resourceIds") or [] if int(rid or 0) > 0 and int(rid) not in seen]
+            capacity = min(len(units), int(pool.get("capacity") or len(units)))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if pool_id > 0 and units and capacity > 0 and pool_id not in pools:
+            pools[pool_id] = (units, capacity)
+            seen.update(units)
+    return pools
+
+
+def load_fits(items: List[Tuple[int, int, int]], start: int, end: int, demand: int, capacity: int) -> bool:
+    """True si `[start, end)` con `demand` cabe junto a `items` (inicio, fin, demanda) sin superar `capacity`."""
+    overlapping = [(s, e, d) for s, e, d in items if s < end and e > start]
+    # La carga máxima se alcanza al inicio del nuevo intervalo o al empezar alguno de los que solapan.
+    for t in [start] + [s for s, _e, _d in overlapping if s > start]:
+        if demand + sum(d for s, e, d in overlapping if s <= t < e) > capacity:
+            return False
+    return True
+
+
+def color_units(
+    items: List[Tuple[int, int, int, int, List[int], bool]],
+    units: List[int],
+) -> Tuple[Dict[int, List[int]], int]:
+    """Coloreado voraz de intervalos: reparte unidades concretas de un pool entre tareas.
+
+    `items` son `(inicio, fin, tid, demanda, preferidas, fija)`. Las fijas
+    conservan sus preferidas; el resto, por orden de inicio, toma primero sus
+    preferidas libres y después las libres en el orden de `units`. Si la carga
+    nunca supera la capacidad esto siempre encuentra unidades; si una tarea no
+    cabe (por las fijas) completa con unidades ocupadas, empezando por sus
+    preferidas, y cuenta como conflicto: el solape queda a la vista de `validate_plan`.
+    """
+    busy: Dict[int, List[Tuple[int, int]]] = {unit: [] for unit in units}
+    assigned: Dict[int, List[int]] = {}
+    conflicts = 0
+
+    def free(unit: int, start: int, end: int) -> bool:
+        return unit in busy and all(end <= s or start >= e for s, e in busy[unit])
+
+    for start, end, tid, demand, preferred, pinned in sorted(items, key=lambda item: (not item[5], item[0], item[2])):
+        if pinned:
+            chosen = list(preferred)
+        else:
+            candidates = [unit for unit in preferred if free(unit, start, end)]
+            candidates += [unit for unit in units if unit not in preferred and free(unit, start, end)]
+            chosen = candidates[:demand]
+            if len(chosen) < demand:
+                conflicts += 1
+                chosen += [unit for unit in dict.fromkeys(preferred + units) if unit not in chosen][:demand - len(chosen)]
+        for unit in chosen:
+            busy.setdefault(unit, []).append((start, end))
+        assigned[tid] = chosen
+    return assigned, conflicts
+
+# Violaciones detalladas por respuesta; `violationCount` y `counts` siempre son completos.
+VALIDATION_MAX_VIOLATIONS = 200
+
+FIXED_TASK_STATUSES = ["in_progress", "done", "cancelled"]
+
+
+def validate_plan(payload: Dict[str, Any], planned: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Comprueba las reglas duras de un plan en minutos, sin OR-Tools ni modelo.
+
+    Ventanas de concursante/jornada, locks, bloque de comida (solo tareas
+    movibles, como en el modelo), dependencias y NoOverlap por espacio,
+    concursante y recurso. Los solapes se detectan con un barrido por grupo
+    sobre intervalos ordenados: O(n log n). `planned` por defecto es el warm start.
+    """
+    started = time.perf_counter()
     engine_input = payload.get("engineInput") or {}
-    warm = payload.get("warmStart") or {}
-    time_limit_seconds = float(payload.get("timeLimitSeconds") or 0)
+    if planned is None:
+        planned = list((payload.get("warmStart") or {}).get("plannedTasks") or [])
     pilot_mode = bool(payload.get("pilotMode"))
-    requested_movable_ids = {int(v) for v in (payload.get("movableTaskIds") or [])}
+    movable_ids = {int(v) for v in (payload.get("movableTaskIds") or [])}
+    work_day = engine_input.get("workDay") or {}
+    work_start = parse_hhmm(work_day.get("start", "00:00"))
+    work_end = parse_hhmm(work_day.get("end", "23:55"))
+    tasks_by_id = {int(t.get("id")): t for t in engine_input.get("tasks", [])}
+    availability = engine_input.get("contestantAvailabilityById") or {}
+    locks: Dict[int, Dict[str, Any]] = {}
+    for lock in engine_input.get("locks", []):
+        tid = int(lock.get("taskId") or -1)
+        if tid > 0 and str(lock.get("lockType") or "") in ["time", "full"]:
+            locks.setdefault(tid, lock)
+    meal = engine_input.get("meal") or {}
+    meal_window = None
+    if meal.get("start") and meal.get("end"):
+        meal_window = (parse_hhmm(str(meal["start"])), parse_hhmm(str(meal["end"])))
+    capacities = {("space", sid): capacity for sid, capacity in space_capacities(engine_input).items()}
+
+    violations: List[Dict[str, Any]] = []
+    counts: Counter = Counter()
+    # Tareas fijas en la posición del plan: un conflicto solo entre ellas hace el modelo infactible.
+    anchored_ids = set()
+    fixed_conflicts = 0
+
+    def violation(rule: str, task_ids: List[int], **detail: Any) -> None:
+        nonlocal fixed_conflicts
+        counts[rule] += 1
+        if rule != "meal" and all(tid in anchored_ids for tid in task_ids):
+            fixed_conflicts += 1
+        if len(violations) < VALIDATION_MAX_VIOLATIONS:
+            violations.append({"rule": rule, "taskIds": task_ids, **detail})
+
+    intervals: Dict[int, Tuple[int, int]] = {}
+    groups: Dict[Tuple[str, int], List[Tuple[int, int, int]]] = {}
+    for row in planned:
+        tid = int(row.get("taskId") or -1)
+        if tid < 0 or not row.get("startPlanned") or not row.get("endPlanned"):
+            continue
+        start, end = parse_hhmm(str(row["startPlanned"])), parse_hhmm(str(row["endPlanned"]))
+        intervals[tid] = (start, end)
+        task = tasks_by_id.get(tid) or {}
+        lock = locks.get(tid)
+        fixed = (
+            str(task.get("status") or "pending") in FIXED_TASK_STATUSES
+            or lock is not None
+            or (pilot_mode and tid not in movable_ids)
+        )
+        if lock is not None:
+            locked_start = lock.get("lockedStart")
+            locked_end = lock.get("lockedEnd")
+            if (locked_start and parse_hhmm(str(locked_start)) != start) or (locked_end and parse_hhmm(str(locked_end)) != end):
+                violation("lock", [tid], start=to_hhmm(start), lockedStart=locked_start, lockedEnd=locked_end)
+                fixed = False
+        if fixed:
+            anchored_ids.add(tid)
+        contestant_id = int(task.get("contestantId") or 0)
+        window = availability.get(str(contestant_id)) or availability.get(contestant_id) or {}
+        window_start = parse_hhmm(window["start"]) if isinstance(window, dict) and window.get("start") else work_start
+        window_end = parse_hhmm(window["end"]) if isinstance(window, dict) and window.get("end") else work_end
+        if start < max(work_start, window_start) or end > min(work_end, window_end):
+            violation("window", [tid], start=to_hhmm(start), end=to_hhmm(end),
+                      window=[to_hhmm(max(work_start, window_start)), to_hhmm(min(work_end, window_end))])
+        if lock is None and not fixed and meal_window is not None and start < meal_window[1] and end > meal_window[0]:
+            violation("meal", [tid], start=to_hhmm(start), end=to_hhmm(end))
+        resources = row.get("assignedResources")
+        if resources is None:
+            resources = task.get("assignedResources") or task.get("resourceIds") or []
+        keys = [("space", int(task.get("spaceId") or 0)), ("contestant", contestant_id)]
+        keys.extend(("resource", int(rid or 0)) for rid in (resources if isinstance(resources, list) else []))
+        for key in keys:
+            if key[1] > 0:
+                groups.setdefault(key, []).append((start, end, tid))
+
+    for tid, (start, _end) in intervals.items():
+        for did in (tasks_by_id.get(tid) or {}).get("dependsOnTaskIds") or []:
+            dep = intervals.get(int(did))
+            if dep is not None and start < dep[1]:
+                violation("dependency", [int(did), tid], start=to_hhmm(start), dependencyEnd=to_hhmm(dep[1]))
+
+    for (kind, key), items in groups.items():
+        items.sort()
+        capacity = capacities.get((kind, key), 1)
+        if capacity > 1:
+            # Espacio con varios huecos: solo es solape si se supera la capacidad.
+            active: List[Tuple[int, int]] = []
+            for start, end, tid in items:
+                active = [(active_end, active_tid) for active_end, active_tid in active if active_end > start]
+                if len(active) >= capacity:
+                    first_end, first_tid = min(active)
+                    violation("overlap", [first_tid, tid], group=f"{kind}:{key}", overlapMinutes=min(end, first_end) - start, capacity=capacity)
+                active.append((end, tid))
+            continue
+        # Barrido: cada intervalo se compara con el que termina más tarde de los anteriores.
+        reach_end, reach_tid = -1, -1
+        for start, end, tid in items:
+            if start < reach_end:
+                violation("overlap", [reach_tid, tid], group=f"{kind}:{key}", overlapMinutes=min(end, reach_end) - start)
+            if end > reach_end:
+                reach_end, reach_tid = end, tid
+
+    return {
+        "valid": not counts,
+        "violationCount": sum(counts.values()),
+        "counts": {rule: counts[rule] for rule in HARD_RULES if counts[rule]},
+        "violations": violations,
+        "truncated": sum(counts.values()) > len(violations),
+        "fixedConflicts": fixed_conflicts,
+        "checkedTasks": len(intervals),
+        "seconds": round(time.perf_counter() - started, 6),
+    }
 
-    warm_planned = list(warm.get("plannedTasks") or [])
-    if time_limit_seconds <= 0:
-        baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
-        out = {
-            "output": warm,
-            "quality": {
-                "improved": False,
-                "baselineScore": baseline_score,
-                "optimizedScore": baseline_score,
-                "objectiveDelta": 0,
-                "mainZoneGapMinutesDelta": 0,
-                "spaceSwitchesDelta": 0,
-            },
-            "degradations": [],
-            "message": "Optimización CP-SAT omitida por presupuesto 0.",
-            "technicalDetails": ["time_limit_seconds<=0"],
-        }
-        sys.stdout.write(json.dumps(out))
-        return 0
 
-    try:
-        from ortools.sat.python import cp_model
-    except Exception:
-        baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
-        out = {
-            "output": warm,
-            "quality": {
-                "improved": False,
-                "baselineScore": baseline_score,
-                "optimizedScore": baseline_score,
-                "objectiveDelta": 0,
-                "mainZoneGapMinutesDelta": 0,
-                "spaceSwitchesDelta": 0,
-            },
-            "degradations": [],
-            "message": "OR-Tools no disponible; se devuelve Fase A.",
-            "technicalDetails": ["ortools_import_failed"],
-        }
-        sys.stdout.write(json.dumps(out))
-        return 0
+def validation_summary(validation: Dict[str, Any], limit: int = 20) -> Dict[str, Any]:
+    """Versión compacta para incrustar en la respuesta de un solve."""
+    return {**validation, "violations": validation["violations"][:limit], "truncated": validation["violationCount"] > limit}
 
-    grid = 5
-    work_start = parse_hhmm((engine_input.get("workDay") or {}).get("start", "00:00"))
-    work_end = parse_hhmm((engine_input.get("workDay") or {}).get("end", "23:55"))
-    horizon = max(1, (work_end - work_start) // grid)
 
-    tasks_by_id = {int(t.get("id")): t for t in engine_input.get("tasks", [])}
-    warm_by_id = {int(p.get("taskId")): p for p in warm_planned}
-    contestant_availability = engine_input.get("contestantAvailabilityById") or {}
-    planning_rows_by_tid: Dict[int, Dict[str, Any]] = {}
-    for tid, task in tasks_by_id.items():
-        wp = warm_by_id.get(tid) or {}
-        assigned_resources = wp.get("assignedResources")
-        if assigned_resources is None:
-            assigned_resources = task.get("assignedResources") or task.get("resourceIds") or []
-        planning_rows_by_tid[tid] = {
-            **wp,
-            "taskId": tid,
-            "assignedResources": assigned_resources if isinstance(assigned_resources, list) else [],
-            "assignedSpace": wp.get("assignedSpace") if "assignedSpace" in wp else task.get("spaceId"),
+def validate_request(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Modo solo validación (`validateOnly`): valida `plan` o, si falta, el warm start."""
+    plan = payload.get("plan")
+    validation = validate_plan(payload, list(plan) if isinstance(plan, list) else None)
+    return {
+        "validation": validation,
+        "message": "Plan válido." if validation["valid"] else f"El plan incumple {validation['violationCount']} regla(s) dura(s).",
+        "technicalDetails": [
+            "validateOnly=true",
+            f"violations={validation['violationCount']}",
+            *(f"violations_{rule}={count}" for rule, count in validation["counts"].items()),
+        ],
+    }
+
+
+def postcheck_result(payload: Dict[str, Any], precheck: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """Valida el plan devuelto; si rompe reglas que el warm start cumplía, se devuelve Fase A."""
+    check = validate_plan(payload, list((result.get("output") or {}).get("plannedTasks") or []))
+    validation = {"warmStart": validation_summary(precheck), "result": validation_summary(check)}
+    if not check["valid"] and precheck["valid"]:
+        fallback = baseline_result(
+            payload.get("engineInput") or {},
+            payload.get("warmStart") or {},
+            "El plan CP-SAT no supera la validación de reglas duras; se devuelve Fase A.",
+            ["postcheck_failed", f"postcheckViolations={check['violationCount']}", *result.get("technicalDetails", [])],
+        )
+        fallback["validation"] = validation
+        return fallback
+    result["validation"] = validation
+    result.setdefault("technicalDetails", []).append(f"postcheckViolations={check['violationCount']}")
+    return result
+
+
+@dataclass
+class RequestProfile:
+    """Telemetría de una petición: tiempos monotónicos por fase y estadísticas del modelo y del solver."""
+    started: float = field(default_factory=time.perf_counter)
+    phases: Dict[str, float] = field(default_factory=dict)
+    model_blocks: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    model: Dict[str, Any] = field(default_factory=dict)
+    objective_terms: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    solver: Dict[str, Any] = field(default_factory=dict)
+    pstats: Dict[str, Any] = field(default_factory=dict)
+    memory: Dict[str, Any] = field(default_factory=dict)
+    capture: Optional["cp_sat_cache.PendingCapture"] = None
+    # Estado del solve que produjo la respuesta (monolítico, `decompose` o `lns`); None si no llegó a resolverse nada.
+    outcome: Optional[str] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def to_dict(self) -> Dict[str, Any]:
+        document: Dict[str, Any] = {
+            "totalSeconds": round(time.perf_counter() - self.started, 4),
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "memory": {"peakRssMb": peak_rss_mb(), **self.memory},
         }
+        if self.model or self.model_blocks:
+            document["model"] = {**self.model, "byBlock": self.model_blocks}
+        if self.objective_terms:
+            document["objectiveTerms"] = self.objective_terms
+        if self.solver:
+            document["solver"] = self.solver
+        if self.pstats:
+            document["pstats"] = self.pstats
+        return document
+
+
+class PhaseLaps:
+    """Cronómetro por vueltas: cada `lap(nombre)` suma el tiempo desde la vuelta anterior.
+
+    Con `model`, también atribuye al bloque las variables y restricciones creadas.
+    Sin perfil no registra nada, para no condicionar el código que lo usa.
+    """
+
+    def __init__(self, profile: Optional[RequestProfile], prefix: str, model: Any = None) -> None:
+        self.profile = profile
+        self.prefix = prefix
+        self.model = model
+        self.last = time.perf_counter()
+        self.last_sizes = self.sizes()
+
+    def sizes(self) -> Tuple[int, int]:
+        if self.profile is None or self.model is None:
+            return 0, 0
+        proto = self.model.Proto()
+        return len(proto.variables), len(proto.constraints)
+
+    def __call__(self, name: str) -> None:
+        if self.profile is None:
+            return
+        now = time.perf_counter()
+        self.profile.add(f"{self.prefix}.{name}", now - self.last)
+        self.last = now
+        if self.model is not None:
+            sizes = self.sizes()
+            block = self.profile.model_blocks.setdefault(name, {"variables": 0, "constraints": 0})
+            block["variables"] += sizes[0] - self.last_sizes[0]
+            block["constraints"] += sizes[1] - self.last_sizes[1]
+            self.last_sizes = sizes
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de memoria residente del proceso (MiB); en modo worker es el pico acumulado."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KiB; macOS, bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    """Memoria residente actual del proceso (MiB) desde `/proc/self/statm`; None fuera de Linux."""
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as handle:
+            resident_pages = int(handle.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def var_name(enabled: bool, template: str, *ids: Any) -> str:
+    """Nombre de una variable CP-SAT; vacío en `leanModel` para no formatear ni guardar la cadena."""
+    return template.format(*ids) if enabled else ""
+
+
+@dataclass
+class TaskSpec:
+    """Datos de una tarea ya traducidos al grid, independientes de OR-Tools."""
+    tid: int
+    dur_slots: int
+    warm_slot: int
+    has_warm: bool
+    lb: int
+    ub: int
+    window_lb: int
+    window_ub: int
+    fixed: bool
+    fixed_by_lock: bool
+    fixed_ws: int
+    space_id: int
+    contestant_id: int
+    zone_id: int
+    template_id: int
+    resource_ids: List[int]
+    depends_on: List[int]
+    near_hard: bool
+    domain_intervals: Optional[List[Tuple[int, int]]] = None
+    meal_in_domain: bool = False
+    # Grupos con capacidad (`("pool", id)`, espacios de varios huecos) -> demanda de la tarea.
+    cumulative_demands: Dict[Tuple[str, int], int] = field(default_factory=dict)
+
+    def allows(self, slot: int) -> bool:
+        if self.domain_intervals is None:
+            return self.lb <= slot <= self.ub
+        return any(lo <= slot <= hi for lo, hi in self.domain_intervals)
+
+
+@dataclass
+class SolveContext:
+    payload: Dict[str, Any]
+    engine_input: Dict[str, Any]
+    warm: Dict[str, Any]
+    warm_planned: List[Dict[str, Any]]
+    time_limit_seconds: float
+    pilot_mode: bool
+    requested_movable_ids: set
+    occupancy_encoding: str
+    grid: int
+    work_start: int
+    work_end: int
+    horizon: int
+    tasks_by_id: Dict[int, Dict[str, Any]]
+    warm_by_id: Dict[int, Dict[str, Any]]
+    specs: Dict[int, TaskSpec]
+    main_zone_id: int
+    meal_slots: Optional[Tuple[int, int]]
+    near_hard_breaks_max: int
+    details: List[str] = field(default_factory=list)
+    report: Dict[str, Any] = field(default_factory=dict)
+    plan_table: Optional[PlanTable] = None
+    profile: Optional[RequestProfile] = None
+    hint_starts: Dict[int, int] = field(default_factory=dict)
+    capacities: Dict[Tuple[str, int], int] = field(default_factory=dict)
+    pool_units: Dict[int, List[int]] = field(default_factory=dict)
+    # False en `leanModel`: variables sin nombre (salvo depuración, `profileModelKinds` o captura).
+    var_names: bool = True
+
+    def movable_task_ids(self) -> List[int]:
+        return [tid for tid, spec in self.specs.items() if not spec.fixed]
+
+
+@dataclass
+class ModelBuild:
+    model: Any
+    start_vars: Dict[int, Any] = field(default_factory=dict)
+    end_vars: Dict[int, Any] = field(default_factory=dict)
+    intervals: Dict[int, Any] = field(default_factory=dict)
+    movable_task_ids: List[int] = field(default_factory=list)
+    degrade_bools: List[Tuple[int, Any]] = field(default_factory=list)
+    abs_diffs: Dict[int, Any] = field(default_factory=dict)
+    occupancy: MainZoneOccupancy = field(default_factory=MainZoneOccupancy)
+    makespan: Any = None
+    main_zone_empty_slots: Any = None
+    span_vars: Dict[int, Any] = field(default_factory=dict)
+    dispersion_vars: Dict[Tuple[int, int], Any] = field(default_factory=dict)
+    keep_bools: Dict[int, Any] = field(default_factory=dict)
+    before_meal_bools: Dict[int, Any] = field(default_factory=dict)
+    span_bounds: Dict[int, Tuple[List[int], Any, Any]] = field(default_factory=dict)
+    dispersion_bounds: Dict[Tuple[int, int], Tuple[List[int], Any, Any]] = field(default_factory=dict)
+    hint: Dict[str, Any] = field(default_factory=dict)
+    symmetry_classes: List[List[int]] = field(default_factory=list)
+    # Índices de restricciones por tarea, para parchear o retirar el modelo al reutilizarlo.
+    task_constraints: Dict[int, List[int]] = field(default_factory=dict)
+    parametric: Dict[Tuple[str, int], List[int]] = field(default_factory=dict)
+    group_constraints: Dict[Tuple[str, int], int] = field(default_factory=dict)
+    group_members: Dict[Tuple[str, int], List[int]] = field(default_factory=dict)
+    makespan_constraint: Optional[int] = None
+    span_constraints: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    retired_vars: int = 0
+
+    def own(self, tid: int, kind: Optional[str], *constraints: Any) -> None:
+        """Anota restricciones de la tarea `tid`; con `kind`, también como parámetro parcheable."""
+        indices = [constraint.Index() for constraint in constraints]
+        self.task_constraints.setdefault(tid, []).extend(indices)
+        if kind is not None:
+            self.parametric[(kind, tid)] = indices
+
+
+@dataclass
+class TaskIndex:
+    """Índices del payload que comparten todas las tareas al calcular su `TaskSpec`."""
+    grid: int
+    work_start: int
+    work_end: int
+    horizon: int
+    contestant_availability: Dict[Any, Any]
+    locks_by_task: Dict[int, Dict[str, Any]]
+    grouping: Dict[Any, Any]
+    pool_by_unit: Dict[int, int]
+    capacities: Dict[Tuple[str, int], int]
+    pilot_mode: bool
+    requested_movable_ids: set
+
+
+@dataclass
+class BatchBase:
+    """Trabajo del escenario base de un lote que cada variante reutiliza.
+
+    `ctx` es el contexto antes del horizonte rodante y del ajuste de dominios,
+    que mutan las especificaciones; cada variante trabaja sobre una copia.
+    """
+    payload: Dict[str, Any]
+    ctx: SolveContext
+    index: TaskIndex
+    precheck: Dict[str, Any]
+
+
+# Campos de `engineInput` que una variante puede cambiar sin reconstruir el contexto desde cero.
+DERIVABLE_ENGINE_INPUT_FIELDS = [
+    "tasks",
+    "locks",
+    "contestantAvailabilityById",
+    "meal",
+    "optimizerMainZoneId",
+    "optimizerNearHardBreaksMax",
+]
+
+
+def locks_by_task_id(engine_input: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
     locks_by_task: Dict[int, Dict[str, Any]] = {}
     for lock in engine_input.get("locks", []):
         task_id = int(lock.get("taskId") or -1)
@@ -165,390 +1013,1722 @@ def main() -> int:
             continue
         if task_id not in locks_by_task:
             locks_by_task[task_id] = lock
-
-    def warm_with_message(message: str, technical: List[str]) -> int:
-        baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
-        out = {
-            "output": warm,
-            "quality": {
-                "improved": False,
-                "baselineScore": baseline_score,
-                "optimizedScore": baseline_score,
-                "objectiveDelta": 0,
-                "mainZoneGapMinutesDelta": 0,
-                "spaceSwitchesDelta": 0,
-            },
-            "degradations": [],
-            "message": message,
-            "technicalDetails": technical,
-        }
-        sys.stdout.write(json.dumps(out))
+    return locks_by_task
+
+
+def lock_start_slot(index: TaskIndex, lock: Dict[str, Any], tid: int, dur_slots: int) -> Tuple[Optional[int], Optional[List[str]]]:
+    grid, work_start, work_end = index.grid, index.work_start, index.work_end
+    start_raw = lock.get("lockedStart")
+    if not start_raw:
+        return None, [f"lock_missing_lockedStart_task={tid}"]
+    start_min = parse_hhmm(str(start_raw))
+    if start_min < work_start or start_min > work_end:
+        return None, [f"lock_outside_workday_task={tid}"]
+    delta = start_min - work_start
+    if delta % grid != 0:
+        return None, [f"lock_unaligned_grid_task={tid}"]
+    start_slot = delta // grid
+    if start_slot < 0 or start_slot + dur_slots > index.horizon:
+        return None, [f"lock_outside_horizon_task={tid}"]
+
+    locked_end = lock.get("lockedEnd")
+    if locked_end:
+        end_min = parse_hhmm(str(locked_end))
+        expected_end = start_min + dur_slots * grid
+        if end_min != expected_end:
+            return None, [f"lock_duration_mismatch_task={tid}"]
+    return int(start_slot), None
+
+
+def task_spec(
+    index: TaskIndex,
+    tid: int,
+    t: Dict[str, Any],
+    p: Dict[str, Any],
+) -> Tuple[Optional[TaskSpec], Optional[Tuple[str, List[str]]]]:
+    """`TaskSpec` de la tarea `t` con su fila warm `p`, o `(None, (mensaje, detalles))` si no es modelable."""
+    grid, work_start, work_end, horizon = index.grid, index.work_start, index.work_end, index.horizon
+    warm_start = p.get("startPlanned")
+    warm_end = p.get("endPlanned")
+    warm_duration = None
+    if warm_start and warm_end:
+        warm_duration = parse_hhmm(warm_end) - parse_hhmm(warm_start)
+    dur_min = int(t.get("durationOverrideMin") or t.get("durationMin") or max(5, warm_duration or 5))
+    dur_slots = max(1, dur_min // grid)
+
+    if warm_start:
+        ws = int((parse_hhmm(warm_start) - work_start) // grid)
+    else:
+        ws = 0
+
+    contestant_id = int(t.get("contestantId") or 0)
+    contestant_availability = index.contestant_availability
+    availability = contestant_availability.get(str(contestant_id)) or contestant_availability.get(contestant_id) or {}
+    raw_win_start = availability.get("start") if isinstance(availability, dict) else None
+    raw_win_end = availability.get("end") if isinstance(availability, dict) else None
+    win_start_min = parse_hhmm(raw_win_start) if raw_win_start else work_start
+    win_end_min = parse_hhmm(raw_win_end) if raw_win_end else work_end
+
+    if win_end_min <= win_start_min:
+        return None, (
+            "Ventana de concursante inválida; se devuelve Fase A.",
+            [f"contestant_availability_invalid_window_contestant={contestant_id}"],
+        )
+    if win_start_min < work_start or win_end_min > work_end:
+        return None, (
+            "Ventana de concursante fuera de jornada; se devuelve Fase A.",
+            [f"contestant_availability_outside_workday_contestant={contestant_id}"],
+        )
+
+    start_slot_min = max(0, (win_start_min - work_start) // grid)
+    end_slot_max = min(horizon, (win_end_min - work_start) // grid)
+
+    fixed_by_status = str(t.get("status") or "pending") in ["in_progress", "done", "cancelled"]
+    lock = index.locks_by_task.get(tid)
+    fixed_by_lock = lock is not None
+    fixed_by_pilot_scope = index.pilot_mode and tid not in index.requested_movable_ids
+    fixed = fixed_by_status or fixed_by_lock or fixed_by_pilot_scope
+
+    lock_slot = None
+    if fixed_by_lock and lock is not None:
+        lock_slot, lock_error = lock_start_slot(index, lock, tid, dur_slots)
+        if lock_error:
+            return None, ("Lock incompatible con workday/grid; se devuelve Fase A.", lock_error)
+
+    fixed_ws = lock_slot if lock_slot is not None else ws
+    default_lb, default_ub = 0, max(0, horizon - dur_slots)
+    avail_lb = start_slot_min
+    avail_ub = end_slot_max - dur_slots
+    if avail_ub < avail_lb:
+        return None, (
+            "Ventana de concursante incompatible con duración; se devuelve Fase A.",
+            [f"contestant_availability_no_room_task={tid}", f"contestant={contestant_id}"],
+        )
+
+    lb, ub = (fixed_ws, fixed_ws) if fixed else (max(default_lb, avail_lb), min(default_ub, avail_ub))
+    if ub < lb:
+        return None, (
+            "Dominio CP-SAT vacío por ventana de concursante; se devuelve Fase A.",
+            [f"contestant_availability_empty_domain_task={tid}", f"contestant={contestant_id}"],
+        )
+
+    sid = int(t.get("spaceId") or 0)
+    grouping = index.grouping
+    level = int((grouping.get(str(sid)) or grouping.get(sid) or {}).get("level") or 0)
+    resource_ids = [int(rid or 0) for rid in planned_resources(p, t)]
+    pool_by_unit = index.pool_by_unit
+    # Las unidades de un pool pasan a ser demanda sobre el pool; el resto sigue siendo NoOverlap por id.
+    cumulative_demands: Dict[Tuple[str, int], int] = {}
+    for rid in resource_ids:
+        if rid in pool_by_unit:
+            key = ("pool", pool_by_unit[rid])
+            cumulative_demands[key] = cumulative_demands.get(key, 0) + 1
+    if ("space", sid) in index.capacities:
+        cumulative_demands[("space", sid)] = 1
+    return TaskSpec(
+        tid=tid,
+        dur_slots=dur_slots,
+        warm_slot=ws,
+        has_warm=bool(warm_start),
+        lb=lb,
+        ub=ub,
+        window_lb=start_slot_min,
+        window_ub=end_slot_max - dur_slots,
+        fixed=fixed,
+        fixed_by_lock=fixed_by_lock,
+        fixed_ws=fixed_ws,
+        space_id=sid,
+        contestant_id=contestant_id,
+        zone_id=int(t.get("zoneId") or 0),
+        template_id=int(t.get("templateId") or 0),
+        resource_ids=[rid for rid in resource_ids if rid > 0 and rid not in pool_by_unit],
+        depends_on=[int(dep) for dep in (t.get("dependsOnTaskIds") or [])],
+        near_hard=level >= 10 and not fixed and bool(warm_start),
+        cumulative_demands=cumulative_demands,
+    ), None
+
+
+def main_zone_of(engine_input: Dict[str, Any]) -> int:
+    try:
+        return int(engine_input.get("optimizerMainZoneId"))
+    except Exception:
         return 0
 
-    def lock_start_slot(lock: Dict[str, Any], tid: int, dur_slots: int) -> Tuple[Optional[int], Optional[List[str]]]:
-        start_raw = lock.get("lockedStart")
-        if not start_raw:
-            return None, [f"lock_missing_lockedStart_task={tid}"]
-        start_min = parse_hhmm(str(start_raw))
-        if start_min < work_start or start_min > work_end:
-            return None, [f"lock_outside_workday_task={tid}"]
-        delta = start_min - work_start
-        if delta % grid != 0:
-            return None, [f"lock_unaligned_grid_task={tid}"]
-        start_slot = delta // grid
-        if start_slot < 0 or start_slot + dur_slots > horizon:
-            return None, [f"lock_outside_horizon_task={tid}"]
-
-        locked_end = lock.get("lockedEnd")
-        if locked_end:
-            end_min = parse_hhmm(str(locked_end))
-            expected_end = start_min + dur_slots * grid
-            if end_min != expected_end:
-                return None, [f"lock_duration_mismatch_task={tid}"]
-        return int(start_slot), None
-
-    model = cp_model.CpModel()
-    start_vars: Dict[int, Any] = {}
-    end_vars: Dict[int, Any] = {}
-    intervals: Dict[int, Any] = {}
-    duration_slots_by_tid: Dict[int, int] = {}
 
-    movable_task_ids: List[int] = []
+def near_hard_breaks_of(engine_input: Dict[str, Any]) -> int:
+    try:
+        near_hard_breaks_max = int(float(engine_input.get("optimizerNearHardBreaksMax") or 0))
+    except Exception:
+        near_hard_breaks_max = 0
+    return max(0, min(10, near_hard_breaks_max))
+
+
+def meal_slots_of(engine_input: Dict[str, Any], work_start: int, grid: int) -> Optional[Tuple[int, int]]:
+    meal = engine_input.get("meal") or {}
+    if meal.get("start") and meal.get("end"):
+        meal_start_slot = (parse_hhmm(str(meal.get("start"))) - work_start) // grid
+        meal_end_slot = (parse_hhmm(str(meal.get("end"))) - work_start) // grid
+        if meal_end_slot > meal_start_slot:
+            return (meal_start_slot, meal_end_slot)
+    return None
+
+
+def occupancy_encoding_of(payload: Dict[str, Any]) -> str:
+    occupancy_encoding = str(payload.get("occupancyEncoding") or "cover")
+    return occupancy_encoding if occupancy_encoding in OCCUPANCY_ENCODINGS else "cover"
 
+
+def index_context(
+    payload: Dict[str, Any],
+    profile: Optional[RequestProfile] = None,
+    lap: Optional[PhaseLaps] = None,
+) -> Tuple[Optional[SolveContext], Optional[Dict[str, Any]], Optional[TaskIndex]]:
+    """Parseo del payload y `TaskSpec` de cada tarea, sin horizonte rodante ni ajuste de dominios."""
+    lap = lap or PhaseLaps(profile, "prepare")
+    engine_input = payload.get("engineInput") or {}
+    warm = payload.get("warmStart") or {}
+    warm_planned = list(warm.get("plannedTasks") or [])
+    pilot_mode = bool(payload.get("pilotMode"))
+    requested_movable_ids = {int(v) for v in (payload.get("movableTaskIds") or [])}
+
+    grid = 5
+    work_start = parse_hhmm((engine_input.get("workDay") or {}).get("start", "00:00"))
+    work_end = parse_hhmm((engine_input.get("workDay") or {}).get("end", "23:55"))
+    horizon = max(1, (work_end - work_start) // grid)
+
+    tasks_by_id = {int(t.get("id")): t for t in engine_input.get("tasks", [])}
+    warm_by_id = {int(p.get("taskId")): p for p in warm_planned}
+    pools = resource_pools(engine_input)
+    capacities: Dict[Tuple[str, int], int] = {("pool", pool_id): capacity for pool_id, (_units, capacity) in pools.items()}
+    capacities.update((("space", sid), capacity) for sid, capacity in space_capacities(engine_input).items())
+    index = TaskIndex(
+        grid=grid,
+        work_start=work_start,
+        work_end=work_end,
+        horizon=horizon,
+        contestant_availability=engine_input.get("contestantAvailabilityById") or {},
+        locks_by_task=locks_by_task_id(engine_input),
+        grouping=engine_input.get("groupingBySpaceId") or {},
+        pool_by_unit={unit: pool_id for pool_id, (units, _capacity) in pools.items() for unit in units},
+        capacities=capacities,
+        pilot_mode=pilot_mode,
+        requested_movable_ids=requested_movable_ids,
+    )
+    lap("index")
+
+    specs: Dict[int, TaskSpec] = {}
     for tid, t in tasks_by_id.items():
-        p = planning_rows_by_tid.get(tid) or {}
         if tid < 0:
             continue
-        warm_start = p.get("startPlanned")
-        warm_end = p.get("endPlanned")
-        warm_duration = None
-        if warm_start and warm_end:
-            warm_duration = parse_hhmm(warm_end) - parse_hhmm(warm_start)
-        dur_min = int(t.get("durationOverrideMin") or t.get("durationMin") or max(5, warm_duration or 5))
-        dur_slots = max(1, dur_min // grid)
-
-        if warm_start:
-            ws = int((parse_hhmm(warm_start) - work_start) // grid)
-        else:
-            ws = 0
-
-        contestant_id = int(t.get("contestantId") or 0)
-        availability = contestant_availability.get(str(contestant_id)) or contestant_availability.get(contestant_id) or {}
-        raw_win_start = availability.get("start") if isinstance(availability, dict) else None
-        raw_win_end = availability.get("end") if isinstance(availability, dict) else None
-        win_start_min = parse_hhmm(raw_win_start) if raw_win_start else work_start
-        win_end_min = parse_hhmm(raw_win_end) if raw_win_end else work_end
-
-        if win_end_min <= win_start_min:
-            return warm_with_message(
-                "Ventana de concursante inválida; se devuelve Fase A.",
-                [f"contestant_availability_invalid_window_contestant={contestant_id}"],
-            )
-        if win_start_min < work_start or win_end_min > work_end:
-            return warm_with_message(
-                "Ventana de concursante fuera de jornada; se devuelve Fase A.",
-                [f"contestant_availability_outside_workday_contestant={contestant_id}"],
-            )
+        spec, error = task_spec(index, tid, t, warm_by_id.get(tid) or {})
+        if spec is None:
+            message, technical = error or ("Payload CP-SAT inválido; se devuelve Fase A.", [])
+            return None, baseline_result(engine_input, warm, message, technical), None
+        specs[tid] = spec
+    lap("tasks")
+
+    ctx = SolveContext(
+        payload=payload,
+        engine_input=engine_input,
+        warm=warm,
+        warm_planned=warm_planned,
+        time_limit_seconds=float(payload.get("timeLimitSeconds") or 0),
+        pilot_mode=pilot_mode,
+        requested_movable_ids=requested_movable_ids,
+        occupancy_encoding=occupancy_encoding_of(payload),
+        grid=grid,
+        work_start=work_start,
+        work_end=work_end,
+        horizon=horizon,
+        tasks_by_id=tasks_by_id,
+        warm_by_id=warm_by_id,
+        specs=specs,
+        main_zone_id=main_zone_of(engine_input),
+        meal_slots=meal_slots_of(engine_input, work_start, grid),
+        near_hard_breaks_max=near_hard_breaks_of(engine_input),
+        plan_table=plan_table(engine_input, warm_planned, work_start, work_end, grid),
+        profile=profile,
+        capacities=capacities,
+        pool_units={pool_id: units for pool_id, (units, _capacity) in pools.items()},
+    )
+    lap("planTable")
+    return ctx, None, index
+
+
+def same_value(a: Any, b: Any) -> bool:
+    return a is b or a == b
+
+
+def derive_context(
+    base: BatchBase,
+    payload: Dict[str, Any],
+    profile: Optional[RequestProfile] = None,
+) -> Tuple[Optional[SolveContext], Optional[Dict[str, Any]]]:
+    """Contexto de una variante a partir del contexto del escenario base.
+
+    Solo recalcula el `TaskSpec` de las tareas cuya fila, fila warm, lock o
+    ventana de concursante cambia el overlay; el resto se copia. Devuelve
+    `(None, None)` si el overlay toca algo fuera de `DERIVABLE_ENGINE_INPUT_FIELDS`
+    (jornada, agrupación, pools...) o el modo piloto: entonces se prepara desde cero.
+    """
+    base_payload, base_ctx, base_index = base.payload, base.ctx, base.index
+    engine_input = payload.get("engineInput") or {}
+    warm = payload.get("warmStart") or {}
+    base_input = base_ctx.engine_input
+    if not same_value(payload.get("pilotMode"), base_payload.get("pilotMode")):
+        return None, None
+    if not same_value(payload.get("movableTaskIds"), base_payload.get("movableTaskIds")):
+        return None, None
+    for key in set(engine_input) | set(base_input):
+        if key not in DERIVABLE_ENGINE_INPUT_FIELDS and not same_value(engine_input.get(key), base_input.get(key)):
+            return None, None
+
+    index = base_index
+    if not same_value(engine_input.get("locks"), base_input.get("locks")) or not same_value(
+        engine_input.get("contestantAvailabilityById"), base_input.get("contestantAvailabilityById")
+    ):
+        index = replace(
+            base_index,
+            locks_by_task=locks_by_task_id(engine_input),
+            contestant_availability=engine_input.get("contestantAvailabilityById") or {},
+        )
+    if same_value(engine_input.get("tasks"), base_input.get("tasks")):
+        tasks_by_id = base_ctx.tasks_by_id
+    else:
+        tasks_by_id = {int(t.get("id")): t for t in engine_input.get("tasks", [])}
+    if warm is base_ctx.warm:
+        warm_planned, warm_by_id = base_ctx.warm_planned, base_ctx.warm_by_id
+    else:
+        warm_planned = list(warm.get("plannedTasks") or [])
+        warm_by_id = {int(p.get("taskId")): p for p in warm_planned}
 
-        start_slot_min = max(0, (win_start_min - work_start) // grid)
-        end_slot_max = min(horizon, (win_end_min - work_start) // grid)
-
-        fixed_by_status = str(t.get("status") or "pending") in ["in_progress", "done", "cancelled"]
-        lock = locks_by_task.get(tid)
-        fixed_by_lock = lock is not None
-        fixed_by_pilot_scope = pilot_mode and tid not in requested_movable_ids
-        fixed = fixed_by_status or fixed_by_lock or fixed_by_pilot_scope
-
-        lock_slot = None
-        if fixed_by_lock and lock is not None:
-            lock_slot, lock_error = lock_start_slot(lock, tid, dur_slots)
-            if lock_error:
-                return warm_with_message(
-                    "Lock incompatible con workday/grid; se devuelve Fase A.",
-                    lock_error,
-                )
+    def availability(source: Dict[Any, Any], contestant_id: int) -> Any:
+        return source.get(str(contestant_id)) or source.get(contestant_id)
 
-        fixed_ws = lock_slot if lock_slot is not None else ws
-        default_lb, default_ub = 0, max(0, horizon - dur_slots)
-        avail_lb = start_slot_min
-        avail_ub = end_slot_max - dur_slots
-        if avail_ub < avail_lb:
-            return warm_with_message(
-                "Ventana de concursante incompatible con duración; se devuelve Fase A.",
-                [f"contestant_availability_no_room_task={tid}", f"contestant={contestant_id}"]
+    specs: Dict[int, TaskSpec] = {}
+    recomputed = 0
+    for tid, t in tasks_by_id.items():
+        if tid < 0:
+            continue
+        spec = base_ctx.specs.get(tid)
+        row = warm_by_id.get(tid) or {}
+        unchanged = (
+            spec is not None
+            and same_value(t, base_ctx.tasks_by_id.get(tid))
+            and same_value(row, base_ctx.warm_by_id.get(tid) or {})
+            and same_value(index.locks_by_task.get(tid), base_index.locks_by_task.get(tid))
+            and same_value(
+                availability(index.contestant_availability, spec.contestant_id),
+                availability(base_index.contestant_availability, spec.contestant_id),
             )
-
-        lb, ub = (fixed_ws, fixed_ws) if fixed else (max(default_lb, avail_lb), min(default_ub, avail_ub))
+        )
+        if unchanged:
+            specs[tid] = replace(spec)
+            continue
+        spec, error = task_spec(index, tid, t, row)
+        if spec is None:
+            message, technical = error or ("Payload CP-SAT inválido; se devuelve Fase A.", [])
+            return None, baseline_result(engine_input, warm, message, technical)
+        specs[tid] = spec
+        recomputed += 1
+
+    table = base_ctx.plan_table
+    if tasks_by_id is not base_ctx.tasks_by_id or warm_by_id is not base_ctx.warm_by_id or not same_value(
+        engine_input.get("optimizerMainZoneId"), base_input.get("optimizerMainZoneId")
+    ):
+        table = plan_table(engine_input, warm_planned, base_ctx.work_start, base_ctx.work_end, base_ctx.grid)
+    ctx = replace(
+        base_ctx,
+        payload=payload,
+        engine_input=engine_input,
+        warm=warm,
+        warm_planned=warm_planned,
+        time_limit_seconds=float(payload.get("timeLimitSeconds") or 0),
+        occupancy_encoding=occupancy_encoding_of(payload),
+        tasks_by_id=tasks_by_id,
+        warm_by_id=warm_by_id,
+        specs=specs,
+        main_zone_id=main_zone_of(engine_input),
+        meal_slots=meal_slots_of(engine_input, base_ctx.work_start, base_ctx.grid),
+        near_hard_breaks_max=near_hard_breaks_of(engine_input),
+        details=[f"batchContext=derived:recomputed={recomputed}"],
+        report={},
+        plan_table=table,
+        profile=profile,
+        hint_starts={},
+        var_names=True,
+    )
+    return ctx, None
+
+
+def same_plan_inputs(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """True si `validate_plan` daría lo mismo para ambos payloads (mismo plan, tareas y alcance piloto)."""
+    return all(same_value(a.get(key), b.get(key)) for key in ["engineInput", "warmStart", "pilotMode", "movableTaskIds"])
+
+
+def batch_base(payload: Dict[str, Any]) -> Optional[BatchBase]:
+    """Contexto y validación del escenario base de un lote; None si no es modelable."""
+    ctx, _early, index = index_context(payload)
+    if ctx is None or index is None:
+        return None
+    ctx.profile = None
+    return BatchBase(payload=payload, ctx=ctx, index=index, precheck=validate_plan(payload))
+
+
+def prepare_context(
+    payload: Dict[str, Any],
+    profile: Optional[RequestProfile] = None,
+    base: Optional[BatchBase] = None,
+) -> Tuple[Optional[SolveContext], Optional[Dict[str, Any]]]:
+    """Normaliza el payload y calcula el dominio de cada tarea.
+
+    Con `base` (variantes de `scenarios`) parte del contexto del escenario base
+    y solo recalcula lo que cambia el overlay. Devuelve `(ctx, None)` o
+    `(None, resultado Fase A)` si el payload no es modelable.
+    """
+    lap = PhaseLaps(profile, "prepare")
+    ctx: Optional[SolveContext] = None
+    if base is not None:
+        ctx, early = derive_context(base, payload, profile)
+        if early is not None:
+            return None, early
+        if ctx is not None:
+            lap("derive")
+    if ctx is None:
+        ctx, early, _index = index_context(payload, profile, lap)
+        if ctx is None:
+            return None, early
+    if ctx.plan_table is None:
+        # Sin NumPy se puntúa fila a fila con `score_plan`: mucho más lento en días grandes.
+        ctx.details.append("planScoring=scalar:numpy_unavailable")
+    if payload.get("leanModel"):
+        # Los nombres solo se conservan si alguien va a leerlos: `model_counts` por tipo o `model.pb` capturado.
+        ctx.var_names = bool(
+            payload.get("debugModelNames")
+            or payload.get("profileModelKinds")
+            or (profile is not None and profile.capture is not None)
+        )
+        ctx.details.append(f"leanModel=true:varNames={str(ctx.var_names).lower()}")
+    if ctx.capacities:
+        report_cumulative_groups(ctx)
+    if payload.get("nowMinute") is not None:
+        apply_rolling_horizon(ctx)
+        lap("rollingHorizon")
+    if payload.get("tightenDomains"):
+        tightening_error = tighten_domains(ctx)
+        lap("tightenDomains")
+        if tightening_error is not None:
+            return None, tightening_error
+    return ctx, None
+
+
+def tighten_domains(ctx: SolveContext) -> Optional[Dict[str, Any]]:
+    """Preproceso de dominios antes de construir el modelo.
+
+    Pasadas hacia delante y hacia atrás (CPM) sobre el DAG de `dependsOnTaskIds`
+    entre tareas modeladas para acotar inicio más temprano y más tardío, y el
+    bloque de comida como hueco del dominio de cada tarea movible (sustituye al
+    booleano `before_meal_`). Devuelve un resultado Fase A si hay un ciclo de
+    dependencias o un dominio queda vacío; si no, None.
+    """
+    specs = ctx.specs
+    successors: Dict[int, List[int]] = {tid: [] for tid in specs}
+    indegree: Dict[int, int] = {tid: 0 for tid in specs}
+    edges = 0
+    for tid, spec in specs.items():
+        for did in spec.depends_on:
+            if did in specs and did != tid:
+                successors[did].append(tid)
+                indegree[tid] += 1
+                edges += 1
+            elif did == tid:
+                indegree[tid] += 1
+
+    order: List[int] = []
+    queue = [tid for tid, degree in indegree.items() if degree == 0]
+    remaining = dict(indegree)
+    while queue:
+        tid = queue.pop()
+        order.append(tid)
+        for succ in successors[tid]:
+            remaining[succ] -= 1
+            if remaining[succ] == 0:
+                queue.append(succ)
+    if len(order) < len(specs):
+        cycle = sorted(tid for tid in specs if remaining[tid] > 0)
+        return baseline_result(
+            ctx.engine_input,
+            ctx.warm,
+            "Ciclo en dependencias de tareas; se devuelve Fase A.",
+            [f"dependency_cycle_tasks={','.join(str(tid) for tid in cycle[:25])}"],
+        )
+
+    meal = ctx.meal_slots
+
+    def push_after_meal(spec: TaskSpec, slot: int) -> int:
+        if meal is not None and not spec.fixed and slot + spec.dur_slots > meal[0] and slot < meal[1]:
+            return meal[1]
+        return slot
+
+    def pull_before_meal(spec: TaskSpec, slot: int) -> int:
+        if meal is not None and not spec.fixed and slot + spec.dur_slots > meal[0] and slot < meal[1]:
+            return meal[0] - spec.dur_slots
+        return slot
+
+    before = {tid: spec.ub - spec.lb + 1 for tid, spec in specs.items()}
+    earliest: Dict[int, int] = {}
+    for tid in order:
+        spec = specs[tid]
+        es = spec.lb if spec.fixed else max(spec.lb, spec.window_lb)
+        for did in spec.depends_on:
+            if did in earliest and did != tid:
+                es = max(es, earliest[did] + specs[did].dur_slots)
+        earliest[tid] = push_after_meal(spec, es)
+    latest: Dict[int, int] = {}
+    for tid in reversed(order):
+        spec = specs[tid]
+        ls = spec.ub if spec.fixed else min(spec.ub, spec.window_ub)
+        for succ in successors[tid]:
+            ls = min(ls, latest[succ] - spec.dur_slots)
+        latest[tid] = pull_before_meal(spec, ls)
+
+    by_task: List[List[int]] = []
+    removed_total = 0
+    meal_holes = 0
+    for tid in order:
+        spec = specs[tid]
+        if spec.fixed:
+            continue
+        lb, ub = earliest[tid], latest[tid]
         if ub < lb:
-            return warm_with_message(
-                "Dominio CP-SAT vacío por ventana de concursante; se devuelve Fase A.",
-                [f"contestant_availability_empty_domain_task={tid}", f"contestant={contestant_id}"]
+            return baseline_result(
+                ctx.engine_input,
+                ctx.warm,
+                "Dominio vacío tras propagar dependencias; se devuelve Fase A.",
+                [f"dependency_empty_domain_task={tid}", f"earliest={lb}", f"latest={ub}"],
             )
+        spec.lb, spec.ub = lb, ub
+        if meal is not None:
+            intervals = [
+                (lo, hi)
+                for lo, hi in [(lb, min(ub, meal[0] - spec.dur_slots)), (max(lb, meal[1]), ub)]
+                if lo <= hi
+            ]
+            if not intervals:
+                return baseline_result(
+                    ctx.engine_input,
+                    ctx.warm,
+                    "Dominio vacío por bloque de comida; se devuelve Fase A.",
+                    [f"meal_empty_domain_task={tid}"],
+                )
+            spec.domain_intervals = intervals
+            spec.meal_in_domain = True
+            meal_holes += 1
+        after = sum(hi - lo + 1 for lo, hi in spec.domain_intervals) if spec.domain_intervals else ub - lb + 1
+        if after < before[tid]:
+            removed_total += before[tid] - after
+            by_task.append([tid, before[tid], after])
+
+    total_before = sum(before[tid] for tid in specs if not specs[tid].fixed)
+    ctx.report["domainTightening"] = {
+        "dependencyEdges": edges,
+        "tasksTightened": len(by_task),
+        "slotsBefore": total_before,
+        "slotsRemoved": removed_total,
+        "mealHoles": meal_holes,
+        "byTask": by_task,
+    }
+    ctx.details.extend([
+        f"domainTighteningTasks={len(by_task)}",
+        f"domainTighteningSlotsRemoved={removed_total}",
+        f"domainTighteningRemovedPct={(100.0 * removed_total / total_before) if total_before else 0.0:.1f}",
+        f"domainTighteningMealHoles={meal_holes}",
+    ])
+    return None
+
+
+def fix_spec_at(spec: TaskSpec, slot: int) -> None:
+    spec.fixed = True
+    spec.fixed_ws = slot
+    spec.lb = slot
+    spec.ub = slot
+    spec.near_hard = False
+
+
+def apply_rolling_horizon(ctx: SolveContext) -> None:
+    """Re-optimización anclada en `nowMinute` (minutos desde 00:00).
+
+    - Las tareas fijas (hechas, en curso, bloqueadas) que terminan antes de `now`
+      salen del modelo (su fila warm se conserva); las que siguen en curso en
+      `now` quedan fijas como intervalos del entorno.
+    - Las pendientes cuyo warm start empieza antes de `now` no se han hecho: pasan
+      a movibles con `lb = now`, sin el tope de fin de ventana, y dejan de ser
+      near-hard (su warm ya no es alcanzable).
+    - Las movibles dentro de la ventana `[now, now + lookAheadMinutes)` no pueden
+      empezar antes de `now` ni terminar después del fin de la ventana (salvo que
+      su warm start ya lo hiciera).
+    - Las posteriores a la ventana quedan fijas en su warm start; las que ninguna
+      tarea movible puede alcanzar ni enlazan por dependencia salen del modelo.
+    """
+    payload = ctx.payload
+    grid = ctx.grid
+    try:
+        now_minute = int(float(payload.get("nowMinute")))
+    except Exception:
+        ctx.details.append("rollingHorizon=invalid_nowMinute")
+        return
+    now_slot = max(0, min(ctx.horizon, -(-(now_minute - ctx.work_start) // grid)))
+    window_end_slot = ctx.horizon
+    look_ahead = payload.get("lookAheadMinutes")
+    if look_ahead is not None:
+        window_end_slot = min(ctx.horizon, now_slot + max(1, -(-int(float(look_ahead)) // grid)))
+
+    counts = {"history": 0, "running": 0, "overdue": 0, "window": 0, "beyond": 0, "droppedBeyond": 0}
+    for tid in list(ctx.specs.keys()):
+        spec = ctx.specs[tid]
+        if spec.fixed:
+            if spec.fixed_ws + spec.dur_slots <= now_slot:
+                del ctx.specs[tid]
+                counts["history"] += 1
+            elif spec.fixed_ws < now_slot:
+                fix_spec_at(spec, spec.fixed_ws)
+                counts["running"] += 1
+            continue
+        start = spec.warm_slot
+        overdue = spec.has_warm and start < now_slot
+        if overdue:
+            spec.near_hard = False
+            counts["overdue"] += 1
+        elif spec.has_warm and start >= window_end_slot:
+            fix_spec_at(spec, start)
+            counts["beyond"] += 1
+            continue
+        # Las atrasadas no se limitan al final de la ventana: si no caben en ella, pasan a los huecos posteriores.
+        latest = spec.ub if overdue else window_end_slot - spec.dur_slots
+        if spec.has_warm and not overdue:
+            latest = max(latest, spec.warm_slot)
+        lb, ub = max(spec.lb, now_slot), min(spec.ub, latest)
+        if ub < lb:
+            if spec.has_warm and not overdue:
+                fix_spec_at(spec, spec.warm_slot)
+                counts["beyond"] += 1
+                continue
+            lb, ub = max(spec.lb, now_slot), spec.ub
+            if ub < lb and overdue:
+                # Atrasada sin hueco tras `now` (p. ej. su concursante ya no está): conserva su warm start.
+                fix_spec_at(spec, spec.warm_slot)
+                continue
+        spec.lb, spec.ub = lb, ub
+        counts["window"] += 1
+
+    movable = [spec for spec in ctx.specs.values() if not spec.fixed]
+    reach_end = max((spec.ub + spec.dur_slots for spec in movable), default=now_slot)
+    linked = set()
+    for spec in movable:
+        linked.update(spec.depends_on)
+    movable_ids = {spec.tid for spec in movable}
+    for tid in list(ctx.specs.keys()):
+        spec = ctx.specs[tid]
+        if not spec.fixed or spec.lb < reach_end or tid in linked or not movable_ids.isdisjoint(spec.depends_on):
+            continue
+        del ctx.specs[tid]
+        counts["droppedBeyond"] += 1
+
+    ctx.details.extend([
+        f"rollingHorizonNowSlot={now_slot}",
+        f"rollingHorizonWindowEndSlot={window_end_slot}",
+        *[f"rollingHorizon_{key}Tasks={value}" for key, value in counts.items()],
+    ])
+
+
+def coarse_context(ctx: SolveContext, coarse_grid: int) -> Optional[SolveContext]:
+    """Copia de `ctx` sobre un grid de `coarse_grid` minutos con redondeo conservador.
+
+    Duraciones hacia arriba, dominios y ventanas hacia dentro, comida hacia fuera y
+    tareas fijas cubriendo todo su intervalo: cualquier solución gruesa, llevada a
+    minutos, es factible en el grid fino. Devuelve None si el grid no es múltiplo
+    del fino, alguna tarea movible se queda sin inicios gruesos o las duraciones
+    redondeadas de un grupo NoOverlap ya no caben en la jornada.
+    """
+    if coarse_grid <= ctx.grid or coarse_grid % ctx.grid:
+        return None
+    r = coarse_grid // ctx.grid
+    specs: Dict[int, TaskSpec] = {}
+    for tid, spec in ctx.specs.items():
+        if spec.fixed:
+            start = spec.fixed_ws // r
+            dur = -(-(spec.fixed_ws + spec.dur_slots) // r) - start
+            specs[tid] = replace(
+                spec, dur_slots=dur, warm_slot=start, lb=start, ub=start, fixed_ws=start,
+                window_lb=min(start, -(-spec.window_lb // r)), window_ub=max(start, spec.window_ub // r),
+                domain_intervals=None, meal_in_domain=False,
+            )
+            continue
+        fine_intervals = spec.domain_intervals or [(spec.lb, spec.ub)]
+        intervals = [(-(-lo // r), hi // r) for lo, hi in fine_intervals if -(-lo // r) <= hi // r]
+        if not intervals:
+            return None
+        lb, ub = intervals[0][0], intervals[-1][1]
+        specs[tid] = replace(
+            spec, dur_slots=-(-spec.dur_slots // r), warm_slot=min(max(spec.warm_slot // r, lb), ub), lb=lb, ub=ub,
+            window_lb=-(-spec.window_lb // r), window_ub=spec.window_ub // r,
+            domain_intervals=intervals if len(intervals) > 1 else None, meal_in_domain=False,
+        )
+    horizon = -(-ctx.horizon // r)
+    load: Counter = Counter()
+    for spec in specs.values():
+        for group in task_groups(spec):
+            load[group] += spec.dur_slots
+        for group, demand in spec.cumulative_demands.items():
+            load[group] += spec.dur_slots * demand
+    if any(total > horizon * ctx.capacities.get(group, 1) for group, total in load.items()):
+        return None
+    meal_slots = None
+    if ctx.meal_slots is not None:
+        meal_slots = (ctx.meal_slots[0] // r, -(-ctx.meal_slots[1] // r))
+    return replace(
+        ctx,
+        grid=coarse_grid,
+        horizon=horizon,
+        specs=specs,
+        meal_slots=meal_slots,
+        details=[],
+        report={},
+        plan_table=None,
+        hint_starts={tid: slot // r for tid, slot in ctx.hint_starts.items()},
+    )
+
+
+def narrow_to_coarse_placement(
+    ctx: SolveContext,
+    coarse_starts: Dict[int, int],
+    r: int,
+    radius: int,
+    warm_starts: Dict[int, int],
+) -> int:
+    """Restringe cada tarea movible a `±radius` slots finos de su inicio grueso y lo deja como hint.
+
+    El slot de `warm_starts` (warm start o hint previo) se conserva en el dominio
+    si ya estaba en él: así el plan de partida sigue siendo una solución del
+    modelo fino y el refinado no puede quedar por encima de su objetivo.
+    """
+    narrowed = 0
+    for tid, coarse_slot in coarse_starts.items():
+        spec = ctx.specs.get(tid)
+        if spec is None or spec.fixed:
+            continue
+        center = coarse_slot * r
+        lo, hi = center - radius, center + radius
+        fine_intervals = spec.domain_intervals or [(spec.lb, spec.ub)]
+        intervals = [(max(a, lo), min(b, hi)) for a, b in fine_intervals if max(a, lo) <= min(b, hi)]
+        warm = warm_starts.get(tid)
+        if warm is not None and spec.allows(warm) and not lo <= warm <= hi:
+            intervals = merge_intervals(intervals + [(warm, warm)])
+        if not intervals:
+            continue
+        spec.lb, spec.ub = intervals[0][0], intervals[-1][1]
+        spec.domain_intervals = intervals if len(intervals) > 1 else None
+        ctx.hint_starts[tid] = center
+        narrowed += 1
+    return narrowed
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Intervalos cerrados ordenados, fusionando los que se solapan o son contiguos."""
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def symmetry_classes(ctx: SolveContext, task_ids: Iterable[int]) -> List[List[int]]:
+    """Clases de tareas movibles intercambiables: mismo espacio, concursante, zona,
+    template, recursos, duración, dominio, ventana y dependencias (en ambos sentidos).
+
+    Intercambiar dos tareas de una clase no altera ninguna restricción ni término del
+    objetivo salvo la distancia al warm start, y para |s - w| la asignación ordenada por
+    warm start domina a la cruzada. Cada clase sale ordenada por (warm start, id). Las
+    casi duras quedan fuera: su `keep_` sí depende de cuál ocupa su warm start.
+    """
+    selected = set(task_ids)
+    # Dependientes de todo el contexto: una fija (piloto, lock, fuera del horizonte)
+    # que depende de una sola tarea de la clase la hace distinguible.
+    dependents: Dict[int, List[int]] = {}
+    for tid, spec in ctx.specs.items():
+        for did in spec.depends_on:
+            dependents.setdefault(did, []).append(tid)
+    classes: Dict[Tuple[Any, ...], List[int]] = {}
+    for tid in selected:
+        spec = ctx.specs[tid]
+        if spec.fixed or spec.near_hard:
+            continue
+        key = (
+            spec.space_id, spec.contestant_id, spec.zone_id, spec.template_id, tuple(sorted(spec.resource_ids)),
+            spec.dur_slots, spec.lb, spec.ub, spec.window_lb, spec.window_ub,
+            tuple(spec.domain_intervals or ()), spec.meal_in_domain, spec.has_warm,
+            tuple(sorted(spec.depends_on)), tuple(sorted(dependents.get(tid, []))),
+            tuple(sorted(spec.cumulative_demands.items())),
+        )
+        classes.setdefault(key, []).append(tid)
+    ordered = [
+        sorted(tids, key=lambda tid: (ctx.specs[tid].warm_slot, tid))
+        for tids in classes.values() if len(tids) > 1
+    ]
+    return sorted(ordered, key=lambda tids: tids[0])
+
+
+def order_symmetric_starts(build: ModelBuild, starts: Dict[int, int]) -> Dict[int, int]:
+    """Reparte los inicios del hint dentro de cada clase en el orden que imponen sus restricciones."""
+    ordered = dict(starts)
+    for tids in build.symmetry_classes:
+        if all(tid in starts for tid in tids):
+            for tid, slot in zip(tids, sorted(starts[tid] for tid in tids)):
+                ordered[tid] = slot
+    return ordered
+
+
+def build_model(
+    cp_model: Any,
+    ctx: SolveContext,
+    task_ids: Optional[Iterable[int]] = None,
+    near_hard_breaks_max: Optional[int] = None,
+) -> ModelBuild:
+    """Construye el modelo CP-SAT completo o restringido a `task_ids`."""
+    horizon = ctx.horizon
+    selected = set(ctx.specs.keys()) if task_ids is None else set(task_ids)
+    specs = [spec for tid, spec in ctx.specs.items() if tid in selected]
+    build = ModelBuild(model=cp_model.CpModel())
+    model = build.model
+    lap = PhaseLaps(ctx.profile, "build", model)
+    rss_before = current_rss_mb() if ctx.profile is not None else None
+    start_vars = build.start_vars
+    end_vars = build.end_vars
+    domain_by_tid: Dict[int, Tuple[int, int]] = {}
+    duration_slots_by_tid: Dict[int, int] = {}
 
-        s = model.NewIntVar(lb, ub, f"s_{tid}")
-        e = model.NewIntVar(max(0, lb + dur_slots), min(horizon, ub + dur_slots), f"e_{tid}")
-        iv = model.NewIntervalVar(s, dur_slots, e, f"iv_{tid}")
-        start_vars[tid] = s
-        end_vars[tid] = e
-        intervals[tid] = iv
-        duration_slots_by_tid[tid] = dur_slots
-        if fixed_by_lock:
-            model.Add(s == fixed_ws)
-            model.Add(e == fixed_ws + dur_slots)
-
-        model.Add(s >= start_slot_min)
-        model.Add(s <= end_slot_max - dur_slots)
-
-        if not fixed:
-            movable_task_ids.append(tid)
-
-        # warm start hint (si existe y cae dentro del dominio)
-        if lb <= ws <= ub:
-            model.AddHint(s, ws)
+    for spec in specs:
+        add_task_variables(cp_model, ctx, build, spec)
+        duration_slots_by_tid[spec.tid] = spec.dur_slots
+        domain_by_tid[spec.tid] = (max(spec.lb, spec.window_lb), min(spec.ub, spec.window_ub))
+    lap("variables")
 
     # No overlap by space and contestant
     by_space: Dict[int, List[Any]] = {}
     by_contestant: Dict[int, List[Any]] = {}
     by_resource: Dict[int, List[Any]] = {}
-    for tid, iv in intervals.items():
-        t = tasks_by_id.get(tid, {})
-        sid = int(t.get("spaceId") or 0)
-        cid = int(t.get("contestantId") or 0)
-        assigned_resources = planning_rows_by_tid.get(tid, {}).get("assignedResources") or []
-        if sid > 0:
-            by_space.setdefault(sid, []).append(iv)
-        if cid > 0:
-            by_contestant.setdefault(cid, []).append(iv)
-        for rid_raw in assigned_resources:
-            rid = int(rid_raw or 0)
-            if rid > 0:
-                by_resource.setdefault(rid, []).append(iv)
-
-    for items in by_space.values():
-        if len(items) > 1:
-            model.AddNoOverlap(items)
-    for items in by_contestant.values():
-        if len(items) > 1:
-            model.AddNoOverlap(items)
-    for items in by_resource.values():
-        if len(items) > 1:
-            model.AddNoOverlap(items)
+    no_overlap_groups_by_tid: Dict[int, List[Tuple[str, int]]] = {}
+    for spec in specs:
+        iv = build.intervals[spec.tid]
+        groups = no_overlap_groups_by_tid.setdefault(spec.tid, [])
+        if spec.space_id > 0 and ("space", spec.space_id) not in spec.cumulative_demands:
+            by_space.setdefault(spec.space_id, []).append(iv)
+            groups.append(("space", spec.space_id))
+        if spec.contestant_id > 0:
+            by_contestant.setdefault(spec.contestant_id, []).append(iv)
+            groups.append(("contestant", spec.contestant_id))
+        for rid in spec.resource_ids:
+            by_resource.setdefault(rid, []).append(iv)
+            groups.append(("resource", rid))
+
+    for kind, by_key in (("space", by_space), ("contestant", by_contestant), ("resource", by_resource)):
+        for key, items in by_key.items():
+            if len(items) > 1:
+                build.group_constraints[(kind, key)] = model.AddNoOverlap(items).Index()
+    for tid, groups in no_overlap_groups_by_tid.items():
+        for group in groups:
+            build.group_members.setdefault(group, []).append(tid)
+    lap("noOverlap")
+
+    # Pools de unidades y espacios con varios huecos: un Cumulative por grupo; las unidades se colorean tras el solve.
+    by_capacity_group: Dict[Tuple[str, int], List[TaskSpec]] = {}
+    for spec in specs:
+        for group in spec.cumulative_demands:
+            by_capacity_group.setdefault(group, []).append(spec)
+    for group, members in by_capacity_group.items():
+        capacity = ctx.capacities[group]
+        if sum(member.cumulative_demands[group] for member in members) > capacity:
+            model.AddCumulative(
+                [build.intervals[member.tid] for member in members],
+                [member.cumulative_demands[group] for member in members],
+                capacity,
+            )
+    if by_capacity_group:
+        lap("cumulative")
 
     # Hard global meal block: movable tasks must remain fully before or after it.
-    meal = engine_input.get("meal") or {}
-    meal_start_raw = meal.get("start")
-    meal_end_raw = meal.get("end")
-    if meal_start_raw and meal_end_raw:
-        meal_start_slot = (parse_hhmm(str(meal_start_raw)) - work_start) // grid
-        meal_end_slot = (parse_hhmm(str(meal_end_raw)) - work_start) // grid
-        if meal_end_slot > meal_start_slot:
-            for tid in movable_task_ids:
-                before_meal = model.NewBoolVar(f"before_meal_{tid}")
-                model.Add(end_vars[tid] <= meal_start_slot).OnlyEnforceIf(before_meal)
-                model.Add(start_vars[tid] >= meal_end_slot).OnlyEnforceIf(before_meal.Not())
+    for tid in build.movable_task_ids:
+        add_meal_choice(ctx, build, tid)
+    lap("meal")
 
     # Dependencies (including fixed environment tasks when both endpoints are modeled)
-    for tid in start_vars.keys():
-        t = tasks_by_id.get(tid, {})
-        deps = t.get("dependsOnTaskIds") or []
-        dur_prev = 0
-        for dep in deps:
-            did = int(dep)
+    for spec in specs:
+        for did in spec.depends_on:
             if did in end_vars:
-                model.Add(start_vars[tid] >= end_vars[did] + dur_prev)
+                add_dependency(build, spec.tid, did)
+    lap("dependencies")
+
+    if ctx.payload.get("symmetryBreaking"):
+        build.symmetry_classes = symmetry_classes(ctx, build.movable_task_ids)
+        for tids in build.symmetry_classes:
+            # Comparten grupo NoOverlap salvo que no tengan espacio, concursante ni recursos.
+            gap = duration_slots_by_tid[tids[0]] if task_groups(ctx.specs[tids[0]]) else 0
+            for before, after in zip(tids, tids[1:]):
+                model.Add(start_vars[after] >= start_vars[before] + gap)
+        lap("symmetry")
 
     # near-hard level 10: keep level10-space tasks at warm start; allow configurable breaks
-    degrade_bools: List[Tuple[int, Any]] = []
-    grouping = engine_input.get("groupingBySpaceId") or {}
-    try:
-        near_hard_breaks_max = int(float(engine_input.get("optimizerNearHardBreaksMax") or 0))
-    except Exception:
-        near_hard_breaks_max = 0
-    near_hard_breaks_max = max(0, min(10, near_hard_breaks_max))
-    for tid in movable_task_ids:
-        t = tasks_by_id.get(tid, {})
-        sid = int(t.get("spaceId") or 0)
-        level = int((grouping.get(str(sid)) or grouping.get(sid) or {}).get("level") or 0)
-        if level < 10:
-            continue
-        wp = planning_rows_by_tid.get(tid) or {}
-        ws_raw = wp.get("startPlanned")
-        if not ws_raw:
+    breaks_max = ctx.near_hard_breaks_max if near_hard_breaks_max is None else near_hard_breaks_max
+    for tid in build.movable_task_ids:
+        spec = ctx.specs[tid]
+        if not spec.near_hard:
             continue
-        ws = int((parse_hhmm(ws_raw) - work_start) // grid)
-        keep = model.NewBoolVar(f"keep_{tid}")
-        model.Add(start_vars[tid] == ws).OnlyEnforceIf(keep)
-        model.Add(start_vars[tid] != ws).OnlyEnforceIf(keep.Not())
-        degrade_bools.append((tid, keep.Not()))
-
-    if degrade_bools:
-        model.Add(sum(b for _, b in degrade_bools) <= near_hard_breaks_max)
+        keep = model.NewBoolVar(var_name(ctx.var_names, "keep_{}", tid))
+        at_warm = model.Add(start_vars[tid] == spec.warm_slot)
+        off_warm = model.Add(start_vars[tid] != spec.warm_slot)
+        at_warm.OnlyEnforceIf(keep)
+        off_warm.OnlyEnforceIf(keep.Not())
+        build.own(tid, "keep", at_warm, off_warm)
+        build.degrade_bools.append((tid, keep.Not()))
+        build.keep_bools[tid] = keep
+
+    if build.degrade_bools:
+        model.Add(sum(b for _, b in build.degrade_bools) <= breaks_max)
+    lap("nearHard")
 
     # Objective components
-    abs_diffs = []
-    for tid in movable_task_ids:
-        wp = warm_by_id.get(tid) or {}
-        ws_raw = wp.get("startPlanned")
-        if not ws_raw:
-            continue
-        ws = int((parse_hhmm(ws_raw) - work_start) // grid)
-        d = model.NewIntVar(0, horizon, f"d_{tid}")
-        model.AddAbsEquality(d, start_vars[tid] - ws)
-        abs_diffs.append(d)
+    for tid in build.movable_task_ids:
+        add_warm_distance(ctx, build, tid)
+    lap("warmDistance")
 
-    main_zone_id_raw = engine_input.get("optimizerMainZoneId")
-    try:
-        main_zone_id = int(main_zone_id_raw)
-    except Exception:
-        main_zone_id = 0
+    main_zone_id = ctx.main_zone_id
     main_zone_task_ids = [
-        tid for tid in start_vars.keys()
-        if int((tasks_by_id.get(tid) or {}).get("zoneId") or 0) == main_zone_id and main_zone_id > 0
+        spec.tid for spec in specs
+        if spec.zone_id == main_zone_id and main_zone_id > 0
     ]
 
-    delta_slots = 12
-    occ_slots_set = set()
-    for tid in main_zone_task_ids:
-        wp = warm_by_id.get(tid) or {}
-        ws = int((parse_hhmm(wp.get("startPlanned")) - work_start) // grid)
-        dur_slots = duration_slots_by_tid.get(tid, 1)
-        we = ws + dur_slots
-        lo = max(0, ws - delta_slots)
-        hi = min(horizon - 1, we + delta_slots)
-        for s in range(lo, hi + 1):
-            occ_slots_set.add(s)
-    occ_slots = sorted(list(occ_slots_set))
-    occ_vars: Dict[int, Any] = {}
-    occ_cover_vars: List[Any] = []
-    for s in occ_slots:
-        cover_bools = []
-        for tid in main_zone_task_ids:
-            dur_slots = duration_slots_by_tid.get(tid, 1)
-            min_start = max(0, s - dur_slots + 1)
-            max_start = min(horizon - dur_slots, s)
-            if min_start > max_start:
-                continue
-            b = model.NewBoolVar(f"cover_{tid}_{s}")
-            model.Add(start_vars[tid] <= s).OnlyEnforceIf(b)
-            model.Add(start_vars[tid] >= s - dur_slots + 1).OnlyEnforceIf(b)
-            cover_bools.append(b)
-            occ_cover_vars.append(b)
-        if not cover_bools:
-            continue
-        occ = model.NewBoolVar(f"occ_{s}")
-        model.AddBoolOr(cover_bools).OnlyEnforceIf(occ)
-        model.AddBoolAnd([b.Not() for b in cover_bools]).OnlyEnforceIf(occ.Not())
-        model.AddBoolOr([occ.Not(), *cover_bools])
-        for b in cover_bools:
-            model.AddImplication(b, occ)
-        occ_vars[s] = occ
-
-    makespan = model.NewIntVar(0, horizon, "makespan")
+    occ_slots = main_zone_occupancy_slots(ctx, main_zone_task_ids)
+    occupancy = add_main_zone_occupancy(
+        cp_model,
+        model,
+        ctx.occupancy_encoding,
+        occ_slots,
+        main_zone_task_ids,
+        start_vars,
+        domain_by_tid,
+        duration_slots_by_tid,
+        horizon,
+        tasks_pairwise_disjoint(main_zone_task_ids, no_overlap_groups_by_tid),
+        names=ctx.var_names,
+    )
+    build.occupancy = occupancy
+    lap("occupancy")
+
+    makespan = model.NewIntVar(0, horizon, var_name(ctx.var_names, "makespan"))
     if end_vars:
-        model.AddMaxEquality(makespan, list(end_vars.values()))
+        build.makespan_constraint = model.AddMaxEquality(makespan, end_vars.values()).Index()
     else:
         model.Add(makespan == 0)
+    build.makespan = makespan
 
-    total_slots_main = len(occ_vars)
-    main_zone_empty_slots = model.NewIntVar(0, total_slots_main, "main_zone_empty_slots")
+    total_slots_main = occupancy.total_slots
+    main_zone_empty_slots = model.NewIntVar(0, total_slots_main, var_name(ctx.var_names, "main_zone_empty_slots"))
     if total_slots_main > 0:
-        model.Add(main_zone_empty_slots == total_slots_main - sum(occ_vars.values()))
+        model.Add(
+            main_zone_empty_slots
+            == total_slots_main
+            - occupancy.forced_slots
+            - sum(occupancy.occ_vars.values())
+            - sum(occupancy.inside_vars.values())
+        )
     else:
         model.Add(main_zone_empty_slots == 0)
+    build.main_zone_empty_slots = main_zone_empty_slots
+    lap("makespan")
 
     # Compactación suave por concursante: minimizar span_c = last_c - first_c
     contestant_task_ids: Dict[int, List[int]] = {}
-    for tid in start_vars.keys():
-        task = tasks_by_id.get(tid) or {}
-        cid = int(task.get("contestantId") or 0)
-        if cid > 0:
-            contestant_task_ids.setdefault(cid, []).append(tid)
+    for spec in specs:
+        if spec.contestant_id > 0:
+            contestant_task_ids.setdefault(spec.contestant_id, []).append(spec.tid)
 
-    span_vars: List[Any] = []
     for cid, tids in contestant_task_ids.items():
         if not tids:
             continue
-        first_c = model.NewIntVar(0, horizon, f"first_{cid}")
-        last_c = model.NewIntVar(0, horizon, f"last_{cid}")
-        span_c = model.NewIntVar(0, horizon, f"span_{cid}")
-        model.AddMinEquality(first_c, [start_vars[tid] for tid in tids])
-        model.AddMaxEquality(last_c, [end_vars[tid] for tid in tids])
+        first_c = model.NewIntVar(0, horizon, var_name(ctx.var_names, "first_{}", cid))
+        last_c = model.NewIntVar(0, horizon, var_name(ctx.var_names, "last_{}", cid))
+        span_c = model.NewIntVar(0, horizon, var_name(ctx.var_names, "span_{}", cid))
+        build.span_constraints[cid] = (
+            model.AddMinEquality(first_c, (start_vars[tid] for tid in tids)).Index(),
+            model.AddMaxEquality(last_c, (end_vars[tid] for tid in tids)).Index(),
+        )
         model.Add(span_c == last_c - first_c)
-        span_vars.append(span_c)
+        build.span_vars[cid] = span_c
+        build.span_bounds[cid] = (tids, first_c, last_c)
+    lap("contestantSpans")
 
     # Proxy de switches en plató principal: compactar por template dentro de cada espacio.
-    main_zone_template_dispersion_vars: List[Any] = []
     main_zone_by_space_template: Dict[Tuple[int, int], List[int]] = {}
     for tid in main_zone_task_ids:
-        task = tasks_by_id.get(tid) or {}
-        sid = int(task.get("spaceId") or 0)
-        tpl = int(task.get("templateId") or 0)
-        if sid <= 0 or tpl <= 0:
+        spec = ctx.specs[tid]
+        if spec.space_id <= 0 or spec.template_id <= 0:
             continue
-        main_zone_by_space_template.setdefault((sid, tpl), []).append(tid)
+        main_zone_by_space_template.setdefault((spec.space_id, spec.template_id), []).append(tid)
 
     for (sid, tpl), tids in main_zone_by_space_template.items():
         if len(tids) <= 1:
             continue
-        first_tpl = model.NewIntVar(0, horizon, f"main_tpl_first_s{sid}_t{tpl}")
-        last_tpl = model.NewIntVar(0, horizon, f"main_tpl_last_s{sid}_t{tpl}")
-        span_tpl = model.NewIntVar(0, horizon, f"main_tpl_span_s{sid}_t{tpl}")
-        model.AddMinEquality(first_tpl, [start_vars[tid] for tid in tids])
-        model.AddMaxEquality(last_tpl, [end_vars[tid] for tid in tids])
+        first_tpl = model.NewIntVar(0, horizon, var_name(ctx.var_names, "main_tpl_first_s{}_t{}", sid, tpl))
+        last_tpl = model.NewIntVar(0, horizon, var_name(ctx.var_names, "main_tpl_last_s{}_t{}", sid, tpl))
+        span_tpl = model.NewIntVar(0, horizon, var_name(ctx.var_names, "main_tpl_span_s{}_t{}", sid, tpl))
+        model.AddMinEquality(first_tpl, (start_vars[tid] for tid in tids))
+        model.AddMaxEquality(last_tpl, (end_vars[tid] for tid in tids))
         model.Add(span_tpl == last_tpl - first_tpl)
-        main_zone_template_dispersion_vars.append(span_tpl)
-
-    # Weighted objective: main-zone occupancy >> finish early >> warm-start distance >> near-hard breaks >> contestant span >> main-zone switch proxy.
-    W1 = 10000
-    W2 = 100
-    W3 = 1
-    W4 = 5000
-    W5 = 1
-    W6 = 8
+        build.dispersion_vars[(sid, tpl)] = span_tpl
+        build.dispersion_bounds[(sid, tpl)] = (tids, first_tpl, last_tpl)
+
     objective_terms = [main_zone_empty_slots * W1, makespan * W2]
-    if abs_diffs:
-        objective_terms.append(sum(abs_diffs) * W3)
-    if degrade_bools:
-        for _, b in degrade_bools:
+    if build.abs_diffs:
+        objective_terms.append(sum(build.abs_diffs.values()) * W3)
+    if build.degrade_bools:
+        for _, b in build.degrade_bools:
             objective_terms.append(b * W4)
-    if span_vars:
-        objective_terms.append(sum(span_vars) * W5)
-    if main_zone_template_dispersion_vars:
-        objective_terms.append(sum(main_zone_template_dispersion_vars) * W6)
+    if build.span_vars:
+        objective_terms.append(sum(build.span_vars.values()) * W5)
+    if build.dispersion_vars:
+        objective_terms.append(sum(build.dispersion_vars.values()) * W6)
 
     model.Minimize(sum(objective_terms))
+    lap("objective")
+
+    hint_model(ctx, build)
+    lap("hint")
+    rss_after = current_rss_mb() if rss_before is not None else None
+    if rss_after is not None:
+        memory = ctx.profile.memory
+        memory["buildRssDeltaMb"] = max(memory.get("buildRssDeltaMb", 0.0), round(rss_after - rss_before, 1))
+        memory["buildRssMb"] = max(memory.get("buildRssMb", 0.0), rss_after)
+    return build
+
+
+def add_task_variables(cp_model: Any, ctx: SolveContext, build: ModelBuild, spec: TaskSpec) -> None:
+    """Inicio, fin e intervalo de una tarea, con su lock y su ventana de concursante."""
+    model = build.model
+    tid, lb, ub, dur_slots = spec.tid, spec.lb, spec.ub, spec.dur_slots
+    if spec.domain_intervals is not None:
+        s = model.NewIntVarFromDomain(cp_model.Domain.FromIntervals(spec.domain_intervals), var_name(ctx.var_names, "s_{}", tid))
+    else:
+        s = model.NewIntVar(lb, ub, var_name(ctx.var_names, "s_{}", tid))
+    e = model.NewIntVar(max(0, lb + dur_slots), min(ctx.horizon, ub + dur_slots), var_name(ctx.var_names, "e_{}", tid))
+    iv = model.NewIntervalVar(s, dur_slots, e, var_name(ctx.var_names, "iv_{}", tid))
+    build.start_vars[tid] = s
+    build.end_vars[tid] = e
+    build.intervals[tid] = iv
+    build.own(tid, None, iv)
+    if spec.fixed_by_lock:
+        build.own(tid, "lock", model.Add(s == spec.fixed_ws), model.Add(e == spec.fixed_ws + dur_slots))
+    build.own(tid, "window", model.Add(s >= spec.window_lb), model.Add(s <= spec.window_ub))
+    if not spec.fixed:
+        build.movable_task_ids.append(tid)
+
+
+def add_meal_choice(ctx: SolveContext, build: ModelBuild, tid: int) -> None:
+    """Bloque de comida duro: la tarea movible queda entera antes o después."""
+    if ctx.meal_slots is None or ctx.specs[tid].meal_in_domain:
+        return
+    model = build.model
+    before_meal = model.NewBoolVar(var_name(ctx.var_names, "before_meal_{}", tid))
+    before = model.Add(build.end_vars[tid] <= ctx.meal_slots[0])
+    after = model.Add(build.start_vars[tid] >= ctx.meal_slots[1])
+    before.OnlyEnforceIf(before_meal)
+    after.OnlyEnforceIf(before_meal.Not())
+    build.own(tid, None, before, after)
+    build.before_meal_bools[tid] = before_meal
+
+
+def add_dependency(build: ModelBuild, tid: int, did: int) -> None:
+    constraint = build.model.Add(build.start_vars[tid] >= build.end_vars[did])
+    build.own(tid, None, constraint)
+    build.own(did, None, constraint)
+
+
+def add_warm_distance(ctx: SolveContext, build: ModelBuild, tid: int) -> Optional[Any]:
+    """`d = |s - warm|` de una tarea movible con warm start; None si no tiene."""
+    spec = ctx.specs[tid]
+    if not spec.has_warm:
+        return None
+    d = build.model.NewIntVar(0, ctx.horizon, var_name(ctx.var_names, "d_{}", tid))
+    build.own(tid, "warm", build.model.AddAbsEquality(d, build.start_vars[tid] - spec.warm_slot))
+    build.abs_diffs[tid] = d
+    return d
+
+
+def main_zone_occupancy_slots(ctx: SolveContext, task_ids: List[int], delta_slots: int = 12) -> List[int]:
+    """Slots que cuenta la ocupación de zona principal: cada warm start ± `delta_slots`."""
+    occ_slots_set = set()
+    for tid in task_ids:
+        wp = ctx.warm_by_id.get(tid) or {}
+        ws = int((parse_hhmm(wp.get("startPlanned")) - ctx.work_start) // ctx.grid)
+        lo = max(0, ws - delta_slots)
+        hi = min(ctx.horizon - 1, ws + ctx.specs[tid].dur_slots + delta_slots)
+        occ_slots_set.update(range(lo, hi + 1))
+    return sorted(occ_slots_set)
+
+
+def hint_model(ctx: SolveContext, build: ModelBuild) -> None:
+    """Hint completo desde el warm start (reparado y ordenado por simetrías si procede)."""
+    starts = warm_hint_starts(ctx, build)
+    repaired: List[int] = []
+    if ctx.payload.get("repairHint"):
+        starts, repaired = repair_hint_starts(ctx, build, starts)
+    if build.symmetry_classes:
+        starts = order_symmetric_starts(build, starts)
+    build.hint = add_solution_hint(ctx, build, starts)
+    build.hint["repairedTasks"] = repaired
+
+
+def set_domain(values: Any, flattened: List[int]) -> None:
+    values.clear()
+    values.extend(int(v) for v in flattened)
+
+
+def warm_hint_starts(ctx: SolveContext, build: ModelBuild) -> Dict[int, int]:
+    """Inicios sugeridos para las tareas del modelo.
+
+    Las fijas van en su slot fijo; las movibles, en `ctx.hint_starts` si lo hay
+    y cae en su dominio (p. ej. una solución previa), o en su warm start.
+    """
+    starts = {}
+    for tid in build.start_vars:
+        spec = ctx.specs[tid]
+        if spec.fixed:
+            starts[tid] = spec.lb
+        elif tid in ctx.hint_starts and spec.allows(ctx.hint_starts[tid]):
+            starts[tid] = ctx.hint_starts[tid]
+        else:
+            starts[tid] = spec.warm_slot
+    return starts
+
+
+def plan_start_slots(ctx: SolveContext, planned: List[Dict[str, Any]]) -> Dict[int, int]:
+    """Slot de inicio de cada fila de un plan (`plannedTasks`) en el grid del contexto."""
+    starts = {}
+    for row in planned:
+        tid = int(row.get("taskId") or -1)
+        if tid in ctx.specs and row.get("startPlanned"):
+            starts[tid] = (parse_hhmm(row.get("startPlanned")) - ctx.work_start) // ctx.grid
+    return starts
+
+
+def task_groups(spec: TaskSpec) -> List[Tuple[str, int]]:
+    """Grupos NoOverlap (espacio, concursante, recursos) de una tarea; los de capacidad van aparte."""
+    keys = [("space", spec.space_id), ("contestant", spec.contestant_id)]
+    keys.extend(("resource", rid) for rid in spec.resource_ids)
+    return [key for key in keys if key[1] > 0 and key not in spec.cumulative_demands]
+
+
+def report_cumulative_groups(ctx: SolveContext) -> None:
+    """Informa de los grupos que se modelan con `AddCumulative` en lugar de un NoOverlap por unidad."""
+    tasks: Counter = Counter()
+    for spec in ctx.specs.values():
+        tasks.update(spec.cumulative_demands.keys())
+    groups = [
+        {
+            "group": f"{kind}:{key}",
+            "capacity": capacity,
+            "units": ctx.pool_units.get(key, []) if kind == "pool" else capacity,
+            "tasks": tasks[(kind, key)],
+        }
+        for (kind, key), capacity in sorted(ctx.capacities.items())
+        if tasks[(kind, key)]
+    ]
+    ctx.report["cumulative"] = {"groups": groups}
+    if groups:
+        ctx.details.append(f"cumulativeGroups={','.join(group['group'] for group in groups)}")
+
+
+def repair_hint_starts(
+    ctx: SolveContext,
+    build: ModelBuild,
+    starts: Dict[int, int],
+) -> Tuple[Dict[int, int], List[int]]:
+    """Repara la sugerencia de inicios con una pasada voraz de list scheduling.
+
+    Las tareas fijas se colocan primero; después, respetando el orden de
+    dependencias, las de nivel 10 y el resto por inicio sugerido, cada una en el slot válido más cercano (dominio, ventana,
+    comida, dependencias ya colocadas, sin solape en sus grupos y sin superar la
+    capacidad de sus pools). Si una tarea no cabe se deja donde estaba y el hint
+    se informa como no factible.
+    """
+    repaired_starts = dict(starts)
+    repaired: List[int] = []
+    busy: Dict[Tuple[str, int], List[Tuple[int, int]]] = {}
+    loads: Dict[Tuple[str, int], List[Tuple[int, int, int]]] = {}
+    movable = set(build.movable_task_ids)
+    for tid, slot in starts.items():
+        if tid in movable:
+            continue
+        for key in task_groups(ctx.specs[tid]):
+            busy.setdefault(key, []).append((slot, slot + ctx.specs[tid].dur_slots))
+        for key, demand in ctx.specs[tid].cumulative_demands.items():
+            loads.setdefault(key, []).append((slot, slot + ctx.specs[tid].dur_slots, demand))
+
+    pending = sorted(movable, key=lambda tid: (not ctx.specs[tid].near_hard, starts[tid], tid))
+    placed = set(starts) - movable
+    while pending:
+        # Primera tarea cuyos predecesores modelados ya están colocados (o la primera, si hay ciclo).
+        tid = next(
+            (t for t in pending if all(did in placed or did not in starts for did in ctx.specs[t].depends_on)),
+            pending[0],
+        )
+        pending.remove(tid)
+        spec = ctx.specs[tid]
+        groups = task_groups(spec)
+        earliest = max(
+            [repaired_starts[did] + ctx.specs[did].dur_slots for did in spec.depends_on if did in placed] or [0]
+        )
+        lo = max(spec.lb, spec.window_lb, earliest)
+        hi = min(spec.ub, spec.window_ub)
+
+        def fits(candidate: int) -> bool:
+            end = candidate + spec.dur_slots
+            if not spec.allows(candidate):
+                return False
+            if ctx.meal_slots is not None and candidate < ctx.meal_slots[1] and end > ctx.meal_slots[0]:
+                return False
+            if not all(
+                load_fits(loads.get(key, []), candidate, end, demand, ctx.capacities[key])
+                for key, demand in spec.cumulative_demands.items()
+            ):
+                return False
+            return all(end <= s or candidate >= e for key in groups for s, e in busy.get(key, []))
+
+        target = min(max(starts[tid], lo), max(lo, hi))
+        chosen = None
+        for offset in range(0, max(0, hi - lo) + 1):
+            for candidate in (target - offset, target + offset):
+                if lo <= candidate <= hi and fits(candidate):
+                    chosen = candidate
+                    break
+            if chosen is not None:
+                break
+        if chosen is None:
+            chosen = starts[tid]
+        elif chosen != starts[tid]:
+            repaired_starts[tid] = chosen
+            repaired.append(tid)
+        placed.add(tid)
+        for key in groups:
+            busy.setdefault(key, []).append((chosen, chosen + spec.dur_slots))
+        for key, demand in spec.cumulative_demands.items():
+            loads.setdefault(key, []).append((chosen, chosen + spec.dur_slots, demand))
+    return repaired_starts, repaired
+
+
+def hint_violations(ctx: SolveContext, build: ModelBuild, starts: Dict[int, int]) -> List[str]:
+    """Restricciones duras que incumple una asignación de inicios del modelo."""
+    violations: List[str] = []
+    groups: Dict[Tuple[str, int], List[Tuple[int, int, int]]] = {}
+    loads: Dict[Tuple[str, int], List[Tuple[int, int, int, int]]] = {}
+    for tid, slot in starts.items():
+        spec = ctx.specs[tid]
+        end = slot + spec.dur_slots
+        if not spec.allows(slot) or slot < spec.window_lb or slot > spec.window_ub or end > ctx.horizon:
+            violations.append(f"domain:{tid}")
+        if spec.fixed_by_lock and slot != spec.fixed_ws:
+            violations.append(f"lock:{tid}")
+        if not spec.fixed and ctx.meal_slots is not None and slot < ctx.meal_slots[1] and end > ctx.meal_slots[0]:
+            violations.append(f"meal:{tid}")
+        for did in spec.depends_on:
+            if did in starts and slot < starts[did] + ctx.specs[did].dur_slots:
+                violations.append(f"dependency:{did}>{tid}")
+        for group in task_groups(spec):
+            groups.setdefault(group, []).append((slot, end, tid))
+        for group, demand in spec.cumulative_demands.items():
+            loads.setdefault(group, []).append((slot, end, demand, tid))
+    for (kind, key), items in groups.items():
+        items.sort()
+        for (_s0, e0, t0), (s1, _e1, t1) in zip(items, items[1:]):
+            if s1 < e0:
+                violations.append(f"overlap:{kind}{key}:{t0},{t1}")
+    for (kind, key), items in loads.items():
+        items.sort()
+        # Barrido: la carga máxima se alcanza al empezar algún intervalo.
+        active: List[Tuple[int, int]] = []
+        for start, end, demand, tid in items:
+            active = [(e, d) for e, d in active if e > start] + [(end, demand)]
+            if sum(d for _e, d in active) > ctx.capacities[(kind, key)]:
+                violations.append(f"capacity:{kind}{key}:{tid}")
+    breaks = sum(1 for tid in build.keep_bools if starts[tid] != ctx.specs[tid].warm_slot)
+    breaks_max = ctx.near_hard_breaks_max
+    if breaks > breaks_max:
+        violations.append(f"near_hard_breaks:{breaks}>{breaks_max}")
+    return violations
+
+
+def add_solution_hint(ctx: SolveContext, build: ModelBuild, starts: Dict[int, int]) -> Dict[str, Any]:
+    """Sustituye los hints del modelo por una asignación completa derivada de `starts`.
+
+    A partir de los inicios se calculan fines, `keep_`, `before_meal_`, `d_`,
+    literales de ocupación, spans por concursante y por template y makespan, de
+    modo que CP-SAT recibe una solución completa y no solo los `s_`. Los inicios
+    fuera de dominio no se sugieren (ni lo que depende de ellos).
+    """
+    model = build.model
+    model.ClearHints()
+    # Se acumulan y se vuelcan al proto de una vez: `AddHint` por variable domina el coste con miles de literales.
+    hint_vars: List[int] = []
+    hint_values: List[int] = []
+
+    def hint_index(index: int, value: int) -> None:
+        hint_vars.append(index)
+        hint_values.append(int(value))
+
+    def hint(var: Any, value: int) -> None:
+        hint_index(var.Index(), value)
+
+    in_domain = {tid: ctx.specs[tid].allows(slot) for tid, slot in starts.items()}
+    ends = {tid: slot + ctx.specs[tid].dur_slots for tid, slot in starts.items()}
+    for tid, slot in starts.items():
+        if not in_domain[tid]:
+            continue
+        hint(build.start_vars[tid], slot)
+        hint(build.end_vars[tid], ends[tid])
+
+    if ctx.meal_slots is not None:
+        for tid, var in build.before_meal_bools.items():
+            hint(var, ends[tid] <= ctx.meal_slots[0])
+    for tid, var in build.keep_bools.items():
+        hint(var, starts[tid] == ctx.specs[tid].warm_slot)
+    for tid, var in build.abs_diffs.items():
+        hint(var, abs(starts[tid] - ctx.specs[tid].warm_slot))
+
+    occupancy = build.occupancy
+    covered = set()
+    for tid, s, index in zip(occupancy.cover_tids, occupancy.cover_slots, occupancy.cover_vars):
+        inside = starts[tid] <= s < ends[tid]
+        hint_index(index, inside)
+        if inside:
+            covered.add(s)
+    for s, var in occupancy.occ_vars.items():
+        hint(var, s in covered)
+    inside_total = 0
+    for tid, var in occupancy.inside_vars.items():
+        inside = sum(1 for s in range(starts[tid], ends[tid]) if s in occupancy.slot_set)
+        inside_total += inside
+        if in_domain[tid]:
+            hint(var, inside)
+
+    occupied = occupancy.forced_slots + len(covered & set(occupancy.occ_vars)) + inside_total
+    hint(build.main_zone_empty_slots, max(0, occupancy.total_slots - occupied) if occupancy.total_slots > 0 else 0)
+    hint(build.makespan, max(ends.values()) if ends else 0)
+
+    for bounds, spans in ((build.span_bounds, build.span_vars), (build.dispersion_bounds, build.dispersion_vars)):
+        for key, (tids, first_var, last_var) in bounds.items():
+            first = min(starts[tid] for tid in tids)
+            last = max(ends[tid] for tid in tids)
+            hint(first_var, first)
+            hint(last_var, last)
+            hint(spans[key], last - first)
+
+    solution_hint = model.Proto().solution_hint
+    solution_hint.vars.extend(hint_vars)
+    solution_hint.values.extend(hint_values)
+    violations = hint_violations(ctx, build, starts)
+    model_vars = len(model.Proto().variables) - build.retired_vars
+    return {
+        "complete": len(hint_vars) == model_vars,
+        "feasible": not violations,
+        "hintedVars": len(hint_vars),
+        "modelVars": model_vars,
+        "violations": violations,
+    }
+
+
+def hint_details(hint: Dict[str, Any]) -> List[str]:
+    if not hint:
+        return []
+    details = [
+        f"hintComplete={str(hint['complete']).lower()}",
+        f"hintFeasible={str(hint['feasible']).lower()}",
+        f"hintVars={hint['hintedVars']}/{hint['modelVars']}",
+    ]
+    if hint["violations"]:
+        details.append(f"hintViolations={len(hint['violations'])}")
+        details.append(f"hintViolationSample={','.join(hint['violations'][:5])}")
+    if hint.get("repairedTasks") is not None and len(hint["repairedTasks"]) > 0:
+        details.append(f"hintRepairedTasks={','.join(str(tid) for tid in hint['repairedTasks'])}")
+    return details
+
+
+def variable_kind(name: str) -> str:
+    """Prefijo de una variable CP-SAT sin los identificadores numéricos (`cover_12_40` → `cover`)."""
+    if not name:
+        return "unnamed"
+    return re.sub(r"(_[st]?\d+)+$", "", name) or name
+
+
+# Tipos de restricción del proto, en orden aproximado de frecuencia en este modelo.
+CONSTRAINT_KINDS = [
+    "linear", "bool_and", "bool_or", "interval", "no_overlap", "lin_max", "element", "at_most_one",
+    "exactly_one", "bool_xor", "cumulative", "table", "all_diff", "int_prod", "int_div", "int_mod",
+    "no_overlap_2d", "automaton", "inverse", "reservoir", "circuit", "routes", "dummy_constraint",
+]
+
+
+def constraint_kind(constraint: Any) -> str:
+    """Tipo de una restricción del proto (`linear`, `no_overlap`…); `+enf` si está reificada."""
+    if hasattr(constraint, "WhichOneof"):
+        kind = constraint.WhichOneof("constraint") or "empty"
+    else:
+        # OR-Tools >= 9.13 expone el proto con bindings propios, sin `WhichOneof`.
+        kind = next((name for name in CONSTRAINT_KINDS if getattr(constraint, f"has_{name}")()), "empty")
+    return f"{kind}+enf" if len(constraint.enforcement_literal) else kind
+
+
+def model_counts(model: Any) -> Dict[str, Any]:
+    """Variables y restricciones del modelo, en total y por tipo."""
+    proto = model.Proto()
+    variables = Counter(variable_kind(var.name) for var in proto.variables)
+    constraints = Counter(constraint_kind(ct) for ct in proto.constraints)
+    return {
+        "variables": len(proto.variables),
+        "constraints": len(proto.constraints),
+        "variablesByKind": dict(sorted(variables.items())),
+        "constraintsByKind": dict(sorted(constraints.items())),
+    }
+
+
+# Límite de workers: por encima CP-SAT apenas mejora y compite con el resto del host.
+MAX_SEARCH_WORKERS = 32
+
+# Coste aproximado del presolve completo por restricción (medido con el benchmark en un core).
+PRESOLVE_SECONDS_PER_CONSTRAINT = 7e-5
+
+# En modo determinista el límite es de tiempo determinista; el de pared solo es una red de seguridad.
+DETERMINISTIC_WALL_FACTOR = 3.0
+
+SOLVER_CONFIG_KEYS = ["workers", "useLns", "linearizationLevel", "presolve", "randomSeed", "deterministic", "parameters"]
+
+
+def tune_solver_config(
+    payload: Dict[str, Any],
+    build: ModelBuild,
+    time_limit_seconds: float,
+) -> Dict[str, Any]:
+    """Elige la configuración de CP-SAT según CPUs disponibles y tamaño del modelo.
+
+    - Modelos pequeños (<= 2 000 restricciones): 1 worker, sin LNS y linealización 2.
+    - Medianos (<= 20 000): hasta 8 workers. Grandes: hasta `MAX_SEARCH_WORKERS` y linealización 0.
+    - El presolve se reduce (`light`, una iteración) o se desactiva cuando su coste
+      estimado se come una parte grande del presupuesto.
+    `solverConfig` en el payload sustituye cualquier elección (`numSearchWorkers`
+    se sigue aceptando para los workers).
+    """
+    proto = build.model.Proto()
+    constraints = len(proto.constraints)
+    movable = len(build.movable_task_ids)
+    cpus = available_cpus()
+    if constraints <= 2000:
+        size_class, workers, linearization = "small", 1, 2
+    elif constraints <= 20000:
+        size_class, workers, linearization = "medium", min(cpus, 8), 1
+    else:
+        size_class, workers, linearization = "large", min(cpus, MAX_SEARCH_WORKERS), 0
+    presolve_estimate = constraints * PRESOLVE_SECONDS_PER_CONSTRAINT
+    if presolve_estimate <= 0.1 * time_limit_seconds:
+        presolve = "full"
+    elif presolve_estimate / 2 <= 0.25 * time_limit_seconds:
+        presolve = "light"
+    else:
+        presolve = "off"
+    config: Dict[str, Any] = {
+        "sizeClass": size_class,
+        "cpus": cpus,
+        "constraints": constraints,
+        "movableTasks": movable,
+        "workers": workers,
+        "useLns": movable > 12,
+        "linearizationLevel": linearization,
+        "presolve": presolve,
+        "presolveEstimateS": round(presolve_estimate, 3),
+        "randomSeed": 0,
+        "deterministic": False,
+        "parameters": {},
+        "overrides": [],
+    }
+    overrides = dict(payload.get("solverConfig") or {})
+    if payload.get("numSearchWorkers") and "workers" not in overrides:
+        overrides["workers"] = payload.get("numSearchWorkers")
+    for key in SOLVER_CONFIG_KEYS:
+        if key in overrides:
+            config[key] = overrides[key]
+            config["overrides"].append(key)
+    config["workers"] = max(1, int(config["workers"]))
+    return config
+
+
+def apply_solver_config(solver: Any, config: Dict[str, Any], time_limit_seconds: float) -> List[str]:
+    """Traslada `config` a los parámetros del solver. Devuelve los parámetros crudos rechazados."""
+    params = solver.parameters
+    params.num_search_workers = config["workers"]
+    params.use_lns = bool(config["useLns"])
+    params.linearization_level = int(config["linearizationLevel"])
+    params.random_seed = int(config["randomSeed"])
+    if config["presolve"] == "off":
+        params.cp_model_presolve = False
+    elif config["presolve"] == "light":
+        params.max_presolve_iterations = 1
+    if config["deterministic"]:
+        # Búsqueda paralela reproducible: workers intercalados y límite en tiempo determinista.
+        params.interleave_search = True
+        params.max_deterministic_time = max(0.01, float(time_limit_seconds))
+        params.max_time_in_seconds = max(params.max_time_in_seconds, DETERMINISTIC_WALL_FACTOR * float(time_limit_seconds))
+    rejected = []
+    for name, value in (config.get("parameters") or {}).items():
+        try:
+            setattr(params, name, value)
+        except (AttributeError, TypeError, ValueError):
+            rejected.append(name)
+    return rejected
+
+
+def solver_config_details(config: Dict[str, Any]) -> List[str]:
+    return [
+        f"solverConfig=workers:{config['workers']},lns:{str(bool(config['useLns'])).lower()},"
+        f"linearization:{config['linearizationLevel']},presolve:{config['presolve']},seed:{config['randomSeed']},"
+        f"deterministic:{str(bool(config['deterministic'])).lower()},size:{config['sizeClass']}",
+    ]
+
 
+def new_solver(cp_model: Any, time_limit_seconds: float, num_workers: int = 8, min_time_seconds: float = 1.0) -> Any:
     solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = max(1.0, float(time_limit_seconds))
-    solver.parameters.num_search_workers = 8
+    solver.parameters.max_time_in_seconds = max(min_time_seconds, float(time_limit_seconds))
+    solver.parameters.num_search_workers = num_workers
+    # El log de búsqueda va a la respuesta (nunca a stdout) para extraer tiempos de presolve y primera solución.
+    solver.parameters.log_search_progress = True
+    solver.parameters.log_to_stdout = False
+    solver.parameters.log_to_response = True
+    return solver
+
+
+def tuned_solver(
+    cp_model: Any,
+    payload: Dict[str, Any],
+    build: ModelBuild,
+    time_limit_seconds: float,
+    max_workers: Optional[int] = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    """Solver con la configuración de `tune_solver_config` para `build`.
+
+    `max_workers` acota los workers de búsqueda cuando varios procesos del pool
+    comparten las CPUs, incluso con `solverConfig.workers` explícito.
+    """
+    config = tune_solver_config(payload, build, time_limit_seconds)
+    if max_workers is not None:
+        config["workers"] = max(1, min(config["workers"], int(max_workers)))
+    solver = new_solver(cp_model, time_limit_seconds, config["workers"], min_time_seconds=0.0)
+    apply_solver_config(solver, config, time_limit_seconds)
+    return solver, config
+
+
+def cancel_active_solves(reason: str) -> None:
+    """Pide `StopSearch` a todos los solves en curso; devuelven su mejor incumbente."""
+    with _ACTIVE_SOLVERS_LOCK:
+        if not _CANCELLED.is_set():
+            _CANCEL_REASON.append(reason)
+        _CANCELLED.set()
+        solvers = list(_ACTIVE_SOLVERS)
+    if _POOL_STOP is not None:
+        _POOL_STOP.set()
+    for solver in solvers:
+        solver.StopSearch()
+
+
+def cancel_reason() -> Optional[str]:
+    return _CANCEL_REASON[0] if _CANCELLED.is_set() and _CANCEL_REASON else None
+
+
+@contextmanager
+def request_scope() -> Iterator[None]:
+    """Ámbito de una petición (o de una tarea en un proceso del pool).
+
+    Una cancelación afecta a las peticiones en curso, no a las siguientes: al
+    terminar la última activa se limpian la marca, el motivo y el evento
+    compartido con el pool, así que el worker persistente y los procesos
+    reutilizados del pool no cancelan de inmediato. Una señal recibida antes
+    de empezar (p. ej. en one-shot mientras se lee stdin) sí cancela la
+    petición. En un proceso del pool, la tarea nace cancelada si el padre
+    sigue pidiendo parar y limpia una cancelación vieja si ya no lo pide.
+    """
+    global _ACTIVE_REQUESTS
+    with _ACTIVE_SOLVERS_LOCK:
+        if _ACTIVE_REQUESTS == 0 and _PARENT_STOP is not None and not _PARENT_STOP.is_set():
+            reset_cancellation()
+        _ACTIVE_REQUESTS += 1
+    if _PARENT_STOP is not None and _PARENT_STOP.is_set():
+        cancel_active_solves("parent")
+    try:
+        yield
+    finally:
+        with _ACTIVE_SOLVERS_LOCK:
+            _ACTIVE_REQUESTS -= 1
+            if _ACTIVE_REQUESTS == 0:
+                reset_cancellation()
+
+
+def reset_cancellation() -> None:
+    """Limpia la cancelación del proceso (con `_ACTIVE_SOLVERS_LOCK` tomado)."""
+    _CANCELLED.clear()
+    _CANCEL_REASON.clear()
+    if _POOL_STOP is not None:
+        _POOL_STOP.clear()
+
+
+def run_solver(solver: Any, model: Any, callback: Any = None) -> Any:
+    """`Solve` registrado para que SIGTERM/SIGINT puedan detenerlo limpiamente."""
+    with _ACTIVE_SOLVERS_LOCK:
+        _ACTIVE_SOLVERS.add(solver)
+        cancelled = _CANCELLED.is_set()
+    if cancelled:
+        solver.parameters.max_time_in_seconds = 0.0
+
+    def solve() -> Any:
+        if callback is not None:
+            return solver.Solve(model, callback)
+        return solver.Solve(model)
+
+    try:
+        if threading.current_thread() is not threading.main_thread():
+            return solve()
+        # Python solo atiende señales en el hilo principal y entre bytecodes;
+        # se resuelve en un hilo auxiliar para que SIGTERM llegue durante el solve.
+        outcome: Dict[str, Any] = {}
+
+        def target() -> None:
+            try:
+                outcome["status"] = solve()
+            except BaseException as error:
+                outcome["error"] = error
+
+        worker = threading.Thread(target=target, name="cp-sat-solve", daemon=True)
+        worker.start()
+        while worker.is_alive():
+            worker.join(0.1)
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["status"]
+    finally:
+        with _ACTIVE_SOLVERS_LOCK:
+            _ACTIVE_SOLVERS.discard(solver)
+
+
+def record_outcome(ctx: SolveContext, status: str) -> None:
+    """Anota en el perfil el estado del solve que produce la respuesta (lo usa la caché)."""
+    if ctx.profile is not None:
+        ctx.profile.outcome = status
+
+
+def remaining_until_deadline(payload: Dict[str, Any]) -> Optional[float]:
+    """Segundos hasta `deadlineEpochMs` menos el margen de salida; None sin deadline."""
+    deadline_ms = payload.get("deadlineEpochMs")
+    if not deadline_ms:
+        return None
+    try:
+        return float(deadline_ms) / 1000.0 - time.time() - DEADLINE_MARGIN_SECONDS
+    except Exception:
+        return None
 
-    status = solver.Solve(model)
 
-    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-        baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
-        out = {
-            "output": warm,
-            "quality": {
-                "improved": False,
-                "baselineScore": baseline_score,
-                "optimizedScore": baseline_score,
-                "objectiveDelta": 0,
-                "mainZoneGapMinutesDelta": 0,
-                "spaceSwitchesDelta": 0,
-            },
-            "degradations": [],
-            "message": "CP-SAT sin mejora factible; se devuelve Fase A.",
-            "technicalDetails": [f"status={status}"],
-        }
-        sys.stdout.write(json.dumps(out))
-        return 0
+def write_checkpoint(path: str, document: Dict[str, Any]) -> None:
+    """Escritura atómica (tmp + rename) para que el lector nunca vea un JSON a medias."""
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(document, handle)
+    os.replace(tmp_path, path)
+
+
+def assign_capacity_units(
+    ctx: SolveContext,
+    planned: List[Dict[str, Any]],
+    rewritten: Dict[int, Tuple[int, int]],
+) -> None:
+    """Pasa la demanda sobre pools y espacios de varios huecos a unidades concretas (`color_units`).
+
+    En los pools se sustituyen las unidades del pool en `assignedResources`; en
+    los espacios se escribe `assignedSpaceSlot` (1..capacidad). Solo se tocan
+    las filas que reescribe el solver; las demás conservan lo que traían y
+    ocupan sus unidades.
+    """
+    groups: Dict[Tuple[str, int], Tuple[List[Tuple[int, int, int, int, List[int], bool]], List[int]]] = {}
+    rows_by_tid: Dict[int, Dict[str, Any]] = {}
+    for row in planned:
+        tid = int(row.get("taskId") or -1)
+        spec = ctx.specs.get(tid)
+        if spec is None or not spec.cumulative_demands:
+            continue
+        if tid in rewritten:
+            start, end = rewritten[tid]
+        elif row.get("startPlanned") and row.get("endPlanned"):
+            start, end = parse_hhmm(str(row["startPlanned"])), parse_hhmm(str(row["endPlanned"]))
+        else:
+            continue
+        rows_by_tid[tid] = row
+        for (kind, key), demand in spec.cumulative_demands.items():
+            if kind == "pool":
+                units = ctx.pool_units[key]
+                pool = set(units)
+                preferred = [int(rid) for rid in row.get("assignedResources") or [] if int(rid or 0) in pool]
+            else:
+                units = list(range(1, ctx.capacities[(kind, key)] + 1))
+                slot = row.get("assignedSpaceSlot")
+                preferred = [int(slot)] if isinstance(slot, int) and slot in units else []
+            pinned = (tid not in rewritten or spec.fixed) and len(preferred) == demand
+            groups.setdefault((kind, key), ([], units))[0].append((start, end, tid, demand, preferred, pinned))
+
+    colored = 0
+    conflicts = 0
+    for (kind, key), (items, units) in groups.items():
+        assigned, group_conflicts = color_units(items, units)
+        conflicts += group_conflicts
+        pool = set(units)
+        for tid, chosen in assigned.items():
+            if tid not in rewritten:
+                continue
+            row = rows_by_tid[tid]
+            if kind == "pool":
+                row["assignedResources"] = [rid for rid in row.get("assignedResources") or [] if int(rid or 0) not in pool] + chosen
+            elif chosen:
+                row["assignedSpaceSlot"] = chosen[0]
+            colored += 1
+    ctx.report.setdefault("cumulative", {"groups": []})["coloring"] = {"rows": colored, "conflicts": conflicts}
+    if conflicts:
+        ctx.details.append(f"unitColoringConflicts={conflicts}")
+
+
+def assemble_result(
+    ctx: SolveContext,
+    solved_starts: Dict[int, int],
+    broken_tids: List[int],
+    solver_details: List[str],
+    model_details: List[str],
+) -> Dict[str, Any]:
+    """Reescribe las filas resueltas, re-puntúa con `score_plan` y compone la salida."""
+    engine_input = ctx.engine_input
+    warm = ctx.warm
+    warm_planned = ctx.warm_planned
+    work_start, work_end, grid = ctx.work_start, ctx.work_end, ctx.grid
+    pilot_mode = ctx.pilot_mode
+    requested_movable_ids = ctx.requested_movable_ids
 
     solved_rows: Dict[int, Dict[str, Any]] = {}
-    for tid in sorted(start_vars.keys()):
-        warm_task = planning_rows_by_tid.get(tid) or {}
-        t = tasks_by_id.get(tid) or {}
-        s = int(solver.Value(start_vars[tid]))
-        dur_slots = duration_slots_by_tid.get(tid, 1)
+    for tid in sorted(solved_starts.keys()):
+        warm_task = ctx.warm_by_id.get(tid) or {}
+        t = ctx.tasks_by_id.get(tid) or {}
+        s = int(solved_starts[tid])
+        dur_slots = ctx.specs[tid].dur_slots
         start_m = work_start + s * grid
         end_m = start_m + dur_slots * grid
         solved_rows[tid] = {
@@ -556,44 +2736,62 @@ def main() -> int:
             "taskId": tid,
             "startPlanned": to_hhmm(start_m),
             "endPlanned": to_hhmm(end_m),
-            "assignedResources": warm_task.get("assignedResources") or [],
+            "assignedResources": planned_resources(warm_task, t),
             "assignedSpace": warm_task.get("assignedSpace") if "assignedSpace" in warm_task else t.get("spaceId"),
         }
 
     # A pilot may only rewrite rows already emitted by Phase A. Protected/fixed rows
     # remain environmental intervals and are never added to the persistence payload.
     optimized_planned: List[Dict[str, Any]] = []
+    rewritten: Dict[int, Tuple[int, int]] = {}
     for warm_row in warm_planned:
         tid = int(warm_row.get("taskId") or -1)
-        optimized_planned.append(solved_rows.get(tid, warm_row) if (not pilot_mode or tid in requested_movable_ids) else warm_row)
-
-    baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
-    optimized_score, optimized_gap, optimized_switches = score_plan(engine_input, optimized_planned)
-    baseline_main_zone_occupied = compute_main_zone_occupied_slots(engine_input, warm_planned, work_start, work_end, grid)
-    optimized_main_zone_occupied = compute_main_zone_occupied_slots(engine_input, optimized_planned, work_start, work_end, grid)
-    baseline_makespan = max([parse_hhmm(p.get("endPlanned")) for p in warm_planned], default=work_start) - work_start
-    optimized_makespan = max([parse_hhmm(p.get("endPlanned")) for p in optimized_planned], default=work_start) - work_start
+        if tid in solved_rows and (not pilot_mode or tid in requested_movable_ids):
+            optimized_planned.append(solved_rows[tid])
+            start_m = work_start + int(solved_starts[tid]) * grid
+            rewritten[tid] = (start_m, start_m + ctx.specs[tid].dur_slots * grid)
+        else:
+            optimized_planned.append(warm_row)
+    if ctx.capacities:
+        assign_capacity_units(ctx, optimized_planned, rewritten)
+
+    table = ctx.plan_table
+    if table is not None:
+        optimized_start, optimized_end = plan_with_starts(table, rewritten)
+        scores = score_plans(table, [table.start, optimized_start], [table.end, optimized_end])
+        baseline_score, optimized_score = (int(v) for v in scores["score"])
+        baseline_gap, optimized_gap = (int(v) for v in scores["gap"])
+        baseline_switches, optimized_switches = (int(v) for v in scores["switches"])
+        baseline_main_zone_occupied, optimized_main_zone_occupied = (int(v) for v in scores["mainZoneOccupiedSlots"])
+        baseline_makespan, optimized_makespan = (int(v) for v in scores["makespan"])
+    else:
+        baseline_score, baseline_gap, baseline_switches = score_plan(engine_input, warm_planned)
+        optimized_score, optimized_gap, optimized_switches = score_plan(engine_input, optimized_planned)
+        baseline_main_zone_occupied = compute_main_zone_occupied_slots(engine_input, warm_planned, work_start, work_end, grid)
+        optimized_main_zone_occupied = compute_main_zone_occupied_slots(engine_input, optimized_planned, work_start, work_end, grid)
+        baseline_makespan = max([parse_hhmm(p.get("endPlanned")) for p in warm_planned], default=work_start) - work_start
+        optimized_makespan = max([parse_hhmm(p.get("endPlanned")) for p in optimized_planned], default=work_start) - work_start
     improved = optimized_score <= baseline_score
 
     broken = []
-    for tid, b in degrade_bools:
-        if solver.Value(b) == 1:
-            task = tasks_by_id.get(tid, {})
-            broken.append({
-                "rule": "LEVEL10_KEEP_WARM_START",
-                "taskId": tid,
-                "spaceId": int(task.get("spaceId") or 0),
-                "reason": "Se movió para desbloquear optimización global manteniendo hard constraints.",
-            })
+    for tid in broken_tids:
+        task = ctx.tasks_by_id.get(tid, {})
+        broken.append({
+            "rule": "LEVEL10_KEEP_WARM_START",
+            "taskId": tid,
+            "spaceId": int(task.get("spaceId") or 0),
+            "reason": "Se movió para desbloquear optimización global manteniendo hard constraints.",
+        })
 
     output = dict(warm)
     output["plannedTasks"] = optimized_planned if improved else warm_planned
 
     message = "CP-SAT completado; se mantiene best-so-far."
     if broken:
-        message += f" Se aplicaron {len(broken)} ruptura(s) de regla casi dura nivel 10 (máximo {near_hard_breaks_max})."
+        message += f" Se aplicaron {len(broken)} ruptura(s) de regla casi dura nivel 10 (máximo {ctx.near_hard_breaks_max})."
 
-    out = {
+    return {
+        **ctx.report,
         "output": output,
         "quality": {
             "improved": bool(improved and optimized_score < baseline_score),
@@ -606,23 +2804,1017 @@ def main() -> int:
         "degradations": broken,
         "message": message,
         "technicalDetails": [
-            f"status={status}",
-            f"wall_time_s={solver.WallTime():.3f}",
-            f"branches={solver.NumBranches()}",
-            f"conflicts={solver.NumConflicts()}",
+            *solver_details,
             f"mainZoneOccupiedSlotsBaseline={baseline_main_zone_occupied}",
             f"mainZoneOccupiedSlotsOptimized={optimized_main_zone_occupied}",
             f"makespanBaselineMinutes={baseline_makespan}",
             f"makespanOptimizedMinutes={optimized_makespan}",
-            f"mainZoneSlotVars={total_slots_main}",
-            f"mainZoneCoverVars={len(occ_cover_vars)}",
+            *model_details,
+            *ctx.details,
             f"pilotMode={pilot_mode}",
             f"pilotMovableTasks={len(requested_movable_ids)}",
         ],
     }
-    sys.stdout.write(json.dumps(out))
+
+
+def occupancy_details(occupancy: MainZoneOccupancy, encoding: str) -> List[str]:
+    return [
+        f"mainZoneSlotVars={occupancy.total_slots}",
+        f"mainZoneCoverVars={len(occupancy.cover_vars)}",
+        f"mainZoneOccupancyEncoding={encoding}{':' + occupancy.compact_mode if occupancy.compact_mode else ''}",
+        f"mainZoneForcedSlots={occupancy.forced_slots}",
+        *[
+            f"mainZoneOccupancy_{kind}_{key}={value}"
+            for kind, sizes in occupancy.model_sizes.items()
+            for key, value in sizes.items()
+        ],
+    ]
+
+
+def objective_term_vars(build: ModelBuild) -> Dict[str, Tuple[List[Any], int]]:
+    """Variables (o literales) y peso de cada término del objetivo, por nombre."""
+    return {
+        "mainZoneEmptySlots": ([build.main_zone_empty_slots], W1),
+        "makespan": ([build.makespan], W2),
+        "warmDistance": (list(build.abs_diffs.values()), W3),
+        "nearHardBreaks": ([b for _, b in build.degrade_bools], W4),
+        "contestantSpan": (list(build.span_vars.values()), W5),
+        "templateDispersion": (list(build.dispersion_vars.values()), W6),
+    }
+
+
+def objective_term_values(solver: Any, build: ModelBuild) -> Dict[str, Dict[str, float]]:
+    """Valor, peso y contribución de cada término del objetivo en la solución."""
+    raw = {
+        name: (sum(solver.Value(var) for var in variables), weight)
+        for name, (variables, weight) in objective_term_vars(build).items()
+    }
+    return {name: {"value": value, "weight": weight, "weighted": value * weight} for name, (value, weight) in raw.items()}
+
+
+def objective_term_lower_bound(build: ModelBuild, variables: List[Any]) -> int:
+    """Cota inferior trivial de un término: suma de los mínimos de dominio de sus variables."""
+    proto = build.model.Proto()
+    bound = 0
+    for var in variables:
+        index = var.Index()
+        if index < 0:
+            # Literal negado: vale 1 - x, su mínimo es 1 - máx(x).
+            bound += 1 - proto.variables[-index - 1].domain[-1]
+        else:
+            bound += proto.variables[index].domain[0]
+    return bound
+
+
+@dataclass
+class ConvergenceCriteria:
+    """Criterios de parada anticipada (`convergence` en el payload).
+
+    Los gaps se pasan a CP-SAT (`relative_gap_limit`/`absolute_gap_limit`) y el
+    callback de soluciones los comprueba además contra `BestObjectiveBound()`
+    en cada incumbente. El estancamiento y los objetivos por término los vigila
+    ese callback y un hilo que llama a `StopSearch`. `bound_targets` son los
+    términos pedidos con `"lowerBound"`, con su peso.
+    """
+
+    relative_gap: Optional[float] = None
+    absolute_gap: Optional[float] = None
+    stall_seconds: Optional[float] = None
+    stall_solutions: Optional[int] = None
+    min_improvement: float = 0.001
+    term_targets: Dict[str, float] = field(default_factory=dict)
+    bound_targets: Dict[str, int] = field(default_factory=dict)
+    stopped_by: Optional[str] = None
+    stopped_at: Optional[float] = None
+    last_improvement_at: Optional[float] = None
+    reference_objective: Optional[float] = None
+    stalled_solutions: int = 0
+
+    @property
+    def watches_solutions(self) -> bool:
+        return bool(
+            self.stall_seconds or self.stall_solutions or self.term_targets
+            or self.relative_gap is not None or self.absolute_gap is not None
+        )
+
+    def stop(self, criterion: str) -> None:
+        if self.stopped_by is None:
+            self.stopped_by = criterion
+            self.stopped_at = time.monotonic()
+
+    def observe(self, objective: float, bound: float, terms: Dict[str, float]) -> bool:
+        """Registra un incumbente y la cota del solver; devuelve True si la búsqueda debe parar."""
+        now = time.monotonic()
+        gap = max(0.0, objective - bound)
+        reference = self.reference_objective
+        if reference is None or reference - objective > self.min_improvement * max(1.0, abs(reference)):
+            self.reference_objective = objective
+            self.last_improvement_at = now
+            self.stalled_solutions = 0
+        else:
+            self.stalled_solutions += 1
+        # Con gap 0 el solver ya termina con el óptimo probado y así lo informa.
+        if gap > 0 and self.absolute_gap is not None and gap <= self.absolute_gap:
+            self.stop("absoluteGap")
+            return True
+        if gap > 0 and self.relative_gap is not None and gap <= self.relative_gap * max(1.0, abs(objective)):
+            self.stop("relativeGap")
+            return True
+        for name, target in self.term_targets.items():
+            # Con `lowerBound`, también basta con que el gap no deje mejorar el término ni una unidad.
+            weight = self.bound_targets.get(name)
+            if terms.get(name, float("inf")) <= target or (weight is not None and 0 < gap < weight):
+                self.stop(f"objectiveTarget:{name}")
+                return True
+        if self.stall_solutions and self.stalled_solutions >= self.stall_solutions:
+            self.stop("stallSolutions")
+            return True
+        return False
+
+    def stalled(self) -> bool:
+        if not self.stall_seconds or self.last_improvement_at is None:
+            return False
+        return time.monotonic() - self.last_improvement_at >= self.stall_seconds
+
+
+def convergence_criteria(payload: Dict[str, Any], build: ModelBuild) -> Tuple[Optional[ConvergenceCriteria], List[str]]:
+    """Lee `convergence`.
+
+    `"lowerBound"` como objetivo de término se cumple al llegar a la cota de
+    dominio del término o cuando `objetivo - BestObjectiveBound()` es menor que
+    su peso: ninguna solución mejora ese término una unidad sin empeorar otro.
+    """
+    raw = payload.get("convergence") or {}
+    if not raw:
+        return None, []
+    details: List[str] = []
+    term_vars = objective_term_vars(build)
+    targets: Dict[str, float] = {}
+    bound_targets: Dict[str, int] = {}
+    for name, target in (raw.get("objectiveTargets") or {}).items():
+        if name not in term_vars:
+            details.append(f"convergenceUnknownTerm={name}")
+            continue
+        variables, weight = term_vars[name]
+        if target == "lowerBound":
+            targets[name] = float(objective_term_lower_bound(build, variables))
+            bound_targets[name] = weight
+        else:
+            targets[name] = float(target)
+
+    def number(key: str) -> Optional[float]:
+        value = raw.get(key)
+        return float(value) if value is not None else None
+
+    criteria = ConvergenceCriteria(
+        relative_gap=number("relativeGap"),
+        absolute_gap=number("absoluteGap"),
+        stall_seconds=number("stallSeconds"),
+        stall_solutions=int(raw["stallSolutions"]) if raw.get("stallSolutions") else None,
+        min_improvement=float(raw.get("minImprovement", 0.001)),
+        term_targets=targets,
+        bound_targets=bound_targets,
+    )
+    return criteria, details
+
+
+def apply_convergence(solver: Any, criteria: ConvergenceCriteria) -> None:
+    if criteria.relative_gap is not None:
+        solver.parameters.relative_gap_limit = criteria.relative_gap
+    if criteria.absolute_gap is not None:
+        solver.parameters.absolute_gap_limit = criteria.absolute_gap
+
+
+@contextmanager
+def stall_watchdog(solver: Any, criteria: Optional[ConvergenceCriteria], poll_seconds: float = 0.05) -> Iterator[None]:
+    """Hilo que detiene el solve cuando el incumbente lleva `stallSeconds` sin mejorar."""
+    if criteria is None or not criteria.stall_seconds:
+        yield
+        return
+    done = threading.Event()
+
+    def watch() -> None:
+        while not done.wait(poll_seconds):
+            if criteria.stalled():
+                criteria.stop("stallSeconds")
+                solver.StopSearch()
+                return
+
+    watcher = threading.Thread(target=watch, name="cp-sat-stall", daemon=True)
+    watcher.start()
+    try:
+        yield
+    finally:
+        done.set()
+        watcher.join()
+
+
+def stop_criterion(solver: Any, status: Any, criteria: Optional[ConvergenceCriteria], cancelled: Optional[str]) -> str:
+    """Qué detuvo la búsqueda: criterio de convergencia, óptimo probado, cancelación o límite de tiempo."""
+    if cancelled:
+        return "cancelled"
+    if criteria is not None and criteria.stopped_by:
+        return criteria.stopped_by
+    name = solver.StatusName(status)
+    if name == "OPTIMAL":
+        objective = solver.ObjectiveValue()
+        gap = abs(objective - solver.BestObjectiveBound())
+        if criteria is not None and gap > 0:
+            if criteria.absolute_gap is not None and gap <= criteria.absolute_gap:
+                return "absoluteGap"
+            return "relativeGap"
+        return "optimal"
+    if name in ["INFEASIBLE", "MODEL_INVALID"]:
+        return name.lower()
+    return "timeLimit"
+
+
+def make_incumbent_monitor(
+    cp_model: Any,
+    ctx: SolveContext,
+    build: ModelBuild,
+    emit: Optional[Any],
+    checkpoint_path: Optional[str] = None,
+    checkpoint_interval_seconds: float = 1.0,
+    convergence: Optional[ConvergenceCriteria] = None,
+) -> Any:
+    """Callback de soluciones: emite cada incumbente como evento `progress`.
+
+    `moved` lista solo las tareas movibles cuyo inicio cambió respecto al
+    incumbente anterior (o al warm start en la primera solución), como pares
+    `[taskId, "HH:MM"]`. Con `checkpoint_path` escribe además el documento de
+    salida completo del último incumbente, como mucho una vez por intervalo.
+    Con `convergence` evalúa los criterios de parada en cada incumbente.
+    """
+    term_vars = {
+        name: variables
+        for name, (variables, _) in objective_term_vars(build).items()
+        if convergence is not None and name in convergence.term_targets
+    }
+
+    class IncumbentMonitor(cp_model.CpSolverSolutionCallback):
+        def __init__(self) -> None:
+            super().__init__()
+            self.solutions = 0
+            self.last_starts: Dict[int, int] = {tid: ctx.specs[tid].warm_slot for tid in build.movable_task_ids}
+            self.best_starts: Dict[int, int] = {}
+            self.last_checkpoint_at = 0.0
+            self.checkpoints = 0
+
+        def checkpoint(self, objective: float, bound: float) -> None:
+            now = time.monotonic()
+            if not checkpoint_path or now - self.last_checkpoint_at < checkpoint_interval_seconds:
+                return
+            self.last_checkpoint_at = now
+            starts = {tid: int(self.Value(var)) for tid, var in build.start_vars.items()}
+            broken = [tid for tid, b in build.degrade_bools if self.Value(b) == 1]
+            document = assemble_result(ctx, starts, broken, [f"checkpoint_solution={self.solutions}"], [])
+            document["checkpoint"] = {
+                "solution": self.solutions,
+                "objective": objective,
+                "bestBound": bound,
+                "elapsedSeconds": round(float(self.WallTime()), 3),
+            }
+            try:
+                write_checkpoint(checkpoint_path, document)
+                self.checkpoints += 1
+            except OSError:
+                pass
+
+        def on_solution_callback(self) -> None:
+            self.solutions += 1
+            starts = {tid: int(self.Value(build.start_vars[tid])) for tid in build.movable_task_ids}
+            moved = [
+                [tid, to_hhmm(ctx.work_start + slot * ctx.grid)]
+                for tid, slot in starts.items()
+                if self.last_starts.get(tid) != slot
+            ]
+            self.last_starts = starts
+            self.best_starts = starts
+            objective = float(self.ObjectiveValue())
+            bound = float(self.BestObjectiveBound())
+            self.checkpoint(objective, bound)
+            if convergence is not None:
+                terms = {name: sum(self.Value(var) for var in variables) for name, variables in term_vars.items()}
+                if convergence.observe(objective, bound, terms):
+                    self.StopSearch()
+            if emit is None:
+                return
+            emit({
+                "type": "progress",
+                "solution": self.solutions,
+                "objective": objective,
+                "bestBound": bound,
+                "gap": abs(objective - bound) / max(1.0, abs(objective)),
+                "elapsedSeconds": round(float(self.WallTime()), 3),
+                "movedFromWarm": sum(1 for tid, slot in starts.items() if slot != ctx.specs[tid].warm_slot),
+                "moved": moved,
+            })
+
+    return IncumbentMonitor()
+
+
+def solver_stats(solver: Any, status: Any) -> Dict[str, Any]:
+    """Estadísticas de la respuesta CP-SAT; presolve y primera solución salen del log de búsqueda."""
+    response = solver.ResponseProto()
+    stats: Dict[str, Any] = {
+        "status": solver.StatusName(status),
+        "wallSeconds": round(solver.WallTime(), 4),
+        "userSeconds": round(solver.UserTime(), 4),
+        "deterministicTime": round(response.deterministic_time, 4),
+        "branches": solver.NumBranches(),
+        "conflicts": solver.NumConflicts(),
+        "numWorkers": solver.parameters.num_search_workers,
+        "presolveSeconds": None,
+        "firstSolutionSeconds": None,
+        "firstSolutionBy": None,
+    }
+    if solver.StatusName(status) in ["OPTIMAL", "FEASIBLE"]:
+        objective = solver.ObjectiveValue()
+        bound = solver.BestObjectiveBound()
+        stats["objective"] = objective
+        stats["bestBound"] = bound
+        stats["gap"] = round(abs(objective - bound) / max(1.0, abs(objective)), 6)
+    presolve_started = None
+    for line in response.solve_log.splitlines():
+        if line.startswith("Starting presolve at "):
+            presolve_started = float(line.rsplit(" ", 1)[-1].rstrip("s"))
+        elif line.startswith("Starting search at ") and presolve_started is not None:
+            stats["presolveSeconds"] = round(float(line.split(" ")[3].rstrip("s")) - presolve_started, 4)
+        elif line.startswith("#1 ") and stats["firstSolutionSeconds"] is None:
+            match = re.match(r"#1\s+([\d.]+)s\s+best:\S+\s+next:\S+\s+(\S+)", line)
+            if match:
+                stats["firstSolutionSeconds"] = float(match.group(1))
+                stats["firstSolutionBy"] = match.group(2)
+    return stats
+
+
+def solve_request(
+    payload: Dict[str, Any],
+    emit: Optional[Any] = None,
+    profile: Optional[RequestProfile] = None,
+    base: Optional[BatchBase] = None,
+) -> Dict[str, Any]:
+    """Resuelve un payload one-shot. `emit`, si se indica, recibe eventos de progreso.
+
+    `base` es el trabajo compartido del escenario base cuando el payload es una variante de `scenarios`.
+    Toda respuesta, también las de Fase A, incluye `profile`. Con
+    `profileDumpPath` se vuelca además un perfil cProfile (pstats) de la petición.
+    """
+    with request_scope():
+        profile = profile or RequestProfile()
+        decode_started = time.perf_counter()
+        decoded = cp_sat_server.decode_columnar_payload(payload)
+        if decoded is not payload:
+            profile.add("decodeColumnar", time.perf_counter() - decode_started)
+            payload = decoded
+        capture = None if payload.get("validateOnly") else cp_sat_cache.capture_config_for(payload)
+        if capture is not None:
+            profile.capture = cp_sat_cache.PendingCapture(config=capture, sampled=random.random() < capture.sample_rate)
+        dump_path = payload.get("profileDumpPath")
+        profiler = None
+        if dump_path:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            if payload.get("validateOnly"):
+                with profile.phase("validate"):
+                    result = validate_request(payload)
+            elif payload.get("scenarios"):
+                result = solve_batch(payload, emit, profile)
+            else:
+                result = cp_sat_cache.solve_cached(payload, emit, profile, base)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                try:
+                    profiler.dump_stats(str(dump_path))
+                    profile.pstats = {"path": str(dump_path)}
+                except OSError as error:
+                    profile.pstats = {"path": str(dump_path), "error": str(error)}
+        result["profile"] = profile.to_dict()
+        cp_sat_cache.finish_capture(profile, payload, result)
+        if payload.get("responseMode") == "diff":
+            result = cp_sat_server.diff_response(result, list((payload.get("warmStart") or {}).get("plannedTasks") or []))
+        return result
+
+
+def merge_overlay(base: Dict[str, Any], overlay: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica un overlay sobre un payload: los objetos se fusionan por clave, el resto se sustituye.
+
+    Solo copia los niveles que el overlay toca; el resto se comparte con la base.
+    """
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merged[key] = merge_overlay(base[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def solve_batch(payload: Dict[str, Any], emit: Optional[Any], profile: RequestProfile) -> Dict[str, Any]:
+    """Resuelve el payload base y N escenarios what-if en paralelo bajo un único presupuesto.
+
+    Cada escenario es `{"id", "overlay"}` (o los campos del overlay junto a
+    `id`) fusionado sobre el payload base. Los escenarios corren en hilos
+    (CP-SAT libera el GIL) en oleadas de `batchMaxConcurrency`; el presupuesto
+    total se reparte entre oleadas y los workers de búsqueda entre escenarios
+    simultáneos. La respuesta es la del escenario base, más `scenarios` con
+    cada resultado y sus deltas de `score_plan` frente a la base.
+    """
+    started = time.monotonic()
+    base_payload = {key: value for key, value in payload.items() if key not in ["scenarios", "batchMaxConcurrency"]}
+    variants: List[Tuple[str, Dict[str, Any]]] = [("base", base_payload)]
+    for index, scenario in enumerate(payload.get("scenarios") or []):
+        if not isinstance(scenario, dict):
+            continue
+        overlay = scenario.get("overlay")
+        if not isinstance(overlay, dict):
+            overlay = {key: value for key, value in scenario.items() if key not in ["id", "label"]}
+        variants.append((str(scenario.get("id") or f"scenario-{index + 1}"), merge_overlay(base_payload, overlay)))
+
+    total_budget = float(payload.get("timeLimitSeconds") or 0)
+    cpus = available_cpus()
+    concurrency = max(1, min(len(variants), int(payload.get("batchMaxConcurrency") or cpus)))
+    waves = -(-len(variants) // concurrency)
+    per_variant = total_budget / waves
+    search_workers = max(1, cpus // concurrency)
+    deadline_ms = time.time() * 1000.0 + total_budget * 1000.0
+    if payload.get("deadlineEpochMs") is not None:
+        deadline_ms = min(deadline_ms, float(payload["deadlineEpochMs"]))
+
+    # El escenario base se parsea y valida una vez; cada variante copia su contexto y aplica solo su overlay.
+    with profile.phase("prepare"):
+        base = batch_base(base_payload)
+
+    def run_variant(variant_id: str, variant_payload: Dict[str, Any]) -> Dict[str, Any]:
+        # Deadline propio por escenario (desde que arranca en su oleada), acotado por el del lote.
+        variant_payload = {
+            **variant_payload,
+            "timeLimitSeconds": min(per_variant, float(variant_payload.get("timeLimitSeconds") or per_variant)),
+            "deadlineEpochMs": min(deadline_ms, time.time() * 1000.0 + per_variant * 1000.0),
+            "numSearchWorkers": variant_payload.get("numSearchWorkers") or search_workers,
+            # El lote se captura entero; sus escenarios no generan capturas propias.
+            "capture": False,
+        }
+        variant_emit = (lambda event: emit({**event, "scenario": variant_id})) if emit is not None else None
+        return solve_request(variant_payload, variant_emit, base=base)
+
+    with profile.phase("batch"):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [(variant_id, variant_payload, pool.submit(run_variant, variant_id, variant_payload)) for variant_id, variant_payload in variants]
+            outcomes = []
+            for variant_id, variant_payload, future in futures:
+                try:
+                    outcomes.append((variant_id, variant_payload, future.result(), None))
+                except Exception as error:
+                    outcomes.append((variant_id, variant_payload, None, f"{type(error).__name__}: {error}"))
+
+    entries = []
+    base_score: Optional[Tuple[int, int, int]] = None
+    for variant_id, variant_payload, result, error in outcomes:
+        if result is None:
+            entries.append({"id": variant_id, "error": error})
+            continue
+        planned = list((result.get("output") or {}).get("plannedTasks") or [])
+        score, gap, switches = score_plan(variant_payload.get("engineInput") or {}, planned)
+        if base_score is None and variant_id == "base":
+            base_score = (score, gap, switches)
+        entry = {"id": variant_id, "score": {"score": score, "gap": gap, "switches": switches}, "result": result}
+        if base_score is not None:
+            entry["deltaVsBase"] = {
+                "score": score - base_score[0],
+                "gap": gap - base_score[1],
+                "switches": switches - base_score[2],
+            }
+        entries.append(entry)
+
+    base_entry = entries[0]
+    if base_entry.get("result") is None:
+        base_result = baseline_result(
+            payload.get("engineInput") or {}, payload.get("warmStart") or {},
+            "Escenario base fallido; se devuelve Fase A.", [f"batch_base_error={base_entry.get('error')}"],
+        )
+    else:
+        base_result = {key: value for key, value in base_entry["result"].items() if key != "profile"}
+    return {
+        **base_result,
+        "technicalDetails": [
+            *base_result.get("technicalDetails", []),
+            f"batchScenarios={len(variants) - 1}",
+            f"batchConcurrency={concurrency}",
+            f"batchWaves={waves}",
+            f"batchTimeLimitPerScenarioS={per_variant:.3f}",
+            f"batchSearchWorkersPerScenario={search_workers}",
+            f"batchSharedContext={str(base is not None).lower()}",
+            f"batchWallS={time.monotonic() - started:.3f}",
+        ],
+        "scenarios": entries,
+    }
+
+
+# Prioridades del modo lexicográfico por defecto: de mayor a menor peso; el último
+# nivel agrupa los términos de peso pequeño con sus pesos relativos.
+LEXICOGRAPHIC_STAGES = [
+    ["mainZoneEmptySlots"],
+    ["nearHardBreaks"],
+    ["makespan"],
+    ["templateDispersion", "warmDistance", "contestantSpan"],
+]
+
+# Reparto del presupuesto por nivel: el primero (zona principal) es el que más mejora con tiempo.
+LEXICOGRAPHIC_SHARES = [3.0, 1.0, 1.0, 1.0]
+
+
+def solve_lexicographic(
+    cp_model: Any,
+    ctx: SolveContext,
+    build: ModelBuild,
+    options: Dict[str, Any],
+    time_limit_seconds: float,
+    monitor: Any = None,
+) -> Tuple[Any, Any]:
+    """Optimiza los niveles de `stages` en orden sobre el mismo modelo.
+
+    Cada nivel minimiza su suma ponderada con el presupuesto restante repartido
+    entre los niveles pendientes (lo que un nivel óptimo no gasta pasa al
+    siguiente), fija el valor alcanzado (`==` si es óptimo, `<=` si no) y deja su
+    solución como hint completo del siguiente. El reparto sigue `shares`
+    (`LEXICOGRAPHIC_SHARES` por defecto). Devuelve `(solver, status)` del
+    último nivel con solución; los niveles sin variables se saltan. La
+    configuración del solver se ajusta al presupuesto de cada nivel.
+    """
+    deadline = time.monotonic() + time_limit_seconds
+    term_vars = objective_term_vars(build)
+    configured = options.get("stages") or LEXICOGRAPHIC_STAGES
+    configured_shares = [float(share) for share in (options.get("shares") or LEXICOGRAPHIC_SHARES)]
+    stages: List[List[str]] = []
+    shares: List[float] = []
+    for index, stage in enumerate(configured):
+        names = [name for name in stage if name in term_vars and term_vars[name][0]]
+        if names:
+            stages.append(names)
+            shares.append(configured_shares[index] if index < len(configured_shares) else 1.0)
+    report: List[Dict[str, Any]] = []
+    ctx.report["lexicographic"] = {"stages": report}
+    best: Tuple[Any, Any] = (None, None)
+    model = build.model
+    for index, stage in enumerate(stages):
+        weights = {name: (term_vars[name][1] if len(stage) > 1 else 1) for name in stage}
+        expression = sum(weights[name] * sum(term_vars[name][0]) for name in stage)
+        model.Minimize(expression)
+        remaining = deadline - time.monotonic()
+        limit = max(0.0, remaining * shares[index] / sum(shares[index:]))
+        solver, config = tuned_solver(cp_model, ctx.payload, build, limit)
+        status = run_solver(solver, model, monitor)
+        stats = solver_stats(solver, status)
+        entry: Dict[str, Any] = {"terms": stage, "timeLimitSeconds": round(limit, 3), "presolve": config["presolve"], **stats}
+        report.append(entry)
+        if stats["status"] not in ["OPTIMAL", "FEASIBLE"]:
+            break
+        best = (solver, status)
+        value = int(round(solver.ObjectiveValue()))
+        entry["value"] = value
+        if index == len(stages) - 1:
+            break
+        if stats["status"] == "OPTIMAL":
+            model.Add(expression == value)
+            entry["fixed"] = "equal"
+        else:
+            model.Add(expression <= value)
+            entry["fixed"] = "upperBound"
+        starts = {tid: int(solver.Value(var)) for tid, var in build.start_vars.items()}
+        build.hint = {**add_solution_hint(ctx, build, starts), "repairedTasks": build.hint.get("repairedTasks", [])}
+        if cancel_reason():
+            break
+    if best[0] is None:
+        return solver, status
+    return best
+
+
+def solve_coarse_stage(
+    cp_model: Any,
+    ctx: SolveContext,
+    options: Dict[str, Any],
+    time_limit_seconds: float,
+) -> Tuple[float, Dict[int, int]]:
+    """Fase gruesa de `multiResolution`: resuelve en el grid grueso y estrecha `ctx` alrededor.
+
+    Devuelve los segundos consumidos y los inicios de partida (warm start o hint)
+    de las tareas estrechadas, para comparar después el objetivo fino con el suyo.
+    Si la fase gruesa no encuentra solución, `ctx` queda intacto, el solve fino usa
+    el dominio completo y no hay inicios que comparar.
+    """
+    started = time.monotonic()
+    coarse_grid = int(options.get("coarseGridMinutes") or 15)
+    r = max(1, coarse_grid // ctx.grid)
+    radius = max(r, -(-int(options.get("refineRadiusMinutes") or coarse_grid) // ctx.grid))
+    stage: Dict[str, Any] = {"coarseGridMinutes": coarse_grid, "refineRadiusMinutes": radius * ctx.grid}
+    ctx.report["multiResolution"] = stage
+    coarse = coarse_context(ctx, coarse_grid)
+    if coarse is None:
+        stage["coarse"] = {"status": "SKIPPED"}
+        ctx.details.append("multiResolutionCoarse=SKIPPED")
+        return time.monotonic() - started, {}
+    encoding = ctx.occupancy_encoding
+    if not ctx.payload.get("occupancyEncoding"):
+        # `cover` ignora los dominios; `compact` sí aprovecha las ventanas estrechas del refinado.
+        coarse.occupancy_encoding = "compact"
+    coarse.profile = None
+    # El warm start redondeado casi nunca es factible en el grid grueso: se repara el hint.
+    coarse.payload = {**ctx.payload, "repairHint": True}
+    build = build_model(cp_model, coarse)
+    proto = build.model.Proto()
+    limit = max(0.05, time_limit_seconds * float(options.get("coarseShare") or 0.3))
+    solver, config = tuned_solver(cp_model, ctx.payload, build, limit)
+    status = run_solver(solver, build.model)
+    stats = solver_stats(solver, status)
+    stage["coarse"] = {
+        "variables": len(proto.variables),
+        "constraints": len(proto.constraints),
+        "horizonSlots": coarse.horizon,
+        **stats,
+    }
+    warm_starts: Dict[int, int] = {}
+    if solver.StatusName(status) in ["OPTIMAL", "FEASIBLE"]:
+        starts = {tid: int(solver.Value(build.start_vars[tid])) for tid in build.movable_task_ids}
+        warm_starts = {
+            tid: ctx.hint_starts[tid] if tid in ctx.hint_starts else ctx.specs[tid].warm_slot
+            for tid in starts
+            if tid in ctx.specs
+        }
+        stage["narrowedTasks"] = narrow_to_coarse_placement(ctx, starts, r, radius, warm_starts)
+        ctx.occupancy_encoding = coarse.occupancy_encoding
+    stage["occupancyEncoding"] = ctx.occupancy_encoding if stage.get("narrowedTasks") is not None else encoding
+    ctx.details.append(f"multiResolutionCoarse={stats['status']}")
+    return time.monotonic() - started, warm_starts
+
+
+def plan_objective(ctx: SolveContext, build: ModelBuild, starts: Dict[int, int]) -> Optional[float]:
+    """Objetivo del modelo en la asignación completa que deriva de `starts`.
+
+    Reutiliza el cálculo del hint (sustituye los hints del modelo) y devuelve None
+    si la asignación no es completa o incumple alguna regla dura.
+    """
+    if build.symmetry_classes:
+        starts = order_symmetric_starts(build, starts)
+    hint = add_solution_hint(ctx, build, starts)
+    if not hint["complete"] or not hint["feasible"]:
+        return None
+    proto = build.model.Proto()
+    values = dict(zip(proto.solution_hint.vars, proto.solution_hint.values))
+    objective = proto.objective
+    total = objective.offset + sum(coeff * values[var] for var, coeff in zip(objective.vars, objective.coeffs))
+    return float(total * (objective.scaling_factor or 1))
+
+
+def solve_uncached(
+    payload: Dict[str, Any],
+    emit: Optional[Any],
+    profile: RequestProfile,
+    hint_plan: Optional[List[Dict[str, Any]]] = None,
+    base: Optional[BatchBase] = None,
+) -> Dict[str, Any]:
+    engine_input = payload.get("engineInput") or {}
+    warm = payload.get("warmStart") or {}
+    time_limit_seconds = float(payload.get("timeLimitSeconds") or 0)
+
+    if time_limit_seconds <= 0:
+        return baseline_result(
+            engine_input, warm, "Optimización CP-SAT omitida por presupuesto 0.", ["time_limit_seconds<=0"]
+        )
+
+    with profile.phase("precheck"):
+        if base is not None and same_plan_inputs(base.payload, payload):
+            precheck = base.precheck
+        else:
+            precheck = validate_plan(payload)
+    if precheck["fixedConflicts"]:
+        # Las tareas fijas ya chocan entre sí o con su ventana: el modelo sería infactible.
+        early_result = baseline_result(
+            engine_input,
+            warm,
+            "Las tareas fijas del warm start incumplen reglas duras; se devuelve Fase A sin resolver.",
+            ["precheck_fixed_conflict", f"precheckViolations={precheck['violationCount']}"],
+        )
+        early_result["validation"] = {"warmStart": validation_summary(precheck)}
+        return early_result
+
+    cp_model = load_cp_model()
+    if cp_model is None:
+        return baseline_result(
+            engine_input, warm, "OR-Tools no disponible; se devuelve Fase A.", ["ortools_import_failed"]
+        )
+
+    with profile.phase("prepare"):
+        ctx, early = prepare_context(payload, profile, base)
+    if ctx is None:
+        return early or baseline_result(engine_input, warm, "Payload CP-SAT inválido; se devuelve Fase A.", [])
+    if hint_plan:
+        ctx.hint_starts = plan_start_slots(ctx, hint_plan)
+    if not precheck["valid"]:
+        ctx.details.append(f"precheckViolations={precheck['violationCount']}")
+        if not payload.get("repairHint"):
+            # Un hint que incumple reglas duras solo hace perder tiempo al solver: se repara antes.
+            ctx.payload = {**payload, "repairHint": True}
+            ctx.details.append("precheckRepairHint=true")
+
+    progress = emit if payload.get("stream") else None
+    if payload.get("decompose"):
+        with profile.phase("decompose"):
+            decomposed = cp_sat_decompose.solve_decomposed(cp_model, ctx, progress)
+        if decomposed is not None:
+            with profile.phase("postcheck"):
+                return postcheck_result(payload, precheck, decomposed)
+
+    if payload.get("lns"):
+        with profile.phase("lns"):
+            searched = cp_sat_decompose.solve_lns(cp_model, ctx, progress)
+        if searched is not None:
+            with profile.phase("postcheck"):
+                return postcheck_result(payload, precheck, searched)
+
+    multi_resolution = payload.get("multiResolution")
+    coarse_warm_starts: Dict[int, int] = {}
+    if multi_resolution:
+        options = multi_resolution if isinstance(multi_resolution, dict) else {}
+        with profile.phase("coarse"):
+            coarse_seconds, coarse_warm_starts = solve_coarse_stage(cp_model, ctx, options, time_limit_seconds)
+        time_limit_seconds = max(0.05, time_limit_seconds - coarse_seconds)
+
+    with cp_sat_reuse.reusable_model(cp_model, ctx, profile) as build:
+        proto = build.model.Proto()
+        profile.model = {"variables": len(proto.variables), "constraints": len(proto.constraints)}
+        if payload.get("profileModelKinds") or len(proto.constraints) <= PROFILE_MODEL_KINDS_MAX_CONSTRAINTS:
+            profile.model = model_counts(build.model)
+        solver_details: List[str] = []
+        if payload.get("symmetryBreaking"):
+            ctx.report["symmetry"] = {
+                "classes": len(build.symmetry_classes),
+                "tasks": sum(len(tids) for tids in build.symmetry_classes),
+                "largestClass": max((len(tids) for tids in build.symmetry_classes), default=0),
+            }
+            solver_details.extend([
+                f"symmetryClasses={ctx.report['symmetry']['classes']}",
+                f"symmetryTasks={ctx.report['symmetry']['tasks']}",
+            ])
+        remaining = remaining_until_deadline(payload)
+        if remaining is not None and remaining < time_limit_seconds:
+            if remaining <= 0:
+                return baseline_result(
+                    engine_input, warm, "Deadline CP-SAT agotado antes del solve; se devuelve Fase A.", ["deadline_exceeded_before_solve"]
+                )
+            effective_limit = remaining
+            solver_details.append(f"deadlineClampedTimeLimitS={remaining:.3f}")
+        else:
+            effective_limit = time_limit_seconds
+        config = tune_solver_config(payload, build, effective_limit)
+        solver = new_solver(cp_model, effective_limit, config["workers"], min_time_seconds=0.0)
+        rejected = apply_solver_config(solver, config, effective_limit)
+        if config["deterministic"] and remaining is not None:
+            solver.parameters.max_time_in_seconds = min(solver.parameters.max_time_in_seconds, max(0.0, remaining))
+        ctx.report["solverConfig"] = {key: value for key, value in config.items() if key != "parameters" or value}
+        solver_details.extend(solver_config_details(config))
+        if rejected:
+            solver_details.append(f"solverConfigRejected={','.join(rejected)}")
+        criteria, convergence_details = convergence_criteria(payload, build)
+        solver_details.extend(convergence_details)
+        if criteria is not None:
+            apply_convergence(solver, criteria)
+        checkpoint_path = payload.get("checkpointPath")
+        monitor = None
+        if progress is not None or checkpoint_path or (criteria is not None and criteria.watches_solutions):
+            monitor = make_incumbent_monitor(
+                cp_model,
+                ctx,
+                build,
+                progress,
+                str(checkpoint_path) if checkpoint_path else None,
+                float(payload.get("checkpointIntervalSeconds") or 1.0),
+                criteria,
+            )
+        lexicographic = payload.get("lexicographic")
+        if lexicographic:
+            with profile.phase("solve"):
+                solver, status = solve_lexicographic(
+                    cp_model,
+                    ctx,
+                    build,
+                    lexicographic if isinstance(lexicographic, dict) else {},
+                    effective_limit,
+                    monitor,
+                )
+            stages = ctx.report["lexicographic"]["stages"]
+            solver_details.append("lexicographicStages=" + ",".join(f"{'+'.join(s['terms'])}:{s['status']}" for s in stages))
+        else:
+            with profile.phase("solve"), stall_watchdog(solver, criteria):
+                status = run_solver(solver, build.model, monitor)
+        profile.solver = solver_stats(solver, status)
+        profile.outcome = solver.StatusName(status)
+        cp_sat_cache.stage_capture_model(profile, build.model, solver, status in [cp_model.OPTIMAL, cp_model.FEASIBLE])
+        if "multiResolution" in ctx.report:
+            stage = ctx.report["multiResolution"]
+            stage["fine"] = {**profile.model, **profile.solver, "horizonSlots": ctx.horizon}
+            if coarse_warm_starts and status in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+                # El refinado no debe devolver un plan peor que el de partida, aunque `score_plan` empate.
+                warm_starts = {**warm_hint_starts(ctx, build), **coarse_warm_starts}
+                stage["fineObjective"] = float(solver.ObjectiveValue())
+                stage["warmObjective"] = plan_objective(ctx, build, warm_starts)
+                stage["fallback"] = (
+                    stage["warmObjective"] is not None and stage["fineObjective"] > stage["warmObjective"]
+                )
+                if stage["fallback"]:
+                    solver_details.append(f"multiResolutionFallback=fine:{stage['fineObjective']:.0f}>warm:{stage['warmObjective']:.0f}")
+                    fallback = baseline_result(
+                        engine_input,
+                        warm,
+                        "El refinado multiResolution empeora el objetivo del warm start; se devuelve Fase A.",
+                        [f"status={status}", *solver_details, *hint_details(build.hint)],
+                    )
+                    fallback["multiResolution"] = stage
+                    return fallback
+        cancelled = cancel_reason()
+        if cancelled:
+            solver_details.append(f"cancelled={cancelled}")
+        criterion = stop_criterion(solver, status, criteria, cancelled)
+        solver_details.append(f"stopCriterion={criterion}")
+        if criteria is not None:
+            wall = float(solver.WallTime())
+            ctx.report["convergence"] = {
+                "stoppedBy": criterion,
+                "elapsedSeconds": round(wall, 3),
+                "budgetSeconds": round(effective_limit, 3),
+                "savedSeconds": round(max(0.0, effective_limit - wall), 3),
+                "objectiveTargets": criteria.term_targets,
+                "boundTargets": sorted(criteria.bound_targets),
+            }
+        if monitor is not None and checkpoint_path:
+            solver_details.append(f"checkpointsWritten={monitor.checkpoints}")
+
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            message = "CP-SAT sin mejora factible; se devuelve Fase A."
+            if cancelled:
+                message = "CP-SAT interrumpido sin incumbente factible; se devuelve Fase A."
+            return baseline_result(engine_input, warm, message, [f"status={status}", *solver_details, *hint_details(build.hint)])
+
+        profile.objective_terms = objective_term_values(solver, build)
+        solved_starts = {tid: int(solver.Value(var)) for tid, var in build.start_vars.items()}
+        broken_tids = [tid for tid, b in build.degrade_bools if solver.Value(b) == 1]
+        with profile.phase("assemble"):
+            result = assemble_result(
+                ctx,
+                solved_starts,
+                broken_tids,
+                [
+                    f"status={status}",
+                    f"wall_time_s={solver.WallTime():.3f}",
+                    f"branches={solver.NumBranches()}",
+                    f"conflicts={solver.NumConflicts()}",
+                    *solver_details,
+                ],
+                [*occupancy_details(build.occupancy, ctx.occupancy_encoding), *hint_details(build.hint)],
+            )
+        if cancelled:
+            result["message"] = "CP-SAT interrumpido; se devuelve el mejor incumbente. " + result["message"]
+        with profile.phase("postcheck"):
+            return postcheck_result(payload, precheck, result)
+
+
+def available_cpus() -> int:
+    """CPUs utilizables: afinidad del proceso acotada por la cuota CFS del cgroup (contenedores)."""
+    try:
+        cpus = max(1, len(os.sched_getaffinity(0)))
+    except Exception:
+        cpus = max(1, os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as handle:
+            quota, period = handle.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+_PROCESS_POOL: Any = None
+_PROCESS_POOL_SIZE = 0
+_PROCESS_POOL_LOCK = threading.Lock()
+# Evento compartido con los procesos del pool: SIGTERM/SIGINT en el padre detiene también sus solves.
+# Lo crea y lo limpia el padre (`_POOL_STOP`); en cada proceso del pool es `_PARENT_STOP`.
+_POOL_STOP: Any = None
+_PARENT_STOP: Any = None
+
+
+def init_pool_worker(stop: Any) -> None:
+    """Inicializador de cada proceso del pool: vigila el evento de parada del padre.
+
+    El vigía se rearma cuando el padre limpia el evento al empezar otra
+    petición, porque el proceso se reutiliza entre peticiones.
+    """
+    global _PARENT_STOP
+    _PARENT_STOP = stop
+
+    def watch() -> None:
+        while True:
+            stop.wait()
+            cancel_active_solves("parent")
+            while stop.is_set():
+                time.sleep(0.1)
+
+    threading.Thread(target=watch, name="cp-sat-pool-stop", daemon=True).start()
+
+
+def get_process_pool(max_workers: int) -> Any:
+    """Pool de procesos compartido (persistente en modo worker)."""
+    global _PROCESS_POOL, _PROCESS_POOL_SIZE, _POOL_STOP
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is None or _PROCESS_POOL_SIZE < max_workers:
+            if _PROCESS_POOL is not None:
+                _PROCESS_POOL.shutdown(wait=False)
+            mp_context = multiprocessing.get_context("spawn")
+            if _POOL_STOP is None:
+                _POOL_STOP = mp_context.Event()
+                if _CANCELLED.is_set():
+                    _POOL_STOP.set()
+            _PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=mp_context,
+                initializer=init_pool_worker,
+                initargs=(_POOL_STOP,),
+            )
+            _PROCESS_POOL_SIZE = max_workers
+        return _PROCESS_POOL
+
+
+class ServiceShutdown(Exception):
+    """Señal de terminación recibida por el worker persistente."""
+
+
+def install_signal_handlers(stop_serving: bool) -> None:
+    """SIGTERM/SIGINT detienen los solves en curso con `StopSearch`.
+
+    En one-shot el solve devuelve su mejor incumbente y se escribe la salida
+    completa. En modo worker, además, se deja de aceptar peticiones.
+    """
+
+    def handle(signum: int, _frame: Any) -> None:
+        cancel_active_solves(signal.Signals(signum).name.lower())
+        if stop_serving:
+            raise ServiceShutdown()
+
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, handle)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    options = cp_sat_server.parse_cli_options(list(sys.argv[1:] if argv is None else argv))
+    codec = cp_sat_server.wire_codec(options)
+    install_signal_handlers(stop_serving=bool(options["serve"]))
+    if options["serve"]:
+        load_cp_model()
+        server = cp_sat_server.CpSatServer(options["maxConcurrency"])
+        if options["socket"]:
+            return server.serve_socket(str(options["socket"]), codec)
+        return server.serve_stream(sys.stdin.buffer, sys.stdout.buffer, codec)
+
+    profile = RequestProfile()
+    if codec != cp_sat_server.WireCodec():
+        with profile.phase("jsonParse"):
+            payload = codec.read_one(sys.stdin.buffer)
+        write_lock = threading.Lock()
+
+        def emit_frame(message: Dict[str, Any]) -> None:
+            with write_lock:
+                sys.stdout.buffer.write(codec.encode(message))
+                sys.stdout.buffer.flush()
+
+        emit_frame(solve_request(payload, emit_frame if payload.get("stream") else None, profile))
+        return 0
+
+    with profile.phase("jsonParse"):
+        raw = sys.stdin.read()
+        payload = json.loads(raw or "{}")
+    if payload.get("stream"):
+        write_lock = threading.Lock()
+
+        def emit(event: Dict[str, Any]) -> None:
+            with write_lock:
+                sys.stdout.write(json.dumps(event) + "\n")
+                sys.stdout.flush()
+
+        result = solve_request(payload, emit, profile)
+        sys.stdout.write(json.dumps(result) + "\n")
+        return 0
+    sys.stdout.write(json.dumps(solve_request(payload, profile=profile)))
     return 0
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    # Como script este fichero es `__main__`, pero los módulos del servicio importan
+    # `cp_sat_service`: se delega en ese módulo para compartir un único estado
+    # (cancelación, pool, almacenes) con ellos.
+    import cp_sat_service
+
+    raise SystemExit(cp_sat_service.main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Reproducción offline de capturas de `cp_sat_service.py` (`capture`).
+
+Acepta una captura o un directorio de capturas. Por defecto vuelve a pasar
+`request.json` por `solve_request` (con `--payload` se prueban otras
+formulaciones); con `--model` resuelve directamente `model.pb` con
+`parameters.txt` y los overrides de `--params`. Imprime por stderr la
+comparación de tiempo y objetivo contra la respuesta capturada y escribe un
+JSON con todas las ejecuciones.
+
+    python3 engine/v3/python/replay_cp_sat.py /var/tmp/cp-sat-captures
+    python3 engine/v3/python/replay_cp_sat.py CAPTURA --payload '{"occupancyEncoding": "compact"}'
+    python3 engine/v3/python/replay_cp_sat.py CAPTURA --model --params 'num_workers: 8 linearization_level: 1'
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cp_sat_service as service  # noqa: E402
+
+
+def find_captures(paths: List[str]) -> List[str]:
+    """Directorios de captura: los indicados o, si son raíces, sus subdirectorios en orden."""
+    captures = []
+    for path in paths:
+        if os.path.isfile(os.path.join(path, "request.json")):
+            captures.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            candidate = os.path.join(path, name)
+            if not name.startswith(".") and os.path.isfile(os.path.join(candidate, "request.json")):
+                captures.append(candidate)
+    return captures
+
+
+def load_json(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def response_metrics(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Métricas comparables de una respuesta del servicio (capturada o reproducida)."""
+    profile = response.get("profile") or {}
+    solver = profile.get("solver") or {}
+    return {
+        "status": solver.get("status"),
+        "objective": solver.get("objective"),
+        "bestBound": solver.get("bestBound"),
+        "solveSeconds": solver.get("wallSeconds"),
+        "totalSeconds": profile.get("totalSeconds"),
+        "optimizedScore": (response.get("quality") or {}).get("optimizedScore"),
+        "noOptimized": bool(response.get("noOptimized")),
+    }
+
+
+def replay_request(capture: str, overlay: Dict[str, Any], time_limit: Optional[float]) -> Dict[str, Any]:
+    payload = service.merge_overlay(load_json(os.path.join(capture, "request.json")), overlay)
+    payload.update({"capture": False, "cache": False})
+    if time_limit is not None:
+        payload["timeLimitSeconds"] = time_limit
+    started = time.perf_counter()
+    response = service.solve_request(payload)
+    metrics = response_metrics(response)
+    metrics["totalSeconds"] = round(time.perf_counter() - started, 4)
+    return metrics
+
+
+def replay_model(cp_model: Any, capture: str, params: str, time_limit: Optional[float]) -> Dict[str, Any]:
+    from ortools.sat import cp_model_pb2
+
+    model_path = os.path.join(capture, "model.pb")
+    if not os.path.isfile(model_path):
+        return {"status": None, "error": "model_not_captured"}
+    started = time.perf_counter()
+    proto = cp_model_pb2.CpModelProto()
+    with open(model_path, "rb") as handle:
+        proto.ParseFromString(handle.read())
+    model = cp_model.CpModel()
+    model.Proto().parse_text_format(str(proto))
+    load_seconds = time.perf_counter() - started
+
+    solver = cp_model.CpSolver()
+    params_path = os.path.join(capture, "parameters.txt")
+    if os.path.isfile(params_path):
+        with open(params_path, "r", encoding="utf-8") as handle:
+            solver.parameters.parse_text_format(handle.read())
+    solver.parameters.log_to_response = False
+    if params:
+        solver.parameters.merge_text_format(params)
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    status = solver.Solve(model)
+    stats = service.solver_stats(solver, status)
+    return {
+        "status": stats.get("status"),
+        "objective": stats.get("objective"),
+        "bestBound": stats.get("bestBound"),
+        "solveSeconds": stats.get("wallSeconds"),
+        "totalSeconds": round(time.perf_counter() - started, 4),
+        "loadSeconds": round(load_seconds, 4),
+    }
+
+
+def compare(captured: Dict[str, Any], replayed: Dict[str, Any]) -> Dict[str, Any]:
+    """Diferencias reproducido - capturado; objetivo menor es mejor (minimización)."""
+    delta = {}
+    for metric in ["objective", "solveSeconds", "totalSeconds"]:
+        before, after = captured.get(metric), replayed.get(metric)
+        if before is not None and after is not None:
+            delta[metric] = round(after - before, 4)
+    delta["statusChanged"] = captured.get("status") != replayed.get("status")
+    return delta
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Reproduce capturas de cp_sat_service.py")
+    parser.add_argument("captures", nargs="+", help="Directorio de captura o raíz con varias capturas")
+    parser.add_argument("--model", action="store_true", help="Resuelve model.pb directamente en lugar de la petición")
+    parser.add_argument("--payload", help="JSON fusionado sobre request.json (p. ej. '{\"symmetryBreaking\": true}')")
+    parser.add_argument("--params", default="", help="SatParameters en texto aplicados sobre parameters.txt (modo --model)")
+    parser.add_argument("--time-limit", type=float, help="Sustituye el límite de tiempo capturado")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    cp_model = service.load_cp_model()
+    if cp_model is None:
+        print("OR-Tools no disponible.", file=sys.stderr)
+        return 2
+    overlay = json.loads(args.payload) if args.payload else {}
+    results: Dict[str, Any] = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "ortools": getattr(sys.modules.get("ortools"), "__version__", None),
+        "mode": "model" if args.model else "request",
+        "payload": overlay,
+        "params": args.params,
+        "runs": [],
+    }
+    for capture in find_captures(args.captures):
+        meta = load_json(os.path.join(capture, "meta.json")) if os.path.isfile(os.path.join(capture, "meta.json")) else {}
+        captured = response_metrics(load_json(os.path.join(capture, "response.json")))
+        if args.model:
+            replayed = replay_model(cp_model, capture, args.params, args.time_limit)
+        else:
+            replayed = replay_request(capture, overlay, args.time_limit)
+        run = {
+            "name": os.path.basename(os.path.normpath(capture)),
+            "reasons": meta.get("reasons"),
+            "capturedOrtools": meta.get("ortools"),
+            "captured": captured,
+            "replayed": replayed,
+            "delta": compare(captured, replayed),
+        }
+        results["runs"].append(run)
+        print(
+            f"{run['name']}: status={captured.get('status')}->{replayed.get('status')} "
+            f"objective={captured.get('objective')}->{replayed.get('objective')} "
+            f"solve={captured.get('solveSeconds')}s->{replayed.get('solveSeconds')}s",
+            file=sys.stderr,
+        )
+
+    document = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(document + "\n")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1245 @@
+import copy
+import io
+import json
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import cp_sat_service as service
+import cp_sat_reuse
+import cp_sat_server
+import replay_cp_sat
+from benchmark_cp_sat import generate_scenario
+
+
+def scenario(tasks: int, seed: int) -> Dict[str, Any]:
+    """Escenario sintético con jornada recortada al warm start, sin ventanas de concursante."""
+    payload = generate_scenario(tasks, seed, contestants=3, spaces=4, main_zone_share=0.25)
+    end = max(service.parse_hhmm(row["endPlanned"]) for row in payload["warmStart"]["plannedTasks"])
+    payload["engineInput"]["workDay"] = {"start": "08:00", "end": service.to_hhmm(end + 30)}
+    payload["engineInput"].pop("contestantAvailabilityById", None)
+    payload["engineInput"]["planId"] = 77
+    return payload
+
+
+# --- score_plans frente a score_plan y compute_main_zone_occupied_slots ---
+
+
+def test_score_plans_matches_score_plan_for_every_candidate() -> None:
+    np = pytest.importorskip("numpy")
+    payload = scenario(40, 3)
+    engine_input = payload["engineInput"]
+    planned = payload["warmStart"]["plannedTasks"]
+    table = service.plan_table(engine_input, planned, 8 * 60, 23 * 60 + 55, 5)
+    rnd = random.Random(11)
+
+    candidates: List[List[Dict[str, Any]]] = [planned]
+    starts, ends = [table.start], [table.end]
+    for _ in range(12):
+        moved: Dict[int, Tuple[int, int]] = {}
+        for row in rnd.sample(planned, 6):
+            shift = 5 * rnd.randint(-12, 12)
+            moved[int(row["taskId"])] = (
+                service.parse_hhmm(row["startPlanned"]) + shift,
+                service.parse_hhmm(row["endPlanned"]) + shift,
+            )
+        start, end = service.plan_with_starts(table, moved)
+        starts.append(start)
+        ends.append(end)
+        candidates.append([
+            {**row, "startPlanned": service.to_hhmm(int(s)), "endPlanned": service.to_hhmm(int(e))}
+            for row, s, e in zip(planned, start, end)
+        ])
+
+    scored = service.score_plans(table, np.stack(starts), np.stack(ends))
+    for i, candidate in enumerate(candidates):
+        score, gap, switches = service.score_plan(engine_input, candidate)
+        assert (int(scored["score"][i]), int(scored["gap"][i]), int(scored["switches"][i])) == (score, gap, switches)
+        occupied = service.compute_main_zone_occupied_slots(engine_input, candidate, 8 * 60, 23 * 60 + 55, 5)
+        assert int(scored["mainZoneOccupiedSlots"][i]) == occupied
+
+
+def test_score_plans_matches_score_plan_without_main_zone() -> None:
+    np = pytest.importorskip("numpy")
+    payload = scenario(20, 4)
+    engine_input = {**payload["engineInput"], "optimizerMainZoneId": None}
+    planned = payload["warmStart"]["plannedTasks"]
+    table = service.plan_table(engine_input, planned, 8 * 60, 23 * 60 + 55, 5)
+
+    scored = service.score_plans(table, np.stack([table.start]), np.stack([table.end]))
+
+    assert int(scored["gap"][0]) == 0
+    assert (int(scored["score"][0]), 0, int(scored["switches"][0])) == service.score_plan(engine_input, planned)
+
+
+def test_prepare_context_reports_the_scalar_fallback_without_numpy(monkeypatch) -> None:
+    payload = scenario(10, 3)
+    monkeypatch.setattr(service, "_NUMPY", None)
+    monkeypatch.setattr(service, "_NUMPY_LOADED", True)
+
+    ctx, early = service.prepare_context(payload)
+
+    assert ctx is not None, early
+    assert ctx.plan_table is None
+    assert "planScoring=scalar:numpy_unavailable" in ctx.details
+
+
+# --- validate_plan: una prueba por regla dura ---
+
+
+def validation_payload(**engine_input: Any) -> Dict[str, Any]:
+    """Día 09:00-13:00 con comida 11:00-11:30; el warm start de referencia es válido."""
+    base = {
+        "planId": 1,
+        "workDay": {"start": "09:00", "end": "13:00"},
+        "meal": {"start": "11:00", "end": "11:30"},
+        "tasks": [
+            {"id": 1, "zoneId": 1, "spaceId": 1, "contestantId": 1, "templateId": 1, "status": "pending"},
+            {"id": 2, "zoneId": 1, "spaceId": 1, "contestantId": 2, "templateId": 1, "status": "pending"},
+            {"id": 3, "zoneId": 2, "spaceId": 2, "contestantId": 3, "templateId": 2, "status": "pending"},
+            {"id": 4, "zoneId": 2, "spaceId": 3, "contestantId": 4, "templateId": 2, "status": "pending", "dependsOnTaskIds": [1]},
+            {"id": 5, "zoneId": 2, "spaceId": 4, "contestantId": 2, "templateId": 3, "status": "pending"},
+        ],
+        "locks": [],
+        "contestantAvailabilityById": {"3": {"start": "10:00", "end": "12:00"}},
+    }
+    base.update(engine_input)
+    return {
+        "engineInput": base,
+        "warmStart": {"plannedTasks": [
+            {"taskId": 1, "startPlanned": "09:00", "endPlanned": "09:30"},
+            {"taskId": 2, "startPlanned": "09:30", "endPlanned": "10:00"},
+            {"taskId": 3, "startPlanned": "10:00", "endPlanned": "10:30"},
+            {"taskId": 4, "startPlanned": "09:30", "endPlanned": "10:00"},
+            {"taskId": 5, "startPlanned": "10:00", "endPlanned": "10:30"},
+        ]},
+    }
+
+
+def moved_rows(payload: Dict[str, Any], moves: Dict[int, Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """Warm start de `payload` con las filas de `moves` en otro horario."""
+    rows = copy.deepcopy(payload["warmStart"]["plannedTasks"])
+    for row in rows:
+        if row["taskId"] in moves:
+            row["startPlanned"], row["endPlanned"] = moves[row["taskId"]]
+    return rows
+
+
+def test_validate_plan_accepts_the_reference_plan() -> None:
+    validation = service.validate_plan(validation_payload())
+
+    assert validation["valid"] is True
+    assert validation["violationCount"] == 0
+    assert validation["counts"] == {}
+    assert validation["checkedTasks"] == 5
+
+
+def test_validate_plan_reports_window_violations() -> None:
+    payload = validation_payload()
+
+    before_availability = service.validate_plan(payload, moved_rows(payload, {3: ("09:30", "10:00")}))
+    after_work_day = service.validate_plan(payload, moved_rows(payload, {2: ("12:45", "13:15")}))
+
+    assert before_availability["counts"] == {"window": 1}
+    assert before_availability["violations"][0]["window"] == ["10:00", "12:00"]
+    assert after_work_day["counts"] == {"window": 1}
+    assert after_work_day["violations"][0]["taskIds"] == [2]
+
+
+def test_validate_plan_reports_moved_locks() -> None:
+    payload = validation_payload(locks=[{"taskId": 3, "lockType": "time", "lockedStart": "10:00", "lockedEnd": "10:30"}])
+
+    assert service.validate_plan(payload)["valid"] is True
+    validation = service.validate_plan(payload, moved_rows(payload, {3: ("10:30", "11:00")}))
+
+    assert validation["counts"] == {"lock": 1}
+    assert validation["violations"][0]["taskIds"] == [3]
+
+
+def test_validate_plan_reports_meal_only_for_movable_tasks() -> None:
+    payload = validation_payload()
+    rows = moved_rows(payload, {3: ("11:00", "11:30")})
+    locked = validation_payload(locks=[{"taskId": 3, "lockType": "time", "lockedStart": "11:00", "lockedEnd": "11:30"}])
+    done = validation_payload()
+    done["engineInput"]["tasks"][2]["status"] = "done"
+
+    assert service.validate_plan(payload, rows)["counts"] == {"meal": 1}
+    assert service.validate_plan(locked, rows)["valid"] is True
+    assert service.validate_plan(done, rows)["valid"] is True
+
+
+def test_validate_plan_reports_dependencies_started_too_early() -> None:
+    payload = validation_payload()
+
+    validation = service.validate_plan(payload, moved_rows(payload, {4: ("09:15", "09:45")}))
+
+    assert validation["counts"] == {"dependency": 1}
+    assert validation["violations"][0]["taskIds"] == [1, 4]
+    assert validation["violations"][0]["dependencyEnd"] == "09:30"
+
+
+def test_validate_plan_reports_overlaps_per_space_and_contestant() -> None:
+    payload = validation_payload()
+
+    same_space = service.validate_plan(payload, moved_rows(payload, {2: ("09:15", "09:45")}))
+    same_contestant = service.validate_plan(payload, moved_rows(payload, {5: ("09:45", "10:15")}))
+
+    assert same_space["counts"] == {"overlap": 1}
+    assert same_space["violations"][0]["group"] == "space:1"
+    assert same_space["violations"][0]["overlapMinutes"] == 15
+    assert same_contestant["counts"] == {"overlap": 1}
+    assert same_contestant["violations"][0]["group"] == "contestant:2"
+    assert same_contestant["violations"][0]["taskIds"] == [2, 5]
+
+
+def test_validate_plan_overlap_respects_space_capacity() -> None:
+    payload = validation_payload(spaceCapacityById={"1": 2})
+    payload["engineInput"]["tasks"].append({"id": 6, "zoneId": 1, "spaceId": 1, "contestantId": 6, "templateId": 1, "status": "pending"})
+    two = moved_rows(payload, {2: ("09:00", "09:30")})
+    three = two + [{"taskId": 6, "startPlanned": "09:10", "endPlanned": "09:40"}]
+
+    assert service.validate_plan(payload, two)["valid"] is True
+    validation = service.validate_plan(payload, three)
+
+    assert validation["counts"] == {"overlap": 1}
+    assert validation["violations"][0]["capacity"] == 2
+    assert validation["violations"][0]["taskIds"] == [1, 6]
+
+
+def test_validate_plan_counts_conflicts_between_fixed_tasks() -> None:
+    payload = validation_payload()
+    for task in payload["engineInput"]["tasks"][:2]:
+        task["status"] = "in_progress"
+
+    validation = service.validate_plan(payload, moved_rows(payload, {2: ("09:00", "09:30")}))
+
+    assert validation["counts"] == {"overlap": 1}
+    assert validation["fixedConflicts"] == 1
+
+
+# --- Reutilización de modelo (`reuseModel`) frente a reconstrucción ---
+
+
+@pytest.fixture
+def model_store():
+    cp_sat_reuse._MODEL_STORE.clear()
+    yield cp_sat_reuse._MODEL_STORE
+    cp_sat_reuse._MODEL_STORE.clear()
+
+
+def solve_build(cp_model: Any, build: Any) -> Tuple[str, Optional[float]]:
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = 30
+    solver.parameters.num_workers = 1
+    status = solver.Solve(build.model)
+    objective = solver.ObjectiveValue() if status in (cp_model.OPTIMAL, cp_model.FEASIBLE) else None
+    return solver.StatusName(status), objective
+
+
+def reuse_and_rebuild(cp_model: Any, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Any, Any]:
+    """Resuelve con el modelo del almacén y con uno nuevo; devuelve `modelReuse` y ambos resultados."""
+    payload = dict(payload, reuseModel=True, timeLimitSeconds=1, occupancyEncoding="compact", symmetryBreaking=True)
+    ctx, early = service.prepare_context(payload)
+    assert ctx is not None, early
+    with cp_sat_reuse.reusable_model(cp_model, ctx, service.RequestProfile()) as build:
+        reused = solve_build(cp_model, build)
+    fresh_ctx, _ = service.prepare_context(dict(payload, reuseModel=False))
+    fresh = solve_build(cp_model, service.build_model(cp_model, fresh_ctx))
+    return ctx.report["modelReuse"], reused, fresh
+
+
+def test_patched_model_matches_a_fresh_build_across_edits(model_store) -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = scenario(14, 5)
+    payload["engineInput"]["optimizerMainZoneId"] = 0
+    tasks = payload["engineInput"]["tasks"]
+    rows = payload["warmStart"]["plannedTasks"]
+    rows_by_id = {int(row["taskId"]): row for row in rows}
+    plain = [int(t["id"]) for t in tasks]
+
+    def shifted(row: Dict[str, Any], minutes: int) -> Tuple[str, str]:
+        return (service.to_hhmm(service.parse_hhmm(row["startPlanned"]) + minutes),
+                service.to_hhmm(service.parse_hhmm(row["endPlanned"]) + minutes))
+
+    def check(expected_mode: str) -> Dict[str, Any]:
+        reuse, reused, fresh = reuse_and_rebuild(cp_model, payload)
+        assert reuse["mode"] == expected_mode, reuse
+        assert reused[0] == "OPTIMAL"
+        assert reused == fresh
+        return reuse
+
+    assert check("built")["reason"] == "not_stored"
+    assert check("reused")["patchedTasks"] == 0
+
+    # Warm start desplazado: solo cambian los hints.
+    row = rows_by_id[plain[0]]
+    row["startPlanned"], row["endPlanned"] = shifted(row, 5)
+    check("reused")
+
+    # Lock nuevo y lock movido: la tarea se fija o se parchea en su sitio.
+    locked = rows_by_id[plain[1]]
+    payload["engineInput"]["locks"] = [
+        {"taskId": plain[1], "lockType": "time", "lockedStart": locked["startPlanned"], "lockedEnd": locked["endPlanned"]},
+    ]
+    check("reused")
+    lock = payload["engineInput"]["locks"][0]
+    lock["lockedStart"], lock["lockedEnd"] = shifted(locked, 5)
+    assert check("reused")["patchedTasks"] == 1
+
+    # Tarea terminada, tarea retirada y vuelta a añadir.
+    for task in tasks:
+        if int(task["id"]) == plain[2]:
+            task["status"] = "done"
+    check("reused")
+    gone = plain[3]
+    payload["engineInput"]["tasks"] = [t for t in tasks if int(t["id"]) != gone]
+    payload["warmStart"]["plannedTasks"] = [r for r in rows if int(r["taskId"]) != gone]
+    assert check("reused")["retiredTasks"] == 1
+    payload["engineInput"]["tasks"], payload["warmStart"]["plannedTasks"] = tasks, rows
+    assert check("reused")["addedTasks"] == 1
+
+    payload["engineInput"]["locks"] = []
+    check("reused")
+
+
+def test_reuse_model_rebuilds_when_the_structure_changes(model_store) -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = scenario(14, 5)
+
+    assert reuse_and_rebuild(cp_model, payload)[0]["mode"] == "built"
+    changed = copy.deepcopy(payload)
+    end = service.parse_hhmm(changed["engineInput"]["workDay"]["end"])
+    changed["engineInput"]["workDay"]["end"] = service.to_hhmm(end + 30)
+    reuse, reused, fresh = reuse_and_rebuild(cp_model, changed)
+
+    assert (reuse["mode"], reuse["reason"]) == ("built", "structure_changed")
+    assert reused == fresh
+
+
+# --- Ruptura de simetrías (`symmetryBreaking`) ---
+
+
+def twin_tasks_payload(symmetry_breaking: bool) -> Dict[str, Any]:
+    """Tareas 1 y 2 idénticas y movibles; la 3, fuera del piloto, depende solo de la 2."""
+    task = {"zoneId": 1, "spaceId": 1, "contestantId": 1, "templateId": 1, "status": "pending", "durationOverrideMin": 30}
+    return {
+        "timeLimitSeconds": 5,
+        "symmetryBreaking": symmetry_breaking,
+        "pilotMode": True,
+        "movableTaskIds": [1, 2],
+        "engineInput": {
+            "planId": 5,
+            "workDay": {"start": "09:00", "end": "11:00"},
+            "meal": {"start": "12:00", "end": "12:30"},
+            "tasks": [
+                {**task, "id": 1},
+                {**task, "id": 2},
+                {**task, "id": 3, "zoneId": 2, "spaceId": 2, "contestantId": 2, "templateId": 2, "dependsOnTaskIds": [2]},
+            ],
+            "locks": [],
+            "optimizerMainZoneId": 1,
+        },
+        "warmStart": {"plannedTasks": [
+            {"taskId": 1, "startPlanned": "09:30", "endPlanned": "10:00"},
+            {"taskId": 2, "startPlanned": "10:00", "endPlanned": "10:30"},
+            {"taskId": 3, "startPlanned": "09:30", "endPlanned": "10:00"},
+        ]},
+    }
+
+
+def test_symmetry_breaking_skips_tasks_with_a_fixed_dependent() -> None:
+    pytest.importorskip("ortools")
+
+    plain = service.solve_request(twin_tasks_payload(False))
+    broken = service.solve_request(twin_tasks_payload(True))
+
+    assert "status=CpSolverStatus.OPTIMAL" in plain["technicalDetails"]
+    assert "status=CpSolverStatus.OPTIMAL" in broken["technicalDetails"]
+    assert "symmetryClasses=0" in broken["technicalDetails"]
+    assert broken["output"]["plannedTasks"] == plain["output"]["plannedTasks"]
+
+
+def test_symmetry_classes_group_identical_movable_tasks() -> None:
+    payload = twin_tasks_payload(True)
+    payload["engineInput"]["tasks"][2]["dependsOnTaskIds"] = []
+    ctx, early = service.prepare_context(payload)
+    assert ctx is not None, early
+
+    assert service.symmetry_classes(ctx, ctx.movable_task_ids()) == [[1, 2]]
+
+
+# --- Codificaciones de ocupación de zona principal (`occupancyEncoding`) ---
+
+
+def occupancy_scenario(tasks: int, spaces: int, main_zone_share: float) -> Dict[str, Any]:
+    """Con 4 espacios y un cuarto en zona principal sale `compact:element`; con 6 y la mitad, `compact:reachable`."""
+    payload = generate_scenario(tasks, 2, contestants=4, spaces=spaces, main_zone_share=main_zone_share)
+    end = max(service.parse_hhmm(row["endPlanned"]) for row in payload["warmStart"]["plannedTasks"])
+    payload["engineInput"]["workDay"] = {"start": "08:00", "end": service.to_hhmm(end + 30)}
+    payload["engineInput"].pop("contestantAvailabilityById", None)
+    return payload
+
+
+@pytest.mark.parametrize("spaces, main_zone_share, compact_mode", [(4, 0.25, "element"), (6, 0.5, "reachable")])
+def test_occupancy_encodings_count_the_same_empty_slots_in_any_solution(
+    spaces: int, main_zone_share: float, compact_mode: str,
+) -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = occupancy_scenario(16, spaces, main_zone_share)
+    engine_input = payload["engineInput"]
+    planned = payload["warmStart"]["plannedTasks"]
+    work_day = engine_input["workDay"]
+    empty_by_encoding = {}
+
+    for encoding in ["cover", "compact"]:
+        ctx, early = service.prepare_context({**payload, "occupancyEncoding": encoding})
+        assert ctx is not None, early
+        build = service.build_model(cp_model, ctx)
+        if encoding == "compact":
+            assert build.occupancy.compact_mode == compact_mode
+        # Plan fijado al warm start y el término maximizado en vez de minimizado.
+        for row in planned:
+            tid = int(row["taskId"])
+            build.model.Add(build.start_vars[tid] == ctx.specs[tid].warm_slot)
+        build.model.Maximize(build.main_zone_empty_slots)
+        solver = cp_model.CpSolver()
+        solver.parameters.num_workers = 1
+        assert solver.Solve(build.model) == cp_model.OPTIMAL
+        occupied = service.compute_main_zone_occupied_slots(
+            engine_input, planned, service.parse_hhmm(work_day["start"]), service.parse_hhmm(work_day["end"]), ctx.grid,
+        )
+        empty_by_encoding[encoding] = int(solver.Value(build.main_zone_empty_slots))
+        assert empty_by_encoding[encoding] == build.occupancy.total_slots - occupied
+
+    assert empty_by_encoding["compact"] == empty_by_encoding["cover"]
+
+
+@pytest.mark.parametrize("spaces, main_zone_share, compact_mode", [(4, 0.25, "element"), (6, 0.5, "reachable")])
+def test_occupancy_encodings_agree_under_lexicographic_stages(
+    spaces: int, main_zone_share: float, compact_mode: str,
+) -> None:
+    pytest.importorskip("ortools")
+    payload = occupancy_scenario(8, spaces, main_zone_share)
+    values = {}
+    for encoding in ["cover", "compact"]:
+        result = service.solve_request({**payload, "occupancyEncoding": encoding, "lexicographic": True, "timeLimitSeconds": 20})
+        if encoding == "compact":
+            assert f"mainZoneOccupancyEncoding=compact:{compact_mode}" in result["technicalDetails"]
+        stages = result["lexicographic"]["stages"]
+        assert all(stage["status"] == "OPTIMAL" for stage in stages)
+        values[encoding] = [stage["value"] for stage in stages]
+
+    assert values["compact"] == values["cover"]
+
+
+# --- Formato de transporte (`--wire`, `--framing`) ---
+
+
+def test_msgpack_wire_fails_clearly_when_the_package_is_missing(monkeypatch) -> None:
+    monkeypatch.setattr(cp_sat_server, "_MSGPACK", None)
+    monkeypatch.setattr(cp_sat_server, "_MSGPACK_LOADED", True)
+
+    with pytest.raises(SystemExit, match="pip install msgpack"):
+        cp_sat_server.wire_codec({"wire": "msgpack"})
+    with pytest.raises(RuntimeError, match="pip install msgpack"):
+        cp_sat_server.WireCodec(format="msgpack", framing="length").encode({"id": 1})
+
+
+
+def columns_of(rows: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Columnas paralelas de `rows`, con `None` donde una fila no tiene la clave."""
+    names = sorted({name for row in rows for name in row})
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def columnar(payload: Dict[str, Any]) -> Dict[str, Any]:
+    planned = [
+        {**{k: v for k, v in row.items() if k not in ("startPlanned", "endPlanned")},
+         "startMin": service.parse_hhmm(row["startPlanned"]), "endMin": service.parse_hhmm(row["endPlanned"])}
+        for row in payload["warmStart"]["plannedTasks"]
+    ]
+    engine_input = {k: v for k, v in payload["engineInput"].items() if k != "tasks"}
+    return {
+        **payload,
+        "engineInput": {**engine_input, "taskColumns": columns_of(payload["engineInput"]["tasks"])},
+        "warmStart": {"plannedColumns": columns_of(planned)},
+    }
+
+
+def apply_output_diff(warm_rows: List[Dict[str, Any]], diff: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reconstruye `plannedTasks` como `applyOutputDiff` en `cpSatOptimizer.ts`."""
+    rows = {row["taskId"]: dict(row) for row in warm_rows}
+    for i, tid in enumerate(diff["taskId"]):
+        rows[tid].update(
+            startPlanned=service.to_hhmm(diff["startMin"][i]),
+            endPlanned=service.to_hhmm(diff["endMin"][i]),
+            assignedSpace=diff["assignedSpace"][i],
+            assignedResources=diff["assignedResources"][i],
+        )
+    return [rows[row["taskId"]] for row in warm_rows]
+
+
+def test_columnar_payload_decodes_to_the_row_payload() -> None:
+    payload = scenario(12, 3)
+
+    decoded = cp_sat_server.decode_columnar_payload(columnar(payload))
+
+    assert decoded["engineInput"]["tasks"] == payload["engineInput"]["tasks"]
+    assert decoded["warmStart"]["plannedTasks"] == payload["warmStart"]["plannedTasks"]
+    assert cp_sat_server.decode_columnar_payload(payload) is payload
+
+
+def test_columnar_request_and_diff_response_round_trip() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(10, 3), "timeLimitSeconds": 5}
+
+    full = service.solve_request(copy.deepcopy(payload))
+    diffed = service.solve_request({**columnar(payload), "responseMode": "diff"})
+
+    assert "output" not in diffed
+    diff = diffed["outputDiff"]
+    assert diff["rows"] == len(full["output"]["plannedTasks"])
+    assert 0 < diff["moved"] == len(diff["taskId"])
+    assert apply_output_diff(payload["warmStart"]["plannedTasks"], diff) == full["output"]["plannedTasks"]
+
+
+@pytest.mark.parametrize("wire", ["json", "msgpack"])
+def test_length_framed_codec_round_trips_messages(wire: str) -> None:
+    if wire == "msgpack":
+        pytest.importorskip("msgpack")
+    codec = cp_sat_server.WireCodec(format=wire, framing="length")
+    messages = [{"id": 1, "type": "health"}, {"id": "b", "text": "línea\ncon salto", "values": [1, 2.5, None]}]
+
+    stream = io.BytesIO(b"".join(codec.encode(message) for message in messages))
+
+    assert [codec.decode(frame) for frame in codec.frames(stream)] == messages
+    assert codec.read_one(io.BytesIO(codec.encode(messages[1]))) == messages[1]
+    assert codec.read_one(io.BytesIO(b"")) == {}
+
+
+def test_worker_answers_length_framed_requests() -> None:
+    codec = cp_sat_server.WireCodec(format="json", framing="length")
+    request = {"id": 7, "type": "validate", "payload": validation_payload()}
+    outstream = io.BytesIO()
+
+    cp_sat_server.CpSatServer(1).serve_stream(io.BytesIO(codec.encode(request)), outstream, codec)
+
+    replies = [codec.decode(frame) for frame in codec.frames(io.BytesIO(outstream.getvalue()))]
+    assert [reply["type"] for reply in replies] == ["ready", "result"]
+    assert replies[1]["id"] == 7 and replies[1]["result"]["validation"]["valid"] is True
+
+# --- Parada por convergencia (`convergence`) ---
+
+
+def test_convergence_gap_criteria_use_the_solver_bound() -> None:
+    relative = service.ConvergenceCriteria(relative_gap=0.1)
+    absolute = service.ConvergenceCriteria(absolute_gap=50)
+
+    assert relative.observe(1000.0, 850.0, {}) is False
+    assert relative.observe(1000.0, 920.0, {}) is True
+    assert relative.stopped_by == "relativeGap"
+    assert absolute.observe(1000.0, 960.0, {}) is True
+    assert absolute.stopped_by == "absoluteGap"
+    # Gap 0: CP-SAT ya para con el óptimo probado.
+    assert service.ConvergenceCriteria(absolute_gap=50).observe(1000.0, 1000.0, {}) is False
+
+
+def test_lower_bound_target_stops_when_the_gap_is_below_the_term_weight() -> None:
+    criteria = service.ConvergenceCriteria(
+        term_targets={"mainZoneEmptySlots": 0.0}, bound_targets={"mainZoneEmptySlots": service.W1},
+    )
+
+    assert criteria.observe(50_000.0, 30_000.0, {"mainZoneEmptySlots": 3}) is False
+    assert criteria.observe(40_100.0, 31_000.0, {"mainZoneEmptySlots": 3}) is True
+    assert criteria.stopped_by == "objectiveTarget:mainZoneEmptySlots"
+
+
+def test_convergence_stops_early_on_a_relative_gap() -> None:
+    pytest.importorskip("ortools")
+    payload = scenario(25, 3)
+
+    result = service.solve_request({**payload, "timeLimitSeconds": 10, "convergence": {"relativeGap": 0.9}})
+
+    assert "stopCriterion=relativeGap" in result["technicalDetails"]
+    assert result["convergence"]["stoppedBy"] == "relativeGap"
+    assert result["convergence"]["savedSeconds"] > 5
+
+
+
+def test_stall_solutions_counts_incumbents_without_significant_improvement() -> None:
+    criteria = service.ConvergenceCriteria(stall_solutions=3, min_improvement=0.01)
+
+    assert criteria.observe(1000.0, 0.0, {}) is False
+    assert criteria.observe(995.0, 0.0, {}) is False
+    assert criteria.observe(980.0, 0.0, {}) is False  # Mejora > 1 %: reinicia la cuenta.
+    assert criteria.observe(975.0, 0.0, {}) is False
+    assert criteria.observe(972.0, 0.0, {}) is False
+    assert criteria.observe(971.0, 0.0, {}) is True
+    assert criteria.stopped_by == "stallSolutions"
+
+
+def test_stall_seconds_only_counts_after_the_first_solution() -> None:
+    criteria = service.ConvergenceCriteria(stall_seconds=2)
+
+    assert criteria.stalled() is False
+    criteria.observe(1000.0, 0.0, {})
+    assert criteria.stalled() is False
+    criteria.last_improvement_at = time.monotonic() - 3
+    assert criteria.stalled() is True
+
+
+@pytest.mark.parametrize("convergence, criterion", [
+    ({"stallSeconds": 1}, "stallSeconds"),
+    ({"stallSolutions": 3, "minImprovement": 0.01}, "stallSolutions"),
+])
+def test_convergence_stops_early_when_the_search_stalls(convergence: Dict[str, Any], criterion: str) -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(25, 3), "timeLimitSeconds": 15, "convergence": convergence}
+
+    result = service.solve_request(payload)
+
+    assert f"stopCriterion={criterion}" in result["technicalDetails"]
+    assert result["convergence"]["stoppedBy"] == criterion
+    assert result["convergence"]["savedSeconds"] > 5
+    assert result["validation"]["result"]["valid"] is True
+
+# --- Cancelación por petición (`request_scope`) ---
+
+
+def decomposable_scenario(tasks: int, time_limit_seconds: float) -> Dict[str, Any]:
+    """Concursante = espacio y sin recursos ni dependencias: varios componentes independientes."""
+    payload = generate_scenario(tasks, 3, contestants=12, spaces=12, main_zone_share=0.0)
+    for task in payload["engineInput"]["tasks"]:
+        task["contestantId"] = task["spaceId"]
+        for key in list(task):
+            if "esource" in key or "epend" in key:
+                task.pop(key)
+    payload.update(timeLimitSeconds=time_limit_seconds, decompose=True, decomposeMaxWorkers=2)
+    return payload
+
+
+def cancelled_details(result: Dict[str, Any]) -> List[str]:
+    return [detail for detail in result["technicalDetails"] if detail.startswith(("cancelled=", "stopCriterion=cancelled"))]
+
+
+def test_a_cancelled_request_does_not_cancel_the_next_one() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(25, 3), "timeLimitSeconds": 3}
+
+    timer = threading.Timer(0.5, service.cancel_active_solves, args=("sigterm",))
+    timer.start()
+    cancelled = service.solve_request(copy.deepcopy(payload))
+    timer.join()
+    following = service.solve_request({**copy.deepcopy(payload), "timeLimitSeconds": 1})
+
+    assert "cancelled=sigterm" in cancelled["technicalDetails"]
+    assert cancelled_details(following) == []
+    assert service.cancel_reason() is None
+
+
+def test_reused_pool_workers_solve_again_after_a_cancellation() -> None:
+    pytest.importorskip("ortools")
+    payload = decomposable_scenario(40, 2)
+
+    timer = threading.Timer(1.0, service.cancel_active_solves, args=("sigterm",))
+    timer.start()
+    cancelled = service.solve_request(copy.deepcopy(payload))
+    timer.join()
+    following = service.solve_request(copy.deepcopy(payload))
+
+    assert "cancelled=sigterm" in cancelled["technicalDetails"]
+    assert cancelled_details(following) == []
+    statuses = next(d for d in following["technicalDetails"] if d.startswith("decompositionComponentStatuses="))
+    assert "UNKNOWN" not in statuses
+
+
+# --- Descomposición (`decompose`) frente al solve monolítico ---
+
+
+def test_decompose_matches_the_monolithic_solve() -> None:
+    pytest.importorskip("ortools")
+    payload = decomposable_scenario(30, 4)
+
+    decomposed = service.solve_request(copy.deepcopy(payload))
+    monolithic = service.solve_request({**copy.deepcopy(payload), "decompose": False})
+
+    details = decomposed["technicalDetails"]
+    components = next(d for d in details if d.startswith("decompositionComponents="))
+    assert int(components.split("=")[1]) >= 2
+    assert "status=CpSolverStatus.OPTIMAL" in monolithic["technicalDetails"]
+    assert decomposed["validation"]["result"]["valid"] is True
+    assert sorted(row["taskId"] for row in decomposed["output"]["plannedTasks"]) == sorted(
+        row["taskId"] for row in monolithic["output"]["plannedTasks"]
+    )
+    assert decomposed["quality"]["optimizedScore"] <= monolithic["quality"]["optimizedScore"]
+
+
+# --- Progreso anytime (`stream`) ---
+
+
+def replay_moves(payload: Dict[str, Any], events: List[Dict[str, Any]]) -> Dict[int, str]:
+    """Aplica los `moved` de los eventos, en orden, sobre los inicios del warm start."""
+    starts = {int(row["taskId"]): row["startPlanned"] for row in payload["warmStart"]["plannedTasks"]}
+    for event in events:
+        for tid, start in event["moved"]:
+            starts[tid] = start
+    return starts
+
+
+def test_worker_streams_progress_events_before_the_result() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(20, 3), "timeLimitSeconds": 3, "stream": True}
+    instream = io.BytesIO((json.dumps({"id": "a", "payload": payload}) + "\n").encode())
+    outstream = io.BytesIO()
+
+    cp_sat_server.CpSatServer(1).serve_stream(instream, outstream)
+
+    lines = [json.loads(line) for line in outstream.getvalue().splitlines()]
+    assert lines[0]["type"] == "ready"
+    assert [line["type"] for line in lines[-1:]] == ["result"]
+    events = lines[1:-1]
+    assert events and all(event["type"] == "progress" and event["id"] == "a" for event in events)
+    assert [event["solution"] for event in events] == list(range(1, len(events) + 1))
+    objectives = [event["objective"] for event in events]
+    assert objectives == sorted(objectives, reverse=True)
+    final = {int(row["taskId"]): row["startPlanned"] for row in lines[-1]["result"]["output"]["plannedTasks"]}
+    assert replay_moves(payload, events) == final
+
+
+def test_one_shot_stream_writes_ndjson_ending_with_the_document() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(12, 3), "timeLimitSeconds": 2, "stream": True}
+
+    completed = subprocess.run(
+        [sys.executable, service.__file__], input=json.dumps(payload), capture_output=True, text=True, timeout=60,
+    )
+
+    lines = [json.loads(line) for line in completed.stdout.splitlines()]
+    assert len(lines) >= 2
+    assert all(line["type"] == "progress" for line in lines[:-1])
+    assert "output" in lines[-1] and "type" not in lines[-1]
+
+
+# --- Deadline, SIGTERM y checkpoint ---
+
+
+def test_deadline_clamps_the_solver_time_limit() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(25, 3), "timeLimitSeconds": 30}
+
+    started = time.monotonic()
+    result = service.solve_request({**payload, "deadlineEpochMs": int(time.time() * 1000) + 2000})
+
+    assert time.monotonic() - started < 3
+    assert any(d.startswith("deadlineClampedTimeLimitS=") for d in result["technicalDetails"])
+    assert result["validation"]["result"]["valid"] is True
+
+
+def test_an_expired_deadline_returns_the_warm_start() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(10, 3), "deadlineEpochMs": int(time.time() * 1000) - 1000}
+
+    result = service.solve_request(payload)
+
+    assert "deadline_exceeded_before_solve" in result["technicalDetails"]
+    assert result["output"]["plannedTasks"] == payload["warmStart"]["plannedTasks"]
+
+
+def test_checkpoint_holds_the_latest_incumbent_document(tmp_path) -> None:
+    pytest.importorskip("ortools")
+    path = tmp_path / "checkpoint.json"
+    payload = {**scenario(20, 3), "timeLimitSeconds": 2, "checkpointPath": str(path), "checkpointIntervalSeconds": 0}
+
+    result = service.solve_request(payload)
+
+    written = next(d for d in result["technicalDetails"] if d.startswith("checkpointsWritten="))
+    assert int(written.split("=")[1]) >= 1
+    document = json.loads(path.read_text())
+    assert document["checkpoint"]["solution"] >= 1
+    assert {"output", "quality", "technicalDetails"} <= set(document)
+    assert sorted(row["taskId"] for row in document["output"]["plannedTasks"]) == sorted(
+        row["taskId"] for row in result["output"]["plannedTasks"]
+    )
+
+
+def test_sigterm_writes_the_best_incumbent_and_exits() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(25, 3), "timeLimitSeconds": 30}
+
+    process = subprocess.Popen(
+        [sys.executable, service.__file__], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    process.stdin.write(json.dumps(payload))
+    process.stdin.close()
+    time.sleep(4)
+    process.send_signal(signal.SIGTERM)
+    document = json.loads(process.stdout.read())
+    process.wait(timeout=10)
+
+    assert "cancelled=sigterm" in document["technicalDetails"]
+    assert "quality" in document and "degradations" in document
+    assert document["validation"]["result"]["valid"] is True
+
+
+# --- Horizonte rodante (`nowMinute`, `lookAheadMinutes`) ---
+
+
+def minutes_by_task(rows: List[Dict[str, Any]]) -> Dict[int, Tuple[int, int]]:
+    return {int(row["taskId"]): (service.parse_hhmm(row["startPlanned"]), service.parse_hhmm(row["endPlanned"])) for row in rows}
+
+
+def test_rolling_horizon_freezes_history_and_keeps_work_after_now() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(24, 3), "timeLimitSeconds": 3}
+    now, look_ahead = 595, 120
+    warm = minutes_by_task(payload["warmStart"]["plannedTasks"])
+    # Dos de cada tres tareas anteriores a `now` están hechas; el resto sigue pendiente (atrasada).
+    for task in payload["engineInput"]["tasks"]:
+        start, end = warm[int(task["id"])]
+        if end <= now and int(task["id"]) % 3:
+            task["status"] = "done"
+        elif start < now < end:
+            task["status"] = "in_progress"
+    status = {int(task["id"]): task["status"] for task in payload["engineInput"]["tasks"]}
+    overdue = [tid for tid, (start, _) in warm.items() if status[tid] == "pending" and start < now]
+    assert overdue
+
+    result = service.solve_request({**payload, "nowMinute": now, "lookAheadMinutes": look_ahead})
+
+    assert f"rollingHorizon_overdueTasks={len(overdue)}" in result["technicalDetails"]
+    planned = minutes_by_task(result["output"]["plannedTasks"])
+    for tid, (start, end) in warm.items():
+        if status[tid] != "pending" or start >= now + look_ahead:
+            assert planned[tid] == (start, end), tid
+            continue
+        assert planned[tid][0] >= now, tid
+        if tid not in overdue:
+            assert planned[tid][1] <= max(end, now + look_ahead), tid
+    assert service.validate_plan(payload, result["output"]["plannedTasks"])["valid"] is True
+
+
+# --- Ajuste de dominios (`tightenDomains`) ---
+
+
+def test_tighten_domains_propagates_dependencies_and_the_meal_hole() -> None:
+    ctx, early = service.prepare_context({**validation_payload(), "tightenDomains": True})
+
+    assert ctx is not None, early
+    first, dependent = ctx.specs[1], ctx.specs[4]
+    # 4 depende de 1: empieza como pronto al fin más temprano de 1, y 1 termina a tiempo para 4.
+    assert dependent.lb == first.dur_slots
+    assert first.ub == dependent.ub - first.dur_slots
+    meal_start, meal_end = ctx.meal_slots
+    for spec in ctx.specs.values():
+        assert spec.domain_intervals[0][1] + spec.dur_slots <= meal_start
+        assert spec.domain_intervals[-1][0] >= meal_end
+    assert ctx.report["domainTightening"]["dependencyEdges"] == 1
+    assert ctx.report["domainTightening"]["mealHoles"] == 5
+
+
+def test_tighten_domains_keeps_the_optimum() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(10, 3), "timeLimitSeconds": 10}
+    engine_input = payload["engineInput"]
+    engine_input["meal"] = {"start": "11:00", "end": "11:30"}
+    for i in range(1, len(engine_input["tasks"]), 3):
+        engine_input["tasks"][i]["dependsOnTaskIds"] = [engine_input["tasks"][i - 1]["id"]]
+
+    tightened = service.solve_request({**payload, "tightenDomains": True})
+    plain = service.solve_request(payload)
+
+    assert "status=CpSolverStatus.OPTIMAL" in tightened["technicalDetails"]
+    assert "status=CpSolverStatus.OPTIMAL" in plain["technicalDetails"]
+    assert tightened["domainTightening"]["slotsRemoved"] > 0
+    assert tightened["quality"]["optimizedScore"] == plain["quality"]["optimizedScore"]
+    assert service.validate_plan(payload, tightened["output"]["plannedTasks"])["valid"] is True
+
+
+def test_tighten_domains_reports_dependency_cycles() -> None:
+    payload = validation_payload()
+    payload["engineInput"]["tasks"][0]["dependsOnTaskIds"] = [4]
+
+    result = service.solve_request({**payload, "tightenDomains": True, "timeLimitSeconds": 5})
+
+    assert "dependency_cycle_tasks=1,4" in result["technicalDetails"]
+    assert result["output"]["plannedTasks"] == payload["warmStart"]["plannedTasks"]
+
+
+# --- Hints completos (`repairHint`) ---
+
+
+def solve_with_fixed_hint(cp_model: Any, build: Any) -> str:
+    """Resuelve con todas las variables fijadas a su hint: factible solo si el hint lo es."""
+    solver = cp_model.CpSolver()
+    solver.parameters.fix_variables_to_their_hinted_value = True
+    solver.parameters.num_workers = 1
+    return solver.StatusName(solver.Solve(build.model))
+
+
+def test_repair_hint_turns_a_conflicting_warm_start_into_a_feasible_hint() -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = validation_payload()
+    payload["warmStart"]["plannedTasks"] = moved_rows(payload, {2: ("09:15", "09:45"), 4: ("09:15", "09:45")})
+
+    raw_ctx, _ = service.prepare_context(payload)
+    raw = service.build_model(cp_model, raw_ctx)
+    repaired_ctx, _ = service.prepare_context({**payload, "repairHint": True})
+    repaired = service.build_model(cp_model, repaired_ctx)
+
+    assert raw.hint["complete"] is True and raw.hint["feasible"] is False
+    assert sorted(raw.hint["violations"]) == ["dependency:1>4", "overlap:space1:1,2"]
+    assert solve_with_fixed_hint(cp_model, raw) == "INFEASIBLE"
+    assert repaired.hint["complete"] is True and repaired.hint["feasible"] is True
+    assert repaired.hint["repairedTasks"] == [2, 4]
+    assert solve_with_fixed_hint(cp_model, repaired) in ("OPTIMAL", "FEASIBLE")
+
+
+# --- Caché de resultados (`cacheDir`) ---
+
+
+def test_cache_hits_reuse_the_stored_document_and_misses_solve(tmp_path) -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(12, 3), "timeLimitSeconds": 1, "cacheDir": str(tmp_path)}
+
+    first = service.solve_request(copy.deepcopy(payload))
+    again = service.solve_request(copy.deepcopy(payload))
+    longer = service.solve_request({**copy.deepcopy(payload), "timeLimitSeconds": 2})
+    changed = copy.deepcopy(payload)
+    changed["engineInput"]["optimizerNearHardBreaksMax"] = 3
+    other = service.solve_request(changed)
+
+    assert first["cache"]["status"] == "miss" and "cache=miss" in first["technicalDetails"]
+    assert again["cache"]["status"] == "hit" and "cache=hit" in again["technicalDetails"]
+    assert again["cache"]["key"] == first["cache"]["key"]
+    assert again["output"] == first["output"]
+    assert (longer["cache"]["status"], longer["cache"]["key"]) == ("hint", first["cache"]["key"])
+    assert other["cache"]["status"] == "miss" and other["cache"]["key"] != first["cache"]["key"]
+    assert service.solve_request({**copy.deepcopy(payload), "timeLimitSeconds": 2})["cache"]["status"] == "hit"
+
+
+# --- Escenarios what-if en lote (`scenarios`) ---
+
+
+def test_batch_variants_match_solving_each_scenario_alone() -> None:
+    pytest.importorskip("ortools")
+    base = {**scenario(10, 3), "timeLimitSeconds": 6}
+    row = base["warmStart"]["plannedTasks"][2]
+    later = lambda hhmm: service.to_hhmm(service.parse_hhmm(hhmm) + 30)
+    scenarios = [
+        {"id": "comida", "overlay": {"engineInput": {"meal": {"start": "11:00", "end": "11:30"}}}},
+        {"id": "lock", "overlay": {"engineInput": {"locks": [{
+            "taskId": row["taskId"], "lockType": "time",
+            "lockedStart": later(row["startPlanned"]), "lockedEnd": later(row["endPlanned"]),
+        }]}}},
+    ]
+
+    batch = service.solve_request({**copy.deepcopy(base), "scenarios": scenarios})
+
+    assert "batchSharedContext=true" in batch["technicalDetails"]
+    variants = {variant["id"]: variant for variant in batch["scenarios"]}
+    assert batch["output"] == service.solve_request(copy.deepcopy(base))["output"]
+    for spec in scenarios:
+        merged = service.merge_overlay(base, spec["overlay"])
+        alone = service.solve_request(copy.deepcopy(merged))
+        variant = variants[spec["id"]]
+        assert "status=CpSolverStatus.OPTIMAL" in variant["result"]["technicalDetails"], spec["id"]
+        assert variant["result"]["output"] == alone["output"], spec["id"]
+        score, gap, switches = service.score_plan(merged["engineInput"], alone["output"]["plannedTasks"])
+        assert variant["score"] == {"score": score, "gap": gap, "switches": switches}
+
+
+# --- Configuración del solver (`solverConfig`) ---
+
+
+def sized_build(constraints: int, movable: int) -> Any:
+    """Sustituto de `ModelBuild` con solo lo que mira `tune_solver_config`."""
+    proto = SimpleNamespace(constraints=[None] * constraints)
+    return SimpleNamespace(model=SimpleNamespace(Proto=lambda: proto), movable_task_ids=list(range(movable)))
+
+
+def test_tune_solver_config_scales_with_model_size_and_cpus(monkeypatch) -> None:
+    monkeypatch.setattr(service, "available_cpus", lambda: 16)
+
+    small = service.tune_solver_config({}, sized_build(1500, 10), 30)
+    medium = service.tune_solver_config({}, sized_build(15_000, 200), 30)
+    large = service.tune_solver_config({}, sized_build(60_000, 900), 30)
+
+    assert (small["sizeClass"], small["workers"], small["useLns"], small["linearizationLevel"]) == ("small", 1, False, 2)
+    assert (medium["sizeClass"], medium["workers"], medium["useLns"], medium["linearizationLevel"]) == ("medium", 8, True, 1)
+    assert (large["sizeClass"], large["workers"], large["linearizationLevel"]) == ("large", 16, 0)
+    assert service.tune_solver_config({}, sized_build(1500, 13), 30)["useLns"] is True
+
+
+def test_tune_solver_config_scales_presolve_with_the_budget() -> None:
+    build = sized_build(1500, 20)
+    estimate = 1500 * service.PRESOLVE_SECONDS_PER_CONSTRAINT
+
+    assert service.tune_solver_config({}, build, 10 * estimate)["presolve"] == "full"
+    assert service.tune_solver_config({}, build, 2 * estimate)["presolve"] == "light"
+    assert service.tune_solver_config({}, build, estimate)["presolve"] == "off"
+
+
+def test_solver_config_overrides_reach_the_solver() -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = {"solverConfig": {"workers": 3, "presolve": "off", "randomSeed": 7, "parameters": {"bogus": 1, "max_presolve_iterations": 2}}}
+    config = service.tune_solver_config(payload, sized_build(1500, 20), 10)
+    solver = cp_model.CpSolver()
+
+    rejected = service.apply_solver_config(solver, config, 10)
+
+    assert sorted(config["overrides"]) == ["parameters", "presolve", "randomSeed", "workers"]
+    assert rejected == ["bogus"]
+    assert solver.parameters.num_search_workers == 3
+    assert solver.parameters.cp_model_presolve is False
+    assert solver.parameters.random_seed == 7
+    assert solver.parameters.max_presolve_iterations == 2
+
+
+def test_deterministic_solver_config_is_reproducible() -> None:
+    pytest.importorskip("ortools")
+    # Sin el tope de pared (3× el presupuesto) solo manda el tiempo determinista, también en una máquina cargada.
+    config = {"workers": 2, "deterministic": True, "randomSeed": 5, "parameters": {"max_time_in_seconds": 60}}
+    payload = {**scenario(20, 3), "timeLimitSeconds": 0.2, "solverConfig": config}
+
+    first = service.solve_request(copy.deepcopy(payload))
+    second = service.solve_request(copy.deepcopy(payload))
+
+    assert (first["solverConfig"]["workers"], first["solverConfig"]["randomSeed"], first["solverConfig"]["deterministic"]) == (2, 5, True)
+    assert first["output"] == second["output"]
+
+
+# --- Resolución multiescala (`multiResolution`) ---
+
+
+def test_multi_resolution_refines_around_the_coarse_plan() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(20, 3), "timeLimitSeconds": 4, "multiResolution": True}
+
+    result = service.solve_request(payload)
+
+    stage = result["multiResolution"]
+    assert stage["coarse"]["status"] in ("OPTIMAL", "FEASIBLE")
+    assert stage["narrowedTasks"] == 20
+    assert stage["occupancyEncoding"] == "compact"
+    assert stage["fallback"] is False and stage["fineObjective"] <= stage["warmObjective"]
+    assert result["validation"]["result"]["valid"] is True
+    assert result["quality"]["improved"] is True
+
+
+def test_multi_resolution_falls_back_when_the_fine_plan_is_worse(monkeypatch) -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(20, 3), "timeLimitSeconds": 2, "multiResolution": True}
+    # Un plan de partida con un objetivo inalcanzable: cualquier refinado sale peor.
+    monkeypatch.setattr(service, "plan_objective", lambda ctx, build, starts: -1.0)
+
+    result = service.solve_request(payload)
+
+    assert result["multiResolution"]["fallback"] is True
+    assert any(d.startswith("multiResolutionFallback=fine:") and d.endswith(">warm:-1") for d in result["technicalDetails"])
+    assert result["output"]["plannedTasks"] == payload["warmStart"]["plannedTasks"]
+
+
+def test_multi_resolution_skips_a_coarse_grid_off_the_base_grid() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(20, 3), "timeLimitSeconds": 2, "multiResolution": {"coarseGridMinutes": 7}}
+
+    result = service.solve_request(payload)
+
+    assert "multiResolutionCoarse=SKIPPED" in result["technicalDetails"]
+    assert "narrowedTasks" not in result["multiResolution"]
+    assert result["validation"]["result"]["valid"] is True
+
+
+# --- Objetivo lexicográfico (`lexicographic`) ---
+
+
+def stage_terms_of_plan(payload: Dict[str, Any], planned: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Huecos vacíos de zona principal y makespan (en slots) de un plan, como los mide el modelo."""
+    cp_model = service.load_cp_model()
+    ctx, early = service.prepare_context(payload)
+    assert ctx is not None, early
+    build = service.build_model(cp_model, ctx)
+    occupied = service.compute_main_zone_occupied_slots(
+        payload["engineInput"], planned, ctx.work_start, ctx.work_start + ctx.horizon * ctx.grid, ctx.grid,
+    )
+    end = max(service.parse_hhmm(row["endPlanned"]) for row in planned)
+    return {
+        "mainZoneEmptySlots": build.occupancy.total_slots - occupied,
+        "makespan": -(-(end - ctx.work_start) // ctx.grid),
+    }
+
+
+@pytest.mark.parametrize("tasks, time_limit_seconds", [(10, 10), (40, 2)])
+def test_lexicographic_stages_bound_the_final_plan(tasks: int, time_limit_seconds: float) -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(tasks, 3), "timeLimitSeconds": time_limit_seconds, "lexicographic": True}
+
+    result = service.solve_request(payload)
+
+    stages = result["lexicographic"]["stages"]
+    assert [stage["terms"] for stage in stages[:2]] == [["mainZoneEmptySlots"], ["makespan"]]
+    for stage in stages[:-1]:
+        assert stage["fixed"] == ("equal" if stage["status"] == "OPTIMAL" else "upperBound")
+    terms = stage_terms_of_plan(payload, result["output"]["plannedTasks"])
+    for stage in stages[:2]:
+        name = stage["terms"][0]
+        if stage["fixed"] == "equal":
+            assert terms[name] == stage["value"], name
+        else:
+            assert terms[name] <= stage["value"], name
+    assert result["validation"]["result"]["valid"] is True
+
+
+# --- Captura y reproducción offline (`capture`, `replay_cp_sat.py`) ---
+
+
+def test_captured_request_replays_to_the_same_objective(tmp_path) -> None:
+    pytest.importorskip("ortools")
+    captures = tmp_path / "captures"
+    payload = {**scenario(10, 3), "timeLimitSeconds": 5, "stream": False, "capture": {"dir": str(captures)}}
+
+    result = service.solve_request(copy.deepcopy(payload))
+
+    assert result["capture"]["reasons"] == ["sampled"]
+    capture = Path(result["capture"]["path"])
+    assert {"request.json", "model.pb", "parameters.txt", "response.json", "meta.json"} <= {p.name for p in capture.iterdir()}
+    request = json.loads((capture / "request.json").read_text())
+    assert "stream" not in request and request["engineInput"] == payload["engineInput"]
+
+    runs = {}
+    for mode in ([], ["--model"]):
+        output = tmp_path / f"replay{len(mode)}.json"
+        assert replay_cp_sat.main([str(captures), *mode, "--output", str(output)]) == 0
+        runs[tuple(mode)] = json.loads(output.read_text())["runs"]
+    for replayed in runs.values():
+        assert len(replayed) == 1
+        run = replayed[0]
+        assert run["captured"]["status"] == run["replayed"]["status"] == "OPTIMAL"
+        assert run["delta"]["objective"] == 0 and run["delta"]["statusChanged"] is False
+
+
+# --- Capacidad acumulada (`resourcePools`, `spaceCapacityById`) y `color_units` ---
+
+
+def test_color_units_keeps_free_preferred_units_and_reports_conflicts() -> None:
+    # (inicio, fin, tid, demanda, preferidas, fija)
+    items = [(0, 10, 1, 1, [2], True), (5, 15, 2, 1, [2], False), (5, 15, 3, 1, [], False), (20, 30, 4, 1, [3], False)]
+
+    assigned, conflicts = service.color_units(items, [1, 2, 3])
+
+    assert assigned == {1: [2], 2: [1], 3: [3], 4: [3]}
+    assert conflicts == 0
+    crowded, conflicts = service.color_units(items + [(6, 9, 5, 1, [1], False)], [1, 2, 3])
+    assert conflicts == 1
+    assert crowded[5] == [1]
+
+
+def overlapping_pairs(rows: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    spans = [(service.parse_hhmm(row["startPlanned"]), service.parse_hhmm(row["endPlanned"]), row) for row in rows]
+    return [(a, b) for i, (s1, e1, a) in enumerate(spans) for s2, e2, b in spans[i + 1:] if s1 < e2 and s2 < e1]
+
+
+def test_cumulative_groups_share_capacity_with_distinct_units() -> None:
+    pytest.importorskip("ortools")
+    payload = validation_payload(spaceCapacityById={"1": 2}, resourcePools=[{"id": 9, "resourceIds": [101, 102]}])
+    rows = payload["warmStart"]["plannedTasks"]
+    # 1 y 2 a la vez en el espacio 1 (dos huecos); 3, 4 y 5 a la vez con la misma cámara del pool.
+    rows[1].update(startPlanned="09:00", endPlanned="09:30")
+    for row in rows[2:]:
+        row.update(startPlanned="09:30", endPlanned="10:00", assignedResources=[101])
+    payload["engineInput"]["tasks"][3]["dependsOnTaskIds"] = []
+
+    result = service.solve_request({**payload, "timeLimitSeconds": 5})
+
+    assert "cumulativeGroups=pool:9,space:1" in result["technicalDetails"]
+    assert result["cumulative"]["coloring"]["conflicts"] == 0
+    planned = result["output"]["plannedTasks"]
+    assert service.validate_plan(payload, planned)["valid"] is True
+    pairs = overlapping_pairs(planned)
+    assert any(a["assignedResources"] and b["assignedResources"] for a, b in pairs)
+    for a, b in pairs:
+        assert not set(a["assignedResources"]) & set(b["assignedResources"]), (a, b)
+        if a["assignedSpace"] == b["assignedSpace"] == 1:
+            assert {a["assignedSpaceSlot"], b["assignedSpaceSlot"]} == {1, 2}
+    assert all(set(row["assignedResources"]) <= {101, 102} for row in planned)
+
+
+# --- Búsqueda de vecindario grande (`lns`) ---
+
+
+def test_lns_improves_the_warm_start_score() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(60, 3), "timeLimitSeconds": 6, "lns": {"seed": 1}}
+
+    result = service.solve_request(payload)
+
+    lns = result["lns"]
+    assert lns["initial"] == "warmStart"
+    assert lns["accepted"] > 0
+    assert lns["finalScore"] < lns["initialScore"]
+    assert lns["finalScore"] == result["quality"]["optimizedScore"]
+    assert sum(kind["tried"] for kind in lns["kinds"].values()) == lns["neighborhoods"]
+    assert f"lnsAccepted={lns['accepted']}" in result["technicalDetails"]
+    assert result["validation"]["result"]["valid"] is True
+
+
+# --- Construcción ligera del modelo (`leanModel`) ---
+
+
+def exported_proto(model: Any, path: Path) -> Any:
+    """`CpModelProto` de protobuf del modelo, vía `ExportToFile` como en las capturas."""
+    from ortools.sat import cp_model_pb2
+
+    assert model.ExportToFile(str(path))
+    proto = cp_model_pb2.CpModelProto()
+    proto.ParseFromString(path.read_bytes())
+    return proto
+
+
+@pytest.mark.parametrize("encoding", ["cover", "compact"])
+def test_lean_model_is_the_named_model_without_names(encoding: str, tmp_path) -> None:
+    pytest.importorskip("ortools")
+    cp_model = service.load_cp_model()
+    payload = {**scenario(20, 3), "occupancyEncoding": encoding}
+    protos = {}
+    for lean in (False, True):
+        ctx, early = service.prepare_context({**payload, "leanModel": lean})
+        assert ctx is not None, early
+        protos[lean] = exported_proto(service.build_model(cp_model, ctx).model, tmp_path / f"{lean}.pb")
+
+    named, lean = protos[False], protos[True]
+    assert all(not variable.name for variable in lean.variables)
+    assert all(variable.name for variable in named.variables)
+    for variable in named.variables:
+        variable.name = ""
+    for constraint in [*named.constraints, *lean.constraints]:
+        constraint.name = ""
+    assert named.SerializeToString() == lean.SerializeToString()
+
+
+def test_lean_model_keeps_names_on_request_and_solves_the_same() -> None:
+    pytest.importorskip("ortools")
+    payload = {**scenario(10, 3), "timeLimitSeconds": 5}
+
+    lean = service.solve_request({**payload, "leanModel": True})
+    named = service.solve_request(payload)
+    debug_ctx, _ = service.prepare_context({**payload, "leanModel": True, "debugModelNames": True})
+
+    assert "leanModel=true:varNames=false" in lean["technicalDetails"]
+    assert debug_ctx.var_names is True
+    assert "status=CpSolverStatus.OPTIMAL" in lean["technicalDetails"]
+    assert lean["profile"]["solver"]["objective"] == named["profile"]["solver"]["objective"]
+    assert lean["output"] == named["output"]